@@ -1,7 +1,10 @@
 import os
 from datetime import datetime
-from src.portfolio import PortfolioManager
-from src.risk_engine import RiskEngine
+from src.models import SessionLocal
+from src.filtered_simulation import precompute_universe
+from src.risk_engine import calculate_grouped_risk_many
+from src.scoring import score_portfolios
+from src.snapshots import compute_risk_snapshot, list_portfolios, store_snapshot
 
 SAMPLE_PORTFOLIO = {'AAPL': 150, 'MSFT': 100, 'GOOG': 50, 'TSLA': 75}
 REPORT_OUTPUT_DIR = 'reports'
@@ -12,24 +15,20 @@ def generate_report():
     """
     print('Starting daily risk report generation...')
 
+    print('Calculating market value, VaR and ES...')
     try:
-        pm = PortfolioManager(SAMPLE_PORTFOLIO)
-        risk_engine = RiskEngine(pm)
-    except Exception as e:
-        print(f'Error initializing portfolio/risk engine: {e}')
-        return
-
-    print('Calculating market value and VaR...')
-    try:
-        total_value = pm.calculate_total_market_value()
-        var_value, _ = risk_engine.calculate_historical_var()
+        snapshot = compute_risk_snapshot(SAMPLE_PORTFOLIO)
     except Exception as e:
         print(f'Error during risk calculation: {e}')
         return
 
+    total_value = snapshot['total_market_value']
+    var_value = snapshot['var']
+    es_value = snapshot['es']
+
     print('Formatting the report...')
     today_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
+
     report_content = f"""
 # Daily Risk Report
 
@@ -44,6 +43,7 @@ This report summarizes the key risk metrics for the firm's sample portfolio.
 - **Portfolio:** `{', '.join(SAMPLE_PORTFOLIO.keys())}`
 - **Total Market Value:** `${total_value:,.2f}`
 - **95% Historical VaR (1-day):** `${var_value:,.2f}`
+- **95% Expected Shortfall (1-day):** `${es_value:,.2f}`
 
 ---
 
@@ -51,21 +51,132 @@ This report summarizes the key risk metrics for the firm's sample portfolio.
 
 The 95% Value at Risk (VaR) of **${var_value:,.2f}** signifies that we can be 95% confident that the portfolio will not lose more than this amount over a one-day period, based on historical data from the last 252 trading days.
 
+On the days that were worse than that, the average loss (the Expected Shortfall) was **${es_value:,.2f}**.
+
 """
 
     try:
         if not os.path.exists(REPORT_OUTPUT_DIR):
             os.makedirs(REPORT_OUTPUT_DIR)
-        
+
         report_filename = os.path.join(REPORT_OUTPUT_DIR, 'daily_risk_report.md')
         with open(report_filename, 'w') as f:
             f.write(report_content)
-        
+
         print(f'Successfully generated report: {report_filename}')
 
     except IOError as e:
         print(f'Error writing report to file: {e}')
 
 
+def generate_snapshots(compute=compute_risk_snapshot):
+    """
+    Precomputes risk snapshots for every saved portfolio, so the dashboard can
+    show them instantly the next day. One bad portfolio doesn't stop the rest.
+
+    Returns:
+        The number of snapshots written.
+    """
+    print('Starting nightly risk snapshots...')
+    db = SessionLocal()
+    written = 0
+    try:
+        as_of = datetime.now()
+        portfolios = list_portfolios(db)
+        for portfolio in portfolios:
+            try:
+                store_snapshot(db, portfolio, compute(portfolio.holdings), as_of=as_of)
+                written += 1
+            except Exception as e:
+                db.rollback()
+                print(f"  Could not snapshot '{portfolio.name}'. Error: {e}")
+        print(f'Wrote {written} of {len(portfolios)} snapshots.')
+    finally:
+        db.close()
+    return written
+
+
+def generate_firm_rollup(group_by='listing_exchange', rollup=calculate_grouped_risk_many):
+    """
+    Breaks every saved portfolio's risk down by group, plus the firm-wide
+    total, in one batch, and writes it to reports/firm_rollup.csv.
+
+    Returns:
+        The rollup DataFrame, or None if there was nothing to roll up.
+    """
+    print('Rolling up risk across saved portfolios...')
+    db = SessionLocal()
+    try:
+        portfolios = {p.name: p.holdings for p in list_portfolios(db)}
+    finally:
+        db.close()
+    if not portfolios:
+        print('No saved portfolios to roll up.')
+        return None
+
+    try:
+        rollup_df = rollup(portfolios, group_by=group_by)
+    except Exception as e:
+        print(f'Error during firm rollup: {e}')
+        return None
+
+    os.makedirs(REPORT_OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(REPORT_OUTPUT_DIR, 'firm_rollup.csv')
+    rollup_df.to_csv(path)
+    print(f'Rolled up {len(portfolios)} portfolios into {path}')
+    return rollup_df
+
+
+def generate_portfolio_scores(score=score_portfolios):
+    """
+    Scores every saved portfolio (value, VaR, ES, stress P/L) with the sharded
+    scoring workers and writes reports/portfolio_scores.csv.
+
+    Returns:
+        The scores DataFrame, or None if there was nothing to score.
+    """
+    print('Scoring saved portfolios...')
+    db = SessionLocal()
+    try:
+        portfolios = [{'id': p.name, 'holdings': p.holdings} for p in list_portfolios(db)]
+    finally:
+        db.close()
+    if not portfolios:
+        print('No saved portfolios to score.')
+        return None
+
+    try:
+        scores = score(portfolios)
+    except Exception as e:
+        print(f'Error during portfolio scoring: {e}')
+        return None
+
+    os.makedirs(REPORT_OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(REPORT_OUTPUT_DIR, 'portfolio_scores.csv')
+    scores.to_csv(path)
+    print(f'Scored {len(scores)} portfolios into {path}')
+    return scores
+
+
+def generate_filtered_simulation():
+    """
+    Fits the EWMA and GARCH volatility filters for the whole universe and
+    caches the residuals on disk, so filtered-VaR requests the next day don't
+    refit anything.
+    """
+    print('Fitting volatility filters for filtered historical simulation...')
+    try:
+        timings = precompute_universe()
+    except Exception as e:
+        print(f'Error fitting volatility filters: {e}')
+        return
+    for method, seconds in timings.items():
+        print(f'  {method}: {seconds:.1f}s')
+
+
 if __name__ == '__main__':
-    generate_report()
\ No newline at end of file
+    generate_filtered_simulation()
+    generate_report()
+    generate_snapshots()
+    generate_firm_rollup()
+    generate_portfolio_scores()
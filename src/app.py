@@ -1,29 +1,58 @@
 import json
+import hashlib
+import threading
 import requests
-import pandas as pd
 import numpy as np
-import plotly.express as px
-import plotly.figure_factory as ff
-from flask import Flask, request, jsonify
-from dash import Dash, dcc, html, Input, Output, State, callback_context, ALL
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import Flask, Response, request, jsonify, stream_with_context
+from dash import Dash, dcc, html, Input, Output, State, ClientsideFunction, callback_context, ALL, no_update
 
 from src.portfolio import PortfolioManager
-from src.risk_engine import RiskEngine
-from src.models import get_all_tickers
+from src.filtered_simulation import FILTER_METHODS
+from src.risk_engine import RiskEngine, bin_pl_distribution, calculate_grouped_risk_many, expected_shortfall
+from src.models import SavedPortfolio, get_all_tickers, get_db
+from src.live_feed import LiveFeed, LiveRiskBook, stream_book_events
+from src.return_matrix import memory_footprint
+from src.screening import SCREEN_METRICS, get_screener
+from src.snapshots import save_portfolio, list_portfolios, get_portfolio_risk
 
 # TODO: Maybe split this into two files later? One for the Flask API and one for the Dash app.
 # For now, keeping it simple.
 server = Flask(__name__)
 
+# Open live books and their subscribers. This lives in the web process's memory,
+# so it only works with a single server process (which is what we run anyway).
+live_feed = LiveFeed()
+
+@contextmanager
+def db_session():
+    """
+    A session from `get_db` that stays open for the whole `with` block.
+    `next(get_db())` on its own lets the session be garbage collected as soon
+    as the call it's passed to returns, detaching everything it loaded.
+    """
+    yield from get_db()
+
+# Plain historical simulation, or filtered historical simulation with one of the volatility filters.
+RISK_METHODS = ('historical',) + FILTER_METHODS
+
 @server.route('/api/risk', methods=['POST'])
 def calculate_risk():
-    """API endpoint to calculate risk for a given portfolio."""
+    """
+    API endpoint to calculate risk for a given portfolio. Pass "method": "ewma"
+    or "garch" for filtered historical simulation instead of plain historical.
+    """
     data = request.get_json()
     
     # Basic input validation
     if not data or 'portfolio' not in data or not data['portfolio']:
         return jsonify({"error": "Portfolio data is missing or empty."}), 400
 
+    method = data.get('method', 'historical')
+    if method not in RISK_METHODS:
+        return jsonify({"error": f"Unknown method '{method}'. Expected one of {list(RISK_METHODS)}."}), 400
+
     try:
         portfolio_dict = data['portfolio']
         
@@ -37,15 +66,23 @@ def calculate_risk():
         if total_value == 0:
              return jsonify({"error": "Could not find market data for any of the selected tickers."}), 400
 
-        var_value, simulated_pl = risk_engine.calculate_historical_var()
+        if method == 'historical':
+            var_value, simulated_pl = risk_engine.calculate_historical_var()
+        else:
+            var_value, simulated_pl = risk_engine.calculate_filtered_var(method=method)
         
         # Let's build the response. If something is None or NaN, we'll just pass it as null.
         response_data = {
+            "method": method,
             "total_market_value": float(total_value),
             "var": float(var_value) if var_value is not None and not np.isnan(var_value) else None,
+            "es": expected_shortfall(simulated_pl),
             "market_values_per_stock": {str(k): float(v) for k, v in pm.market_values.items()},
-            "simulated_pl": [float(x) for x in simulated_pl]
+            "pl_histogram": bin_pl_distribution(simulated_pl)
         }
+        # The dashboard only needs the histogram, so it can skip the full P/L vector.
+        if data.get('include_simulated_pl', True):
+            response_data["simulated_pl"] = [float(x) for x in simulated_pl]
 
         return jsonify(response_data)
 
@@ -54,6 +91,250 @@ def calculate_risk():
         # This is better than letting it crash and show a generic server error.
         return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
 
+def holdings_error(holdings):
+    """An error message if `holdings` isn't a non-empty {ticker: quantity} dict, else None."""
+    if not isinstance(holdings, dict) or not holdings or not all(
+        isinstance(t, str) and isinstance(q, (int, float)) and not isinstance(q, bool) for t, q in holdings.items()
+    ):
+        return "Holdings must be a non-empty object mapping tickers to numeric quantities."
+    return None
+
+def tags_error(tags):
+    """An error message if `tags` isn't a {ticker: tag} dict of strings, else None."""
+    if tags is None:
+        return None
+    if not isinstance(tags, dict) or not all(isinstance(k, str) and isinstance(v, str) for k, v in tags.items()):
+        return "'tags' must be an object mapping tickers to tag names."
+    return None
+
+def rollup_to_dict(rollup_df) -> dict:
+    """{group: {column: value}} for a rollup DataFrame indexed by group."""
+    return {
+        str(group): {col: float(val) for col, val in row.items()}
+        for group, row in rollup_df.iterrows()
+    }
+
+@server.route('/api/risk/rollup', methods=['POST'])
+def calculate_risk_rollup():
+    """API endpoint to break a portfolio's risk down by exchange, category or custom tag."""
+    data = request.get_json()
+
+    if not data or 'portfolio' not in data or not data['portfolio']:
+        return jsonify({"error": "Portfolio data is missing or empty."}), 400
+
+    group_by = data.get('group_by', 'listing_exchange')
+    tags = data.get('tags')
+    if tags_error(tags):
+        return jsonify({"error": tags_error(tags)}), 400
+
+    try:
+        pm = PortfolioManager(data['portfolio'])
+        risk_engine = RiskEngine(pm)
+        rollup_df = risk_engine.calculate_grouped_risk(group_by=group_by, tags=tags)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
+
+    return jsonify({
+        "group_by": "tags" if tags is not None else group_by,
+        "groups": rollup_to_dict(rollup_df)
+    })
+
+@server.route('/api/risk/rollup/batch', methods=['POST'])
+def calculate_risk_rollup_batch():
+    """
+    Rolls up many portfolios in one go, plus the firm-wide total. Expects
+    {"portfolios": {name: {ticker: qty}}, "group_by": ..., "tags": ...}.
+    """
+    data = request.get_json()
+
+    portfolios = (data or {}).get('portfolios')
+    if not isinstance(portfolios, dict) or not portfolios or any(holdings_error(h) for h in portfolios.values()):
+        return jsonify({"error": "'portfolios' must map names to non-empty {ticker: quantity} objects."}), 400
+
+    group_by = data.get('group_by', 'listing_exchange')
+    tags = data.get('tags')
+    if tags_error(tags):
+        return jsonify({"error": tags_error(tags)}), 400
+
+    try:
+        rollup_df = calculate_grouped_risk_many(portfolios, group_by=group_by, tags=tags)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
+
+    return jsonify({
+        "group_by": "tags" if tags is not None else group_by,
+        "portfolios": {
+            str(name): rollup_to_dict(rollup_df.xs(name, level='portfolio'))
+            for name in rollup_df.index.get_level_values('portfolio').unique()
+        }
+    })
+
+@server.route('/api/live/books', methods=['POST'])
+def open_live_book():
+    """Seeds an in-memory book for a portfolio so it can be updated from live ticks."""
+    data = request.get_json()
+
+    if not data or 'portfolio' not in data or not data['portfolio']:
+        return jsonify({"error": "Portfolio data is missing or empty."}), 400
+
+    try:
+        pm = PortfolioManager(data['portfolio'])
+        book = LiveRiskBook.from_risk_engine(RiskEngine(pm))
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
+
+    if not book.tickers:
+        return jsonify({"error": "Could not find market data for any of the selected tickers."}), 400
+
+    book_id = live_feed.open_book(book)
+    return jsonify({"book_id": book_id, **book.snapshot()})
+
+@server.route('/api/live/books/<book_id>', methods=['DELETE'])
+def close_live_book(book_id):
+    """Drops a live book."""
+    live_feed.close_book(book_id)
+    return jsonify({"closed": book_id})
+
+@server.route('/api/live/books/<book_id>/events')
+def live_book_events(book_id):
+    """Server-Sent Events stream of value/VaR updates for one book."""
+    if book_id not in live_feed.books:
+        return jsonify({"error": f"Unknown live book '{book_id}'."}), 404
+    return Response(
+        stream_with_context(stream_book_events(live_feed, book_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@server.route('/api/ticks', methods=['POST'])
+def ingest_ticks():
+    """Ingest endpoint for live prices. Expects {"ticks": [{"ticker": ..., "price": ...}, ...]}."""
+    data = request.get_json()
+
+    if not data or not isinstance(data.get('ticks'), list):
+        return jsonify({"error": "A 'ticks' list is required."}), 400
+
+    try:
+        touched = live_feed.ingest(data['ticks'])
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid tick: {e}"}), 400
+
+    return jsonify({"ticks": len(data['ticks']), "books_updated": len(touched)})
+
+@server.route('/api/screen', methods=['GET'])
+def screen_tickers():
+    """
+    Screens the universe on precomputed stats, e.g.
+    /api/screen?max_volatility=0.3&min_return_1y=0.1&sort_by=beta&order=desc&limit=20&etf=false
+    """
+    try:
+        filters = {}
+        for metric in SCREEN_METRICS:
+            low = request.args.get(f'min_{metric}', type=float)
+            high = request.args.get(f'max_{metric}', type=float)
+            if low is not None or high is not None:
+                filters[metric] = (low, high)
+
+        etf = request.args.get('etf')
+        etf = None if etf is None else etf.lower() in ('1', 'true', 'yes')
+        limit = request.args.get('limit', 50, type=int)
+        if limit < 1:
+            raise ValueError("limit must be at least 1.")
+        limit = min(limit, 1000)
+
+        with db_session() as db:
+            screener = get_screener(db)
+        results = screener.screen(
+            filters,
+            sort_by=request.args.get('sort_by', 'volatility'),
+            descending=request.args.get('order', 'asc').lower() == 'desc',
+            limit=limit,
+            etf=etf
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
+
+    # NaN isn't valid JSON, so missing stats go out as null.
+    rows = json.loads(results.reset_index().to_json(orient='records', date_format='iso'))
+    return jsonify({"count": len(rows), "results": rows})
+
+def portfolio_to_dict(portfolio: SavedPortfolio) -> dict:
+    """The JSON form of a saved portfolio, as returned by /api/portfolios."""
+    return {
+        "id": portfolio.id,
+        "name": portfolio.name,
+        "holdings": portfolio.holdings,
+        "holdings_hash": portfolio.holdings_hash,
+        "updated_at": portfolio.updated_at.isoformat(),
+    }
+
+@server.route('/api/portfolios', methods=['GET'])
+def get_saved_portfolios():
+    """Lists the saved portfolios."""
+    try:
+        with db_session() as db:
+            portfolios = [portfolio_to_dict(p) for p in list_portfolios(db)]
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
+    return jsonify({"portfolios": portfolios})
+
+@server.route('/api/portfolios', methods=['POST'])
+def create_saved_portfolio():
+    """Saves a portfolio under a name. Saving under an existing name replaces its holdings."""
+    data = request.get_json(silent=True)
+
+    if not isinstance(data, dict) or not isinstance(data.get('name'), str) or not data['name'].strip():
+        return jsonify({"error": "A non-empty 'name' string is required."}), 400
+    if holdings_error(data.get('portfolio')):
+        return jsonify({"error": f"'portfolio': {holdings_error(data.get('portfolio'))}"}), 400
+
+    try:
+        with db_session() as db:
+            # Built inside the block: after the commit the row has to be
+            # reloaded, which needs the session still open.
+            portfolio = portfolio_to_dict(save_portfolio(db, data['name'], data['portfolio']))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
+
+    return jsonify(portfolio)
+
+@server.route('/api/portfolios/<int:portfolio_id>/risk', methods=['GET', 'POST'])
+def saved_portfolio_risk(portfolio_id):
+    """
+    Risk for a saved portfolio. Served from the nightly snapshot when the
+    holdings haven't changed; POST the current holdings as {"portfolio": ...}
+    and they're computed live if they differ from what was saved. Neither
+    method stores anything (see `automate_report.generate_snapshots`).
+    """
+    data = request.get_json(silent=True) or {}
+
+    with db_session() as db:
+        portfolio = db.get(SavedPortfolio, portfolio_id)
+        if portfolio is None:
+            return jsonify({"error": f"Unknown portfolio {portfolio_id}."}), 404
+
+        try:
+            result = get_portfolio_risk(db, portfolio, holdings=data.get('portfolio'))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
+
+        return jsonify({"portfolio_id": portfolio.id, "name": portfolio.name, "holdings": portfolio.holdings, **result})
+
+@server.route('/api/memory', methods=['GET'])
+def report_memory():
+    """Reports this server process's memory footprint."""
+    return jsonify(memory_footprint())
+
 # --- DASH APP ---
 # We're running the Dash app on top of our Flask server.
 app = Dash(__name__, server=server, url_base_pathname='/dash/')
@@ -69,6 +350,17 @@ app.layout = html.Div(style={'backgroundColor': '#f0f2f5', 'fontFamily': 'Arial'
         html.Div(style={'flex': '30%', 'padding': '10px', 'position': 'sticky', 'top': '20px', 'alignSelf': 'flex-start'}, children=[
             html.Div(style={'backgroundColor': 'white', 'padding': '20px', 'borderRadius': '5px'}, children=[
                 html.H4("Build Your Portfolio", style={'borderBottom': '1px solid #eee', 'paddingBottom': '10px'}),
+                html.Label("Load a saved portfolio:"),
+                dcc.Dropdown(
+                    id='saved-portfolio-selector',
+                    options=[],
+                    placeholder="Pick a saved portfolio...",
+                    style={'marginBottom': '15px'}
+                ),
+                # Holdings of the portfolio that was just loaded, used to pre-fill the quantity inputs.
+                dcc.Store(id='loaded-holdings'),
+                # The live book behind the current results, so it can be closed on re-render.
+                dcc.Store(id='live-book-id'),
                 html.Label("Select stocks to include:"),
                 dcc.Dropdown(
                     id='ticker-selector',
@@ -77,10 +369,21 @@ app.layout = html.Div(style={'backgroundColor': '#f0f2f5', 'fontFamily': 'Arial'
                     placeholder="Search and select tickers..."
                 ),
                 html.Div(id='quantity-inputs', style={'marginTop': '20px'}),
+                dcc.Checklist(
+                    id='live-toggle',
+                    options=[{'label': ' Stream live updates', 'value': 'live'}],
+                    value=[],
+                    style={'marginTop': '20px'}
+                ),
                 html.Div(style={'display': 'flex', 'marginTop': '20px'}, children=[
                     html.Button('Analyze Portfolio', id='analyze-button', n_clicks=0, style={'flex': '60%', 'backgroundColor': '#1a3d6d', 'color': 'white', 'border': 'none', 'padding': '10px', 'cursor': 'pointer'}),
                     html.Button('Clear', id='clear-button', n_clicks=0, style={'flex': '40%', 'marginLeft': '10px', 'backgroundColor': '#6c757d', 'color': 'white', 'border': 'none', 'padding': '10px', 'cursor': 'pointer'})
-                ])
+                ]),
+                html.Div(style={'display': 'flex', 'marginTop': '10px'}, children=[
+                    dcc.Input(id='portfolio-name', type='text', placeholder='Name this portfolio...', style={'flex': '60%'}),
+                    html.Button('Save', id='save-button', n_clicks=0, style={'flex': '40%', 'marginLeft': '10px', 'backgroundColor': '#2e7d32', 'color': 'white', 'border': 'none', 'padding': '10px', 'cursor': 'pointer'})
+                ]),
+                html.Div(id='save-status', style={'marginTop': '5px', 'fontSize': '0.9em'})
             ])
         ]),
         
@@ -91,75 +394,217 @@ app.layout = html.Div(style={'backgroundColor': '#f0f2f5', 'fontFamily': 'Arial'
     ])
 ])
 
-@app.callback(
+# These two callbacks only shuffle UI elements around, so they run in the browser
+# (see assets/dashboard.js) instead of making a round trip to the server.
+app.clientside_callback(
+    ClientsideFunction(namespace='riskdash', function_name='generateQuantityInputs'),
     Output('quantity-inputs', 'children'),
-    Input('ticker-selector', 'value')
+    Input('ticker-selector', 'value'),
+    State('loaded-holdings', 'data')
 )
-def generate_quantity_inputs(selected_tickers):
-    """Creates the quantity input boxes when a user selects tickers."""
-    if not selected_tickers:
-        return []
-    
-    # A bit of a list comprehension to generate the inputs dynamically.
-    return [
-        html.Div(style={'display': 'flex', 'alignItems': 'center', 'marginTop': '10px'}, children=[
-            html.Label(f"{ticker}:", style={'flex': '30%'}),
-            dcc.Input(
-                id={'type': 'quantity-input', 'index': ticker},
-                type='number',
-                placeholder='Enter quantity...',
-                min=0,
-                style={'flex': '70%'}
-            )
-        ]) for ticker in selected_tickers
-    ]
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='riskdash', function_name='clearInputs'),
     Output('ticker-selector', 'value'),
     Output('quantity-inputs', 'children', allow_duplicate=True),
     Output('analysis-output', 'children', allow_duplicate=True),
+    Output('saved-portfolio-selector', 'value'),
+    Output('loaded-holdings', 'data', allow_duplicate=True),
     Input('clear-button', 'n_clicks'),
     prevent_initial_call=True
 )
-def clear_inputs(n_clicks):
-    """Clears all inputs when the 'Clear' button is clicked."""
-    return None, [], None
+
+# Figures are plain dicts (plotly.js draws them in the browser), cached by a
+# fingerprint of the results they show. Re-analysing the same portfolio skips
+# building them again. Dash callbacks run on Flask's request threads, so the
+# cache is only touched while holding its lock.
+FIGURE_CACHE_SIZE = 128
+_figure_cache = OrderedDict()
+_figure_cache_lock = threading.Lock()
+
+def result_fingerprint(data: dict) -> str:
+    """A stable hash of the parts of an API result that the charts depend on."""
+    relevant = {k: data.get(k) for k in ('var', 'market_values_per_stock', 'pl_histogram')}
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+def build_pie_figure(market_values: dict) -> dict:
+    """The risk concentration pie chart."""
+    return {
+        'data': [{'type': 'pie', 'labels': list(market_values.keys()), 'values': list(market_values.values())}],
+        'layout': {'title': {'text': 'Portfolio Composition by Market Value'}},
+    }
+
+def build_pl_figure(histogram: dict, var_value: float) -> dict:
+    """The P/L distribution, drawn as a smoothed density from pre-binned counts."""
+    edges = np.asarray(histogram['bin_edges'])
+    counts = np.asarray(histogram['counts'], dtype=float)
+    widths = np.diff(edges)
+    centers = (edges[:-1] + edges[1:]) / 2
+    density = counts / (counts.sum() * widths) if counts.sum() > 0 else counts
+
+    return {
+        'data': [{
+            'type': 'scatter', 'mode': 'lines', 'name': 'P/L',
+            'x': centers.tolist(), 'y': density.tolist(),
+            'line': {'shape': 'spline', 'color': '#1a3d6d'}, 'fill': 'tozeroy'
+        }],
+        'layout': {
+            'title': {'text': 'Distribution of Simulated Daily P/L'},
+            'xaxis': {'title': {'text': 'Simulated Daily Profit/Loss ($)'}, 'tickprefix': '$', 'tickformat': ',.0f'},
+            'yaxis': {'title': {'text': 'Probability Density'}},
+            'showlegend': False,
+            # The VaR line
+            'shapes': [{'type': 'line', 'x0': -var_value, 'x1': -var_value, 'yref': 'paper', 'y0': 0, 'y1': 1, 'line': {'color': 'red', 'dash': 'dash'}}],
+            'annotations': [{'x': -var_value, 'yref': 'paper', 'y': 1, 'text': f"VaR: ${-var_value:,.0f}", 'showarrow': False, 'xanchor': 'left'}],
+        },
+    }
+
+def get_figures(data: dict) -> dict:
+    """Returns the chart figures for an API result, from the cache if we've seen it before."""
+    key = result_fingerprint(data)
+    with _figure_cache_lock:
+        if key in _figure_cache:
+            _figure_cache.move_to_end(key)
+            return _figure_cache[key]
+
+    figures = {}
+    if data.get("market_values_per_stock"):
+        figures['pie'] = build_pie_figure(data['market_values_per_stock'])
+    if data.get("pl_histogram") and data['pl_histogram'].get('counts'):
+        figures['pl'] = build_pl_figure(data['pl_histogram'], data.get("var") or 0)
+
+    # Built outside the lock; if two threads race on the same key, the
+    # figures are identical and the second write is harmless.
+    with _figure_cache_lock:
+        _figure_cache[key] = figures
+        _figure_cache.move_to_end(key)
+        while len(_figure_cache) > FIGURE_CACHE_SIZE:
+            _figure_cache.popitem(last=False)
+    return figures
+
+def portfolio_from_inputs(input_ids, input_values) -> dict:
+    """Turns the dynamic quantity inputs into a {ticker: quantity} dict."""
+    # This feels a bit clunky, but it's how Dash gets data from dynamic inputs.
+    return {
+        p_id['index']: p_val
+        for p_id, p_val in zip(input_ids, input_values)
+        if p_val is not None and p_val > 0
+    }
 
 @app.callback(
     Output('analysis-output', 'children'),
+    Output('live-book-id', 'data'),
     Input('analyze-button', 'n_clicks'),
     State('ticker-selector', 'value'),
     State({'type': 'quantity-input', 'index': ALL}, 'id'),
     State({'type': 'quantity-input', 'index': ALL}, 'value'),
+    State('live-toggle', 'value'),
+    State('saved-portfolio-selector', 'value'),
+    State('live-book-id', 'data'),
     prevent_initial_call=True
 )
-def update_dashboard(n_clicks, selected_tickers, input_ids, input_values):
+def update_dashboard(n_clicks, selected_tickers, input_ids, input_values, live_toggle=None, saved_portfolio_id=None, previous_book_id=None):
     """The main callback that fires when the 'Analyze' button is clicked."""
+    # The old results (and their live book) are about to be replaced.
+    if previous_book_id:
+        live_feed.close_book(previous_book_id)
+
     if not selected_tickers or not any(input_values):
-        return html.Div("Please select some stocks and enter quantities.", style={'color': 'red'})
+        return html.Div("Please select some stocks and enter quantities.", style={'color': 'red'}), None
 
-    # This feels a bit clunky, but it's how Dash gets data from dynamic inputs.
-    portfolio = {
-        p_id['index']: p_val
-        for p_id, p_val in zip(input_ids, input_values)
-        if p_val is not None and p_val > 0
-    }
+    portfolio = portfolio_from_inputs(input_ids, input_values)
 
     if not portfolio:
-        return html.Div("Please enter a quantity for at least one stock.", style={'color': 'red'})
+        return html.Div("Please enter a quantity for at least one stock.", style={'color': 'red'}), None
 
     # The Dash app calls its own underlying Flask server.
     # This is a bit weird, but it cleanly separates the UI from the API.
-    api_url = f"{request.host_url.strip('/')}/api/risk"
+    # For a saved portfolio we go through its snapshot endpoint, which only
+    # recomputes if the quantities on screen differ from what was saved.
+    if saved_portfolio_id is not None:
+        api_url = f"{request.host_url.strip('/')}/api/portfolios/{saved_portfolio_id}/risk"
+    else:
+        api_url = f"{request.host_url.strip('/')}/api/risk"
     try:
-        response = requests.post(api_url, json={'portfolio': portfolio}, timeout=30)
+        response = requests.post(api_url, json={'portfolio': portfolio, 'include_simulated_pl': False}, timeout=30)
         response.raise_for_status()  # Raises an exception for bad status codes (4xx or 5xx)
         data = response.json()
     except requests.exceptions.RequestException as e:
-        return html.Div(f"Error connecting to the backend API: {e}", style={'color': 'red'})
+        return html.Div(f"Error connecting to the backend API: {e}", style={'color': 'red'}), None
+
+    return render_analysis(data, portfolio, live_toggle)
+
+@app.callback(
+    Output('loaded-holdings', 'data'),
+    Output('ticker-selector', 'value', allow_duplicate=True),
+    Output('analysis-output', 'children', allow_duplicate=True),
+    Output('live-book-id', 'data', allow_duplicate=True),
+    Input('saved-portfolio-selector', 'value'),
+    State('live-book-id', 'data'),
+    prevent_initial_call=True
+)
+def load_saved_portfolio(saved_portfolio_id, previous_book_id=None):
+    """Fills in the form for a saved portfolio and shows its last snapshot straight away."""
+    if saved_portfolio_id is None:
+        return no_update, no_update, no_update, no_update
+    if previous_book_id:
+        live_feed.close_book(previous_book_id)
 
+    api_url = f"{request.host_url.strip('/')}/api/portfolios/{saved_portfolio_id}/risk"
+    try:
+        response = requests.get(api_url, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+    except requests.exceptions.RequestException as e:
+        return no_update, no_update, html.Div(f"Error connecting to the backend API: {e}", style={'color': 'red'}), None
+
+    holdings = data.get('holdings') or {}
+    children, book_id = render_analysis(data, holdings)
+    return holdings, list(holdings.keys()), children, book_id
+
+@app.callback(
+    Output('saved-portfolio-selector', 'options'),
+    Output('save-status', 'children'),
+    Input('save-button', 'n_clicks'),
+    State('portfolio-name', 'value'),
+    State({'type': 'quantity-input', 'index': ALL}, 'id'),
+    State({'type': 'quantity-input', 'index': ALL}, 'value')
+)
+def save_current_portfolio(n_clicks, name, input_ids, input_values):
+    """
+    Saves the portfolio on screen. Also runs on page load to fill in the
+    saved-portfolio list, so it talks to the database directly rather than
+    making an HTTP request back to this server.
+    """
+    status = ""
+    with db_session() as db:
+        if n_clicks:
+            portfolio = portfolio_from_inputs(input_ids, input_values)
+            if not name or not portfolio:
+                status = html.Span("Enter a name and at least one quantity to save.", style={'color': 'red'})
+            else:
+                try:
+                    save_portfolio(db, name, portfolio)
+                    status = html.Span(f"Saved '{name}'.", style={'color': '#2e7d32'})
+                except (TypeError, ValueError) as e:
+                    status = html.Span(f"Could not save: {e}", style={'color': 'red'})
+
+        try:
+            options = [{'label': p.name, 'value': p.id} for p in list_portfolios(db)]
+        except Exception:
+            return no_update, status
+    return options, status
+
+def render_analysis(data: dict, portfolio: dict, live_toggle=None):
+    """
+    Builds the results section from an /api/risk-shaped response.
+
+    Returns:
+        The children for 'analysis-output' and the id of the live book it
+        opened (None unless live updates are on).
+    """
     if 'error' in data:
-        return html.Div(f"API Error: {data['error']}", style={'color': 'red'})
+        return html.Div(f"API Error: {data['error']}", style={'color': 'red'}), None
 
     # A little config to make the graphs cleaner
     graph_config = {
@@ -168,6 +613,8 @@ def update_dashboard(n_clicks, selected_tickers, input_ids, input_values):
         'modeBarButtonsToRemove': ['zoom2d', 'pan2d', 'select2d', 'lasso2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d', 'resetScale2d']
     }
     
+    figures = get_figures(data)
+
     # --- Build the results section ---
     
     # 1. Key Metrics
@@ -178,38 +625,46 @@ def update_dashboard(n_clicks, selected_tickers, input_ids, input_values):
         var_value = data['var']
         summary_children.append(html.H5(f"Value at Risk (95%, 1-day): ${var_value:,.2f}", style={'color': '#c0392b'}))
         summary_children.append(html.P("This is the estimated maximum loss the portfolio could experience in a single day, with 95% confidence.", style={'fontSize': '0.9em', 'fontStyle': 'italic'}))
+    if data.get("es") is not None:
+        summary_children.append(html.P(f"Expected Shortfall (95%, 1-day): ${data['es']:,.2f}", style={'color': '#c0392b'}))
+    if data.get("source") == "snapshot" and data.get("as_of"):
+        summary_children.append(html.P(f"From the nightly snapshot of {data['as_of'][:16].replace('T', ' ')}.", style={'fontSize': '0.8em', 'color': '#6c757d'}))
     
     # 2. Risk Concentration Pie Chart
-    if data.get("market_values_per_stock"):
+    if 'pie' in figures:
         summary_children.append(html.H4("2. Risk Concentration", style={'borderBottom': '1px solid #eee', 'paddingBottom': '10px', 'marginTop': '20px'}))
         summary_children.append(html.P("This chart shows where your portfolio's value is concentrated.", style={'fontSize': '0.9em'}))
-        summary_children.append(dcc.Graph(
-            figure=px.pie(
-                pd.DataFrame(list(data['market_values_per_stock'].items()), columns=['Ticker', 'Market Value']),
-                values='Market Value', names='Ticker', title='Portfolio Composition by Market Value'
-            ),
-            config=graph_config
-        ))
+        summary_children.append(dcc.Graph(figure=figures['pie'], config=graph_config))
+
+    # Live updates: open a book on the server and let assets/live_updates.js
+    # subscribe to its SSE stream. Nothing here polls.
+    book_id = None
+    if live_toggle and 'live' in live_toggle:
+        try:
+            live_response = requests.post(f"{request.host_url.strip('/')}/api/live/books", json={'portfolio': portfolio}, timeout=30)
+            live_response.raise_for_status()
+            book_id = live_response.json()['book_id']
+            summary_children.insert(1, html.Div(id='live-metrics', **{'data-book-id': book_id}, style={'backgroundColor': '#eef4fb', 'padding': '10px', 'borderRadius': '5px'}, children=[
+                html.Strong("Live: "),
+                html.Span("Market Value $", style={'marginLeft': '5px'}), html.Span("-", className='live-value'),
+                html.Span(" | VaR (95%, 1-day) $"), html.Span("-", className='live-var'),
+                html.Span(" | Ticks: "), html.Span("0", className='live-ticks'),
+            ]))
+        except (requests.exceptions.RequestException, KeyError) as e:
+            summary_children.insert(1, html.P(f"Live updates unavailable: {e}", style={'color': '#c0392b'}))
 
     summary_tab = dcc.Tab(label='Risk Summary', children=html.Div(summary_children, style={'padding': '10px'}))
 
     # 3. P/L Simulation Plot
     pl_children = []
-    if data.get("simulated_pl"):
-        var_value = data.get("var") or 0
-        # Create the density plot
-        fig = ff.create_distplot([data["simulated_pl"]], ['P/L'], show_hist=False, show_rug=False, colors=['#1a3d6d'])
-        fig.update_layout(title_text='Distribution of Simulated Daily P/L', xaxis_title='Simulated Daily Profit/Loss ($)', yaxis_title='Probability Density', xaxis_tickprefix='$', xaxis_tickformat=',.0f')
-        # Add a line for the VaR
-        fig.add_vline(x=-var_value, line_dash="dash", line_color="red", annotation_text=f"VaR: ${-var_value:,.0f}")
-        
+    if 'pl' in figures:
         pl_children.append(html.H4("3. Profit/Loss Simulation", style={'borderBottom': '1px solid #eee', 'paddingBottom': '10px'}))
         pl_children.append(html.P("This smooth curve shows the likelihood of different daily outcomes. The peak is the most likely result, and the left tail shows the risk of losses.", style={'fontSize': '0.9em'}))
-        pl_children.append(dcc.Graph(figure=fig, config=graph_config))
+        pl_children.append(dcc.Graph(figure=figures['pl'], config=graph_config))
     
     pl_tab = dcc.Tab(label='P/L Analysis', children=html.Div(pl_children, style={'padding': '10px'}))
 
-    return dcc.Tabs([summary_tab, pl_tab])
+    return dcc.Tabs([summary_tab, pl_tab]), book_id
 
 if __name__ == '__main__':
     # Setting debug=True is great for development, but should be False in production.
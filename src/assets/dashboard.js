@@ -0,0 +1,49 @@
+// Clientside versions of the dashboard's pure UI callbacks.
+//
+// Neither of these needs any data from the server, so running them in the
+// browser saves a round trip (and a bit of server CPU) every time the ticker
+// selection changes or the form is cleared. Components are returned in Dash's
+// JSON form: {namespace, type, props}.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    riskdash: {
+        generateQuantityInputs: function (selectedTickers, loadedHoldings) {
+            if (!selectedTickers || selectedTickers.length === 0) {
+                return [];
+            }
+            // When a saved portfolio was just loaded, pre-fill its quantities.
+            var holdings = loadedHoldings || {};
+            return selectedTickers.map(function (ticker) {
+                return {
+                    namespace: 'dash_html_components',
+                    type: 'Div',
+                    props: {
+                        style: {display: 'flex', alignItems: 'center', marginTop: '10px'},
+                        children: [
+                            {
+                                namespace: 'dash_html_components',
+                                type: 'Label',
+                                props: {children: ticker + ':', style: {flex: '30%'}}
+                            },
+                            {
+                                namespace: 'dash_core_components',
+                                type: 'Input',
+                                props: {
+                                    id: {type: 'quantity-input', index: ticker},
+                                    type: 'number',
+                                    placeholder: 'Enter quantity...',
+                                    value: holdings.hasOwnProperty(ticker) ? holdings[ticker] : null,
+                                    min: 0,
+                                    style: {flex: '70%'}
+                                }
+                            }
+                        ]
+                    }
+                };
+            });
+        },
+
+        clearInputs: function (nClicks) {
+            return [null, [], null, null, null];
+        }
+    }
+});
@@ -0,0 +1,56 @@
+// Dash serves everything in assets/ automatically, so this gets loaded on every page.
+//
+// When the analysis output contains a #live-metrics element (only when "Stream
+// live updates" is ticked), we open a Server-Sent Events connection for its book
+// and write the pushed numbers straight into the page. No Dash callbacks or
+// polling involved.
+(function () {
+    var source = null;
+    var currentBook = null;
+
+    function formatMoney(value) {
+        if (value === null || value === undefined) {
+            return 'n/a';
+        }
+        return value.toLocaleString(undefined, {minimumFractionDigits: 2, maximumFractionDigits: 2});
+    }
+
+    function disconnect() {
+        if (source) {
+            source.close();
+        }
+        source = null;
+        currentBook = null;
+    }
+
+    function connect(element) {
+        var bookId = element.getAttribute('data-book-id');
+        if (!bookId || bookId === currentBook) {
+            return;
+        }
+        disconnect();
+        currentBook = bookId;
+        source = new EventSource('/api/live/books/' + bookId + '/events');
+        source.onmessage = function (event) {
+            var data = JSON.parse(event.data);
+            var target = document.getElementById('live-metrics');
+            if (!target) {
+                disconnect();
+                return;
+            }
+            target.querySelector('.live-value').textContent = formatMoney(data.total_market_value);
+            target.querySelector('.live-var').textContent = formatMoney(data['var']);
+            target.querySelector('.live-ticks').textContent = data.ticks_applied;
+        };
+    }
+
+    // The analysis output is re-rendered by Dash, so watch for the element coming and going.
+    new MutationObserver(function () {
+        var element = document.getElementById('live-metrics');
+        if (element) {
+            connect(element);
+        } else if (source) {
+            disconnect();
+        }
+    }).observe(document.documentElement, {childList: true, subtree: true});
+})();
@@ -0,0 +1,352 @@
+"""
+Filtered historical simulation (FHS), vectorized across the whole universe.
+
+Plain historical simulation replays last year's returns as they were, so a
+calm portfolio in a volatile market (or the other way round) gets the wrong
+VaR. FHS fixes that per ticker:
+  1. estimate each day's volatility with EWMA or GARCH(1,1)
+  2. divide it out to get devolatilized residuals, z_t = r_t / sigma_t
+  3. rescale the residuals by today's volatility forecast, r*_t = z_t * sigma_T+1
+
+Everything runs on (dates x tickers) arrays. The volatility recursions loop
+over dates, never over tickers, and GARCH is fitted for all tickers at once by
+evaluating the likelihood on a shared parameter grid and then refining each
+ticker's own best point. Fitted residuals are cached in-process and can be
+written to disk by the nightly batch, so requests don't refit anything.
+
+In a universe matrix each ticker has NaNs before it listed. The filters skip
+those days (a ticker's variance sits at its seed until its first return), so
+every ticker is fitted on its own history rather than the youngest ticker's.
+"""
+import hashlib
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+from scipy.signal import lfilter
+
+from .return_matrix import ReturnMatrix
+
+FILTER_METHODS = ('ewma', 'garch')
+EWMA_LAMBDA = 0.94  # The RiskMetrics daily decay.
+FHS_DAYS = 500  # GARCH needs a couple of years of history to fit sensibly.
+# Tickers with fewer returns than this are left out of the universe fit, and
+# portfolios holding them get a portfolio-sized fit instead.
+FHS_MIN_DAYS = 60
+
+# Keeps a zero-variance ticker (e.g. one that stopped trading and was
+# forward-filled) from dividing by zero.
+MIN_VARIANCE = 1e-12
+
+
+def _squared_returns(returns: np.ndarray):
+    """
+    Squared returns, each column's mean squared return over the days it has
+    data, and a mask of those days (None if every day has data).
+    """
+    r2 = np.square(returns, dtype=float)
+    valid = ~np.isnan(r2)
+    if valid.all():
+        return r2, r2.mean(axis=0), None
+    with warnings.catch_warnings():
+        # A column with no returns at all just gets NaN.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        seed = np.nanmean(r2, axis=0)
+    return r2, seed, valid
+
+
+def ewma_variance(returns: np.ndarray, lam=EWMA_LAMBDA) -> np.ndarray:
+    """
+    EWMA variance for every column at once.
+
+    sigma2_t = lam * sigma2_t-1 + (1 - lam) * r2_t-1, seeded with each column's
+    mean squared return. Being a linear filter, it runs through `lfilter`.
+    Missing days are filled with the seed, which is the filter's fixed point,
+    so a ticker's variance stays at its seed until its first return.
+
+    Returns:
+        A (dates + 1 x tickers) array: row t is the variance for date t given
+        everything before it, and the last row is the forecast for the next day.
+    """
+    r2, seed, valid = _squared_returns(returns)
+    if valid is not None:
+        np.copyto(r2, np.broadcast_to(seed, r2.shape), where=~valid)
+    filtered, _ = lfilter([1 - lam], [1, -lam], r2, axis=0, zi=(lam * seed)[None, :])
+    return np.maximum(np.vstack([seed[None, :], filtered]), MIN_VARIANCE)
+
+
+def garch_variance(returns: np.ndarray, omega, alpha, beta) -> np.ndarray:
+    """
+    GARCH(1,1) variance for every column at once:
+    sigma2_t = omega + alpha * r2_t-1 + beta * sigma2_t-1, seeded with the
+    mean squared return. Parameters are per-column arrays. On missing days
+    the variance is carried over unchanged.
+
+    Returns:
+        A (dates + 1 x tickers) array laid out like `ewma_variance`.
+    """
+    r2, seed, valid = _squared_returns(returns)
+    variance = np.empty((len(r2) + 1, r2.shape[1]))
+    variance[0] = seed
+    for t in range(len(r2)):
+        variance[t + 1] = omega + alpha * r2[t] + beta * variance[t]
+        if valid is not None:
+            np.copyto(variance[t + 1], variance[t], where=~valid[t])
+    return np.maximum(variance, MIN_VARIANCE)
+
+
+def _garch_loglik(r2: np.ndarray, sample_var: np.ndarray, alpha: np.ndarray, persistence: np.ndarray,
+                  valid: np.ndarray = None) -> np.ndarray:
+    """
+    Gaussian log-likelihood (up to a constant) of a grid of GARCH parameters.
+
+    `alpha` and `persistence` (alpha + beta) have shape (grid, tickers).
+    omega comes from variance targeting, omega = sample_var * (1 - persistence),
+    so the long-run variance matches the data and only two parameters are
+    searched. Only the running variance is kept, so memory is grid x tickers.
+    Days outside `valid` (if given) add nothing and leave the variance as is.
+    """
+    beta = persistence - alpha
+    omega = sample_var * (1 - persistence)
+    variance = np.broadcast_to(sample_var, alpha.shape).copy()
+    loglik = np.zeros(alpha.shape)
+    for t in range(len(r2)):
+        np.maximum(variance, MIN_VARIANCE, out=variance)
+        if valid is None:
+            loglik -= 0.5 * (np.log(variance) + r2[t] / variance)
+            variance = omega + alpha * r2[t] + beta * variance
+        else:
+            loglik -= np.where(valid[t], 0.5 * (np.log(variance) + r2[t] / variance), 0.0)
+            variance = np.where(valid[t], omega + alpha * r2[t] + beta * variance, variance)
+    return loglik
+
+
+def fit_garch(returns: np.ndarray, refinements=3) -> dict[str, np.ndarray]:
+    """
+    Fits GARCH(1,1) to every column of `returns` by vectorized grid search.
+
+    A coarse grid of (alpha, persistence) pairs is scored for all tickers in
+    one pass. Each refinement then searches a smaller grid centred on every
+    ticker's own best point so far.
+
+    Returns:
+        {'omega', 'alpha', 'beta'}, each an array with one value per ticker.
+    """
+    r2, sample_var, observed = _squared_returns(returns)
+    if observed is not None:
+        r2 = np.where(observed, r2, 0.0)
+    n_tickers = r2.shape[1]
+
+    alphas = np.linspace(0.02, 0.25, 8)
+    persistences = np.array([0.80, 0.90, 0.94, 0.97, 0.98, 0.99, 0.995])
+    a, p = np.meshgrid(alphas, persistences, indexing='ij')
+    a, p = a.ravel(), p.ravel()
+    valid = p - a >= 0
+    grid_alpha = np.repeat(a[valid][:, None], n_tickers, axis=1)
+    grid_persistence = np.repeat(p[valid][:, None], n_tickers, axis=1)
+
+    loglik = _garch_loglik(r2, sample_var, grid_alpha, grid_persistence, observed)
+    best = np.argmax(loglik, axis=0)
+    cols = np.arange(n_tickers)
+    alpha, persistence = grid_alpha[best, cols], grid_persistence[best, cols]
+    best_loglik = loglik[best, cols]
+
+    step_alpha, step_persistence = 0.015, 0.01
+    offsets = np.array([-1.0, -0.5, 0.0, 0.5, 1.0])
+    da, dp = (m.ravel()[:, None] for m in np.meshgrid(offsets, offsets, indexing='ij'))
+    for _ in range(refinements):
+        cand_persistence = np.clip(persistence + dp * step_persistence, 0.5, 0.999)
+        cand_alpha = np.clip(alpha + da * step_alpha, 0.001, cand_persistence)
+        loglik = _garch_loglik(r2, sample_var, cand_alpha, cand_persistence, observed)
+        best = np.argmax(loglik, axis=0)
+        improved = loglik[best, cols] > best_loglik
+        alpha = np.where(improved, cand_alpha[best, cols], alpha)
+        persistence = np.where(improved, cand_persistence[best, cols], persistence)
+        best_loglik = np.maximum(best_loglik, loglik[best, cols])
+        step_alpha, step_persistence = step_alpha / 2, step_persistence / 2
+
+    return {
+        'omega': sample_var * (1 - persistence),
+        'alpha': alpha,
+        'beta': persistence - alpha,
+    }
+
+
+class FilteredSimulation:
+    """
+    Devolatilized residuals and current volatilities for a set of tickers.
+
+    Scenario returns are `residuals * current_vol`, but we never build that
+    matrix: a portfolio's P/L is `residuals @ (weights * current_vol)`.
+    Residuals are NaN before a ticker's first return. They're kept as a
+    `ReturnMatrix`, which does the aligning and the per-portfolio history.
+    """
+    def __init__(self, residuals: np.ndarray, current_vol: np.ndarray, tickers, dates, method, params=None):
+        self.matrix = ReturnMatrix(residuals, tickers, dates)
+        self.residuals = self.matrix.values
+        self.current_vol = np.asarray(current_vol)
+        self.tickers = self.matrix.tickers
+        self.dates = self.matrix.dates
+        self.method = method
+        self.params = params or {}
+
+    @classmethod
+    def fit(cls, returns: ReturnMatrix, method='ewma', lam=EWMA_LAMBDA):
+        """
+        Filters a return matrix.
+
+        Args:
+            returns: Daily returns, one column per ticker.
+            method: 'ewma' (fixed decay `lam`) or 'garch' (GARCH(1,1) fitted per ticker).
+        """
+        if method not in FILTER_METHODS:
+            raise ValueError(f"Unknown filter '{method}'. Expected one of {FILTER_METHODS}.")
+        values = np.asarray(returns.values, dtype=float)
+
+        if method == 'ewma':
+            params = {'lambda': np.full(values.shape[1], lam)}
+            variance = ewma_variance(values, lam)
+        else:
+            params = fit_garch(values)
+            variance = garch_variance(values, params['omega'], params['alpha'], params['beta'])
+
+        volatility = np.sqrt(variance)
+        residuals = (values / volatility[:-1]).astype(returns.dtype)
+        return cls(residuals, volatility[-1].astype(returns.dtype), returns.tickers, returns.dates, method, params)
+
+    @property
+    def valid_from(self) -> np.ndarray:
+        """The first row with a residual for each column."""
+        return self.matrix.valid_from
+
+    def covers(self, tickers) -> bool:
+        return self.matrix.covers(tickers)
+
+    def align(self, weights: dict[str, float]) -> np.ndarray:
+        return self.matrix.align(weights)
+
+    def scenario_returns(self) -> np.ndarray:
+        """The full (dates x tickers) matrix of rescaled returns. Mostly for checking."""
+        return self.residuals * self.current_vol
+
+    def portfolio_pl(self, weights: dict[str, float]) -> np.ndarray:
+        """
+        Simulated P/L of a portfolio under today's volatility, over the days
+        where every ticker it holds has a residual.
+        """
+        return self.matrix.portfolio_pl(weights, scale=self.current_vol)
+
+    def save(self, path):
+        """Writes the fitted residuals and volatilities to an .npz file."""
+        np.savez(
+            path,
+            residuals=self.residuals,
+            current_vol=self.current_vol,
+            tickers=np.array(self.tickers, dtype=str),
+            dates=self.dates.values.astype('datetime64[ns]'),
+            method=np.array(self.method),
+            **{f"param_{k}": v for k, v in self.params.items()}
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            params = {k[len('param_'):]: data[k] for k in data.files if k.startswith('param_')}
+            return cls(data['residuals'], data['current_vol'], data['tickers'].tolist(),
+                       data['dates'], str(data['method']), params)
+
+
+# --- Caching ---
+# Universe fits come from the nightly batch (see automate_report.py), via
+# FHS_CACHE_DIR. Portfolio-sized fits are cheap but still cached, keyed by
+# what they were fitted on, including a digest of the returns themselves so a
+# re-ingested price doesn't serve a stale fit.
+
+SIMULATION_CACHE_SIZE = 64
+_simulation_cache = OrderedDict()
+_universe_cache = {}
+# Both caches are used from Flask's request threads.
+_cache_lock = threading.Lock()
+
+
+def get_cache_dir() -> str:
+    return os.getenv("FHS_CACHE_DIR", "fhs_cache")
+
+
+def universe_cache_path(method, days=FHS_DAYS) -> str:
+    return os.path.join(get_cache_dir(), f"universe_{method}_{days}.npz")
+
+
+def fit_cached(returns: ReturnMatrix, method='ewma') -> FilteredSimulation:
+    """`FilteredSimulation.fit`, reusing the result if the same returns were filtered before."""
+    if returns.empty:
+        return FilteredSimulation.fit(returns, method)
+    digest = hashlib.blake2b(np.ascontiguousarray(returns.values).data, digest_size=16).hexdigest()
+    key = (method, tuple(returns.tickers), returns.dates[0], returns.dates[-1], returns.values.shape, digest)
+    with _cache_lock:
+        if key in _simulation_cache:
+            _simulation_cache.move_to_end(key)
+            return _simulation_cache[key]
+
+    simulation = FilteredSimulation.fit(returns, method)
+    with _cache_lock:
+        _simulation_cache[key] = simulation
+        _simulation_cache.move_to_end(key)
+        while len(_simulation_cache) > SIMULATION_CACHE_SIZE:
+            _simulation_cache.popitem(last=False)
+    return simulation
+
+
+def get_universe_simulation(method, days=FHS_DAYS, max_age_seconds=86400):
+    """
+    The nightly whole-universe fit, if there is one no older than `max_age_seconds`.
+    It's loaded from disk once per process and then kept in memory.
+    """
+    path = universe_cache_path(method, days)
+    try:
+        modified = os.path.getmtime(path)
+    except OSError:
+        return None
+    if time.time() - modified > max_age_seconds:
+        return None
+    with _cache_lock:
+        cached = _universe_cache.get(path)
+        if cached is None or cached[0] != modified:
+            cached = _universe_cache[path] = (modified, FilteredSimulation.load(path))
+    return cached[1]
+
+
+def precompute_universe(engine=None, days=FHS_DAYS, methods=FILTER_METHODS, dtype=None) -> dict:
+    """
+    Fits every ticker in `historical_prices` and writes the results to
+    FHS_CACHE_DIR. Meant for the nightly batch.
+
+    Each ticker is fitted on its own last `days` returns, so a recent listing
+    doesn't shorten everyone else's history. Tickers with fewer than
+    FHS_MIN_DAYS returns are left out.
+
+    Returns:
+        {method: seconds taken to fit}.
+    """
+    from .risk_engine import load_universe_returns
+
+    returns, _ = load_universe_returns(engine, days, dtype)
+    long_enough = len(returns.values) - returns.valid_from >= FHS_MIN_DAYS
+    if not long_enough.all():
+        keep = np.flatnonzero(long_enough)
+        returns = ReturnMatrix(returns.values[:, keep], [returns.tickers[i] for i in keep], returns.dates)
+    os.makedirs(get_cache_dir(), exist_ok=True)
+
+    timings = {}
+    for method in methods:
+        start = time.perf_counter()
+        simulation = FilteredSimulation.fit(returns, method)
+        timings[method] = time.perf_counter() - start
+        # Write then rename, so a web process never loads a half-written file.
+        path = universe_cache_path(method, days)
+        simulation.save(path + '.tmp.npz')
+        os.replace(path + '.tmp.npz', path)
+    return timings
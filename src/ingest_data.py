@@ -31,7 +31,11 @@ def create_tables(engine):
     # This is a bit of a hack to get the models loaded.
     # It relies on the fact that our models are defined in src/models.py
     from src.models import Base
+    from src.price_schema import migrate_historical_prices, partition_by_year_setting
     print("Creating database tables if they don't exist...")
+    # `historical_prices` is handled separately because it may need migrating
+    # from the old unindexed layout (or creating as a partitioned table).
+    migrate_historical_prices(engine, partition_by_year=partition_by_year_setting())
     Base.metadata.create_all(engine)
     print("Tables created successfully (or already exist).")
 
@@ -88,17 +92,86 @@ def ingest_stock_data(engine):
     print(f"  Concatenated all data into a single DataFrame with {len(full_df)} rows.")
     print("  Now writing to the 'historical_prices' table... (this might take a minute)")
     
-    # Use `to_sql` for a fast bulk insert.
-    full_df.to_sql('historical_prices', engine, if_exists='replace', index=False, chunksize=1000)
+    # This used to be a straight `to_sql(if_exists='replace')`, but that drops the
+    # table and takes the primary key and indexes with it. `load_prices` bulk
+    # loads into a staging table and upserts, so the managed schema survives reloads.
+    from src.price_schema import load_prices, partition_by_year_setting
+    load_prices(engine, full_df, partition_by_year=partition_by_year_setting())
     
     print("  Stock data ingestion complete!")
 
+def ingest_instrument_metadata(engine):
+    """
+    Loads the symbol metadata file (exchange, ETF flag, market category, name)
+    into the `instruments` table.
+    """
+    print("\nStarting instrument metadata ingestion...")
+
+    path = 'data/archive/symbols_valid_meta.csv'
+    if not os.path.exists(path):
+        print(f"  Metadata file {path} not found, skipping.")
+        return
+
+    meta_df = pd.read_csv(path)
+
+    # Only keep the columns we actually use and give them our schema names.
+    meta_df = meta_df.rename(columns={
+        'Symbol': 'ticker',
+        'Security Name': 'security_name',
+        'Listing Exchange': 'listing_exchange',
+        'Market Category': 'market_category',
+        'ETF': 'is_etf',
+        'Round Lot Size': 'round_lot_size'
+    })[['ticker', 'security_name', 'listing_exchange', 'market_category', 'is_etf', 'round_lot_size']]
+
+    # The file uses a single space for "no market category" (non-NASDAQ listings).
+    meta_df['market_category'] = meta_df['market_category'].str.strip().replace('', None)
+    meta_df['security_name'] = meta_df['security_name'].str.strip()
+    meta_df['is_etf'] = meta_df['is_etf'] == 'Y'
+    meta_df['round_lot_size'] = meta_df['round_lot_size'].fillna(100).astype(int)
+    meta_df = meta_df.drop_duplicates(subset='ticker')
+
+    # Unlike the price table, we keep the table created from the model (so the
+    # primary key survives) and just swap out its rows.
+    from src.models import Instrument
+    with engine.begin() as conn:
+        conn.execute(Instrument.__table__.delete())
+        meta_df.to_sql('instruments', conn, if_exists='append', index=False, chunksize=1000)
+
+    print(f"  Loaded metadata for {len(meta_df)} instruments.")
+
+def ingest_ticker_stats(engine):
+    """
+    Computes summary statistics (volatility, beta, drawdown, trailing returns)
+    for every stock and ETF in one pass and stores them in `ticker_stats`.
+    """
+    print("\nComputing per-ticker summary statistics...")
+    from src.models import TickerStat
+    from src.ticker_stats import compute_ticker_stats, read_close_prices
+
+    closes, etfs = read_close_prices(['data/archive/stocks', 'data/archive/etfs'])
+    if closes.empty:
+        print("  No price files found, skipping.")
+        return
+
+    stats_df = compute_ticker_stats(closes, benchmark=os.getenv("BETA_BENCHMARK"))
+    stats_df['is_etf'] = stats_df.index.isin(etfs)
+    stats_df = stats_df.reset_index()
+
+    with engine.begin() as conn:
+        conn.execute(TickerStat.__table__.delete())
+        stats_df.to_sql('ticker_stats', conn, if_exists='append', index=False, chunksize=1000)
+
+    print(f"  Stored statistics for {len(stats_df)} tickers.")
+
 def main():
     """The main function to run the whole ingestion process."""
     print("--- Starting Data Ingestion ---")
     engine = get_db_engine()
     create_tables(engine)
     ingest_stock_data(engine)
+    ingest_instrument_metadata(engine)
+    ingest_ticker_stats(engine)
     print("\n--- Data Ingestion Finished ---")
 
 if __name__ == "__main__":
@@ -0,0 +1,351 @@
+"""
+Live (intraday) price feed with incremental risk updates.
+
+Instead of recomputing everything from the database on every price change,
+each open "book" keeps its positions, current values and the historical
+simulation P/L vector in memory. A tick for one ticker then only touches the
+books that hold it, and inside each book it's one column update:
+
+    value_i += qty_i * (new_price - old_price)
+    pl      += returns[:, i] * (change in value_i)
+
+That's O(history length) per affected position, with no database queries.
+Refreshed numbers are pushed to subscribers (the dashboard, over SSE).
+
+There's also a replay source that turns the CSVs in `data/archive/` into a
+tick stream, so the whole thing can be tested without a real market feed.
+"""
+import argparse
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# After this many ticks a book rebuilds its P/L vector from scratch, so
+# floating-point error from the incremental updates can't pile up.
+RESYNC_EVERY = 10000
+
+DEFAULT_DATA_DIRS = ('data/archive/stocks', 'data/archive/etfs')
+
+# A book nobody has subscribed to this long after opening is dropped. Books are
+# normally closed when their last SSE client disconnects, but a client that
+# never connects (JS error, the dashboard re-rendering first) would leak them.
+DEFAULT_IDLE_TTL_SECONDS = 120
+
+
+class LiveRiskBook:
+    """
+    In-memory risk state for one portfolio, updated tick by tick.
+    """
+    def __init__(self, portfolio: dict[str, float], prices: dict[str, float], returns: pd.DataFrame, confidence_level=0.95):
+        """
+        Args:
+            portfolio: {ticker: quantity}.
+            prices: {ticker: latest price} to start from.
+            returns: Daily historical returns (dates x tickers) for the VaR simulation.
+            confidence_level: The VaR confidence level.
+        """
+        self.confidence_level = confidence_level
+        # Only tickers we have a price for count towards the value, same as PortfolioManager.
+        self.tickers = [t for t in portfolio if prices.get(t) is not None]
+        self._positions = {t: i for i, t in enumerate(self.tickers)}
+        self.quantities = np.array([portfolio[t] for t in self.tickers], dtype=float)
+        self.prices = np.array([prices[t] for t in self.tickers], dtype=float)
+        self.values = self.quantities * self.prices
+
+        # Tickers without return history still count towards the value, they
+        # just get a zero column in the simulation.
+        aligned = returns.reindex(columns=self.tickers).fillna(0.0)
+        self.returns = aligned.to_numpy(dtype=float)
+        self.ticks_applied = 0
+        self.resync()
+
+    def resync(self):
+        """Recomputes the totals from scratch."""
+        self.total_value = float(self.values.sum())
+        self.pl = self.returns @ self.values
+        self._ticks_since_resync = 0
+
+    def holds(self, ticker: str) -> bool:
+        return ticker in self._positions
+
+    def apply_tick(self, ticker: str, price: float) -> bool:
+        """
+        Applies one price update. Returns False if the book doesn't hold the ticker.
+        """
+        i = self._positions.get(ticker)
+        if i is None:
+            return False
+
+        delta = self.quantities[i] * (price - self.prices[i])
+        self.prices[i] = price
+        self.values[i] += delta
+        self.total_value += delta
+        if len(self.pl):
+            self.pl += self.returns[:, i] * delta
+
+        self.ticks_applied += 1
+        self._ticks_since_resync += 1
+        if self._ticks_since_resync >= RESYNC_EVERY:
+            self.resync()
+        return True
+
+    def var(self):
+        """The current 1-day historical VaR, or None if there's no history."""
+        if not len(self.pl):
+            return None
+        return float(-np.quantile(self.pl, 1 - self.confidence_level))
+
+    def snapshot(self) -> dict:
+        """A JSON-safe summary of the book's current state."""
+        return {
+            "total_market_value": float(self.total_value),
+            "var": self.var(),
+            "market_values_per_stock": {t: float(v) for t, v in zip(self.tickers, self.values)},
+            "ticks_applied": self.ticks_applied,
+        }
+
+    @classmethod
+    def from_risk_engine(cls, risk_engine, days=252, confidence_level=0.95):
+        """
+        Seeds a book from the database, once, using the usual PortfolioManager/RiskEngine path.
+        """
+        pm = risk_engine.pm
+        pm.calculate_total_market_value()
+        returns = risk_engine.get_return_matrix(days).to_frame()
+        return cls(pm.portfolio, pm.current_prices, returns, confidence_level)
+
+
+class TickBroadcaster:
+    """
+    Fan-out of book updates to subscribers, one queue per subscriber.
+
+    Slow subscribers don't hold anyone else up: if a queue is full, the oldest
+    update is thrown away (only the latest numbers matter anyway).
+    """
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._subscribers: dict[str, list[queue.Queue]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, book_id: str) -> queue.Queue:
+        q = queue.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers.setdefault(book_id, []).append(q)
+        return q
+
+    def unsubscribe(self, book_id: str, q: queue.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(book_id, [])
+            if q in subscribers:
+                subscribers.remove(q)
+            if not subscribers:
+                self._subscribers.pop(book_id, None)
+
+    def subscriber_count(self, book_id: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(book_id, []))
+
+    def publish(self, book_id: str, payload: dict):
+        with self._lock:
+            subscribers = list(self._subscribers.get(book_id, []))
+        for q in subscribers:
+            try:
+                q.put_nowait(payload)
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+                q.put_nowait(payload)
+
+
+class LiveFeed:
+    """
+    Keeps track of open books and routes incoming ticks to the ones that care.
+    """
+    def __init__(self, broadcaster: Optional[TickBroadcaster] = None, idle_ttl_seconds=DEFAULT_IDLE_TTL_SECONDS, clock=time.monotonic):
+        """
+        Args:
+            broadcaster: Where updates are published. A new one by default.
+            idle_ttl_seconds: How long a book may go without a subscriber before it's reaped.
+            clock: Time source, swappable for tests.
+        """
+        self.broadcaster = broadcaster or TickBroadcaster()
+        self.books: dict[str, LiveRiskBook] = {}
+        # Reverse index so a tick only visits the books that hold its ticker.
+        self._books_by_ticker: dict[str, set[str]] = {}
+        self._opened_at: dict[str, float] = {}
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def open_book(self, book: LiveRiskBook) -> str:
+        self.reap_idle_books()
+        with self._lock:
+            book_id = uuid.uuid4().hex
+            self.books[book_id] = book
+            self._opened_at[book_id] = self._clock()
+            for ticker in book.tickers:
+                self._books_by_ticker.setdefault(ticker, set()).add(book_id)
+        return book_id
+
+    def close_book(self, book_id: str):
+        with self._lock:
+            self._close_locked(book_id)
+
+    def _close_locked(self, book_id: str):
+        book = self.books.pop(book_id, None)
+        self._opened_at.pop(book_id, None)
+        if book is None:
+            return
+        for ticker in book.tickers:
+            holders = self._books_by_ticker.get(ticker)
+            if holders is not None:
+                holders.discard(book_id)
+                if not holders:
+                    del self._books_by_ticker[ticker]
+
+    def reap_idle_books(self) -> list[str]:
+        """Closes books that have had no subscriber for longer than the idle TTL."""
+        cutoff = self._clock() - self.idle_ttl_seconds
+        with self._lock:
+            idle = [
+                book_id for book_id, opened_at in self._opened_at.items()
+                if opened_at < cutoff and self.broadcaster.subscriber_count(book_id) == 0
+            ]
+            for book_id in idle:
+                self._close_locked(book_id)
+        return idle
+
+    def snapshot(self, book_id: str) -> Optional[dict]:
+        """A book's current snapshot, taken under the lock so a tick can't change it halfway."""
+        with self._lock:
+            book = self.books.get(book_id)
+            return book.snapshot() if book is not None else None
+
+    def ingest(self, ticks) -> set[str]:
+        """
+        Applies a batch of ticks and pushes one update per affected book.
+
+        Args:
+            ticks: An iterable of dicts with 'ticker' and 'price' keys.
+
+        Returns:
+            The ids of the books that changed.
+        """
+        # Validate the whole batch first so a bad tick doesn't leave it half-applied.
+        parsed = []
+        for tick in ticks:
+            price = float(tick['price'])
+            if not np.isfinite(price) or price <= 0:
+                raise ValueError(f"Invalid price for {tick['ticker']}: {tick['price']}")
+            parsed.append((str(tick['ticker']), price))
+
+        self.reap_idle_books()
+        touched = set()
+        with self._lock:
+            for ticker, price in parsed:
+                for book_id in self._books_by_ticker.get(ticker, ()):
+                    self.books[book_id].apply_tick(ticker, price)
+                    touched.add(book_id)
+            snapshots = {book_id: self.books[book_id].snapshot() for book_id in touched}
+
+        for book_id, snapshot in snapshots.items():
+            self.broadcaster.publish(book_id, snapshot)
+        return touched
+
+
+def format_sse(payload: dict, event: Optional[str] = None) -> str:
+    """Formats a payload as a Server-Sent Events message."""
+    message = f"data: {json.dumps(payload)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
+
+
+def stream_book_events(feed: LiveFeed, book_id: str, heartbeat_seconds=15.0):
+    """
+    A generator of SSE messages for one book, suitable for a Flask streaming response.
+
+    Sends the current snapshot straight away, then every update as it arrives,
+    with a comment line as a keep-alive when things are quiet. The book is
+    closed once its last subscriber disconnects.
+    """
+    q = feed.broadcaster.subscribe(book_id)
+    try:
+        snapshot = feed.snapshot(book_id)
+        if snapshot is None:
+            return
+        yield format_sse(snapshot)
+        while True:
+            try:
+                yield format_sse(q.get(timeout=heartbeat_seconds))
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+    finally:
+        feed.broadcaster.unsubscribe(book_id, q)
+        if feed.broadcaster.subscriber_count(book_id) == 0:
+            feed.close_book(book_id)
+
+
+def replay_csv_ticks(tickers, data_dirs=DEFAULT_DATA_DIRS, start=None, end=None):
+    """
+    Replays daily closes from the archive CSVs as a stream of ticks, in date order.
+
+    Yields lists of ticks, one list per date, so each trading day can be
+    ingested as a single batch.
+    """
+    frames = []
+    for ticker in tickers:
+        for data_dir in data_dirs:
+            matches = glob.glob(os.path.join(data_dir, f"{ticker}.csv"))
+            if matches:
+                df = pd.read_csv(matches[0], usecols=['Date', 'Close'])
+                df['ticker'] = ticker
+                frames.append(df)
+                break
+
+    if not frames:
+        return
+
+    ticks = pd.concat(frames, ignore_index=True).dropna(subset=['Close'])
+    ticks['Date'] = pd.to_datetime(ticks['Date'])
+    if start is not None:
+        ticks = ticks[ticks['Date'] >= pd.Timestamp(start)]
+    if end is not None:
+        ticks = ticks[ticks['Date'] <= pd.Timestamp(end)]
+
+    for date, day in ticks.sort_values(['Date', 'ticker']).groupby('Date', sort=True):
+        yield [
+            {'ticker': ticker, 'price': float(price), 'timestamp': date.isoformat()}
+            for ticker, price in zip(day['ticker'], day['Close'])
+        ]
+
+
+def main():
+    """Replays CSV closes into a running app's /api/ticks endpoint."""
+    import requests
+
+    parser = argparse.ArgumentParser(description="Replay archived closes as live ticks.")
+    parser.add_argument('tickers', nargs='+')
+    parser.add_argument('--url', default='http://127.0.0.1:8050')
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--interval', type=float, default=1.0, help="Seconds between trading days.")
+    args = parser.parse_args()
+
+    for batch in replay_csv_ticks(args.tickers, start=args.start):
+        response = requests.post(f"{args.url}/api/ticks", json={'ticks': batch}, timeout=10)
+        print(f"{batch[0]['timestamp'][:10]}: sent {len(batch)} ticks -> {response.status_code}")
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
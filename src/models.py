@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, BigInteger
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, BigInteger, Boolean, Index, JSON, ForeignKey
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 
@@ -14,19 +14,13 @@ class HistoricalPrice(Base):
     """
     __tablename__ = 'historical_prices'
 
-    # I'm not using a composite primary key of (ticker, date) because it can be
-    # a bit of a pain with some ORMs and it's often faster to have a single
-    # integer primary key for joins.
-    id = Column(Integer, primary_key=True)
-    
-    # Using a String for the ticker. A fixed-length CHAR might be slightly more
-    # efficient, but String is more flexible if we ever get weird ticker symbols.
-    ticker = Column(String, nullable=False, index=True)
-    
-    # The date of the price record. This is indexed because we'll almost always
-    # be filtering our queries by date.
-    date = Column(Date, nullable=False, index=True)
-    
+    # (ticker, date) is the natural key, so it's the primary key now. I used to
+    # have a surrogate integer `id` here, but nothing joins on it, and a
+    # composite key gives us the uniqueness guarantee for free. It's also
+    # required if the table is range-partitioned by date (see src/price_schema.py).
+    ticker = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+
     # Using Float for the price columns. For serious financial applications,
     # a Decimal type would be better to avoid floating-point inaccuracies,
     # but for this prototype, Float is perfectly fine and much simpler.
@@ -38,9 +32,128 @@ class HistoricalPrice(Base):
     # Volume can get pretty big, so a BigInteger is safer than a standard Integer.
     volume = Column(BigInteger)
 
+    # Both the latest-price lookup and the N-day window query filter on ticker
+    # and walk dates newest-first, so one composite index on (ticker, date DESC)
+    # serves both. On PostgreSQL it also INCLUDEs `close`, which lets those
+    # queries run as index-only scans without touching the table at all.
+    __table_args__ = (
+        Index(
+            'ix_historical_prices_ticker_date',
+            'ticker', date.desc(),
+            postgresql_include=['close']
+        ),
+    )
+
     def __repr__(self):
         return f"<HistoricalPrice(ticker='{self.ticker}', date='{self.date}', close='{self.close}')>"
 
+class Instrument(Base):
+    """
+    This class represents the `instruments` table, one row per listed symbol.
+    It's loaded from `data/archive/symbols_valid_meta.csv` and is what the
+    grouped risk rollups use to bucket tickers by exchange or category.
+    """
+    __tablename__ = 'instruments'
+
+    # The ticker is already unique in the metadata file, so it works fine as
+    # the primary key and lines up with `historical_prices.ticker`.
+    ticker = Column(String, primary_key=True)
+    security_name = Column(String)
+
+    # Single-letter codes straight from the file (N = NYSE, Q = NASDAQ, etc.).
+    # The rollup code maps these to readable names.
+    listing_exchange = Column(String, index=True)
+
+    # Only NASDAQ listings have a market category (Q, G or S), so this is
+    # NULL for everything else.
+    market_category = Column(String)
+    is_etf = Column(Boolean, nullable=False, default=False)
+    round_lot_size = Column(Integer)
+
+    def __repr__(self):
+        return f"<Instrument(ticker='{self.ticker}', listing_exchange='{self.listing_exchange}', is_etf={self.is_etf})>"
+
+class TickerStat(Base):
+    """
+    This class represents the `ticker_stats` table: one row of precomputed
+    summary statistics per stock/ETF, refreshed by the ingestion script.
+    The screening endpoint reads the whole table into memory and filters it there.
+    """
+    __tablename__ = 'ticker_stats'
+
+    ticker = Column(String, primary_key=True)
+    is_etf = Column(Boolean, nullable=False, default=False)
+
+    # The last day the ticker traded in our data, and its close on that day.
+    # Everything below is measured back from this date.
+    last_date = Column(Date)
+    last_close = Column(Float)
+
+    # Annualized volatility and beta over the last year of daily returns.
+    volatility = Column(Float)
+    beta = Column(Float)
+
+    # Worst peak-to-trough fall over the whole history, as a negative fraction.
+    max_drawdown = Column(Float)
+
+    # Simple price returns over roughly 1, 3 and 12 months (21/63/252 trading days).
+    return_1m = Column(Float)
+    return_3m = Column(Float)
+    return_1y = Column(Float)
+
+    # How many days of prices the stats are based on.
+    n_days = Column(Integer)
+
+    def __repr__(self):
+        return f"<TickerStat(ticker='{self.ticker}', volatility={self.volatility}, beta={self.beta})>"
+
+class SavedPortfolio(Base):
+    """
+    This class represents the `saved_portfolios` table: portfolios users have
+    saved from the dashboard, so they don't have to rebuild them every session.
+    """
+    __tablename__ = 'saved_portfolios'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
+
+    # {ticker: quantity}, stored as JSON since it's always read and written whole.
+    holdings = Column(JSON, nullable=False)
+
+    # A hash of the holdings, so we can tell cheaply whether a snapshot is still current.
+    holdings_hash = Column(String(64), nullable=False)
+
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<SavedPortfolio(id={self.id}, name='{self.name}')>"
+
+class RiskSnapshot(Base):
+    """
+    This class represents the `risk_snapshots` table: precomputed risk numbers
+    for a saved portfolio, written by the nightly job in automate_report.py.
+    """
+    __tablename__ = 'risk_snapshots'
+
+    id = Column(Integer, primary_key=True)
+    portfolio_id = Column(Integer, ForeignKey('saved_portfolios.id', ondelete='CASCADE'), nullable=False, index=True)
+    as_of = Column(DateTime, nullable=False)
+
+    # The holdings hash the numbers were computed for. If the portfolio has
+    # changed since, the snapshot is stale and we recompute live.
+    holdings_hash = Column(String(64), nullable=False)
+
+    confidence_level = Column(Float, nullable=False)
+    total_market_value = Column(Float)
+    var = Column(Float)
+    es = Column(Float)
+    market_values = Column(JSON)
+    pl_histogram = Column(JSON)
+
+    def __repr__(self):
+        return f"<RiskSnapshot(portfolio_id={self.portfolio_id}, as_of='{self.as_of}', var={self.var})>"
+
 # --- Database Connection Setup ---
 
 # This part sets up the database connection so other parts of the app can use it.
@@ -0,0 +1,246 @@
+"""
+Managed schema for the `historical_prices` table.
+
+The original ingestion used `to_sql(if_exists='replace')`, which drops the
+table and recreates it from the DataFrame's dtypes. That silently threw away
+the primary key and every index defined on the model. This module owns the
+table's shape instead:
+
+  * (ticker, date) primary key, so duplicates are impossible
+  * a composite (ticker, date DESC) index that INCLUDEs `close` on PostgreSQL
+  * optional yearly range partitions on PostgreSQL
+  * a loader that upserts through a staging table, so reloads keep all of the above
+  * a one-off migration for tables created the old way (or with the other
+    partitioning), run as a single transaction
+
+Most helpers take either an engine or a connection, so the migration can run
+all of its steps inside one transaction.
+"""
+import os
+from contextlib import nullcontext
+
+import pandas as pd
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+from .models import HistoricalPrice
+
+TABLE_NAME = HistoricalPrice.__tablename__
+INDEX_NAME = 'ix_historical_prices_ticker_date'
+STAGING_TABLE = 'historical_prices_staging'
+LEGACY_TABLE = 'historical_prices_legacy'
+PRICE_COLUMNS = ['ticker', 'date', 'open', 'high', 'low', 'close', 'volume']
+
+# Written out by hand because SQLAlchemy can't emit PARTITION BY for us.
+PARTITIONED_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+        ticker VARCHAR NOT NULL,
+        date DATE NOT NULL,
+        open DOUBLE PRECISION,
+        high DOUBLE PRECISION,
+        low DOUBLE PRECISION,
+        close DOUBLE PRECISION NOT NULL,
+        volume BIGINT,
+        PRIMARY KEY (ticker, date)
+    ) PARTITION BY RANGE (date)
+"""
+
+
+def partition_by_year_setting() -> bool:
+    """The PRICE_PARTITION_BY_YEAR setting."""
+    return os.getenv("PRICE_PARTITION_BY_YEAR", "false").lower() == "true"
+
+
+def _is_postgres(bind) -> bool:
+    return bind.dialect.name == 'postgresql'
+
+
+def _transaction(bind):
+    """A new transaction on an engine, or the caller's own if `bind` is already a connection."""
+    return nullcontext(bind) if isinstance(bind, Connection) else bind.begin()
+
+
+def is_managed(bind, partition_by_year=None) -> bool:
+    """
+    Checks whether `historical_prices` already has the managed shape
+    (composite primary key plus the ticker/date index), partitioned by year
+    or not as `partition_by_year` says (defaults to PRICE_PARTITION_BY_YEAR).
+    """
+    if partition_by_year is None:
+        partition_by_year = partition_by_year_setting()
+    inspector = inspect(bind)
+    if not inspector.has_table(TABLE_NAME):
+        return False
+    pk_columns = inspector.get_pk_constraint(TABLE_NAME).get('constrained_columns') or []
+    index_names = {ix['name'] for ix in inspector.get_indexes(TABLE_NAME)}
+    if pk_columns != ['ticker', 'date'] or INDEX_NAME not in index_names:
+        return False
+    return _is_partitioned(bind) == bool(partition_by_year)
+
+
+def ensure_year_partitions(bind, years):
+    """
+    Makes sure a partition exists for each year (PostgreSQL, partitioned tables only).
+    Rows outside these years land in the default partition.
+    """
+    with _transaction(bind) as conn:
+        for year in sorted(set(int(y) for y in years)):
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {TABLE_NAME}_y{year} PARTITION OF {TABLE_NAME} "
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+            ))
+
+
+def _is_partitioned(bind) -> bool:
+    if not _is_postgres(bind):
+        return False
+    with _transaction(bind) as conn:
+        return bool(conn.execute(text(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = :name"
+        ), {'name': TABLE_NAME}).first())
+
+
+def create_price_table(bind, partition_by_year=False):
+    """
+    Creates `historical_prices` (and its index) if it doesn't already exist.
+
+    Args:
+        bind: A SQLAlchemy engine or connection.
+        partition_by_year: If True (PostgreSQL only), create the table
+                           range-partitioned by date with a default partition.
+                           Yearly partitions are added as data is loaded.
+    """
+    if partition_by_year and not _is_postgres(bind):
+        raise ValueError("Partitioning by year is only supported on PostgreSQL.")
+
+    if partition_by_year:
+        with _transaction(bind) as conn:
+            conn.execute(text(PARTITIONED_DDL))
+            conn.execute(text(f"CREATE TABLE IF NOT EXISTS {TABLE_NAME}_default PARTITION OF {TABLE_NAME} DEFAULT"))
+    else:
+        HistoricalPrice.__table__.create(bind, checkfirst=True)
+
+    ensure_price_indexes(bind)
+
+
+def ensure_price_indexes(bind):
+    """Creates the composite ticker/date index if it's missing. Safe to call repeatedly."""
+    for index in HistoricalPrice.__table__.indexes:
+        index.create(bind, checkfirst=True)
+
+
+def migrate_historical_prices(engine, partition_by_year=None):
+    """
+    Brings an existing `historical_prices` table up to the managed schema.
+
+    If the table was created by the old `to_sql(if_exists='replace')` ingestion
+    (no primary key, no index, maybe duplicates or an extra `Adj Close`
+    column), or with the other partitioning, it's renamed out of the way, the
+    managed table is created, and the rows are copied across with duplicates
+    on (ticker, date) dropped. Does nothing if the table is already managed.
+
+    Everything runs in one transaction. On PostgreSQL DDL is transactional,
+    so a failure leaves the original table untouched. SQLite commits some DDL
+    as it goes, so a failure there can leave the rows in the legacy table;
+    the next run finds it and finishes the copy rather than losing them.
+
+    Args:
+        partition_by_year: Defaults to the PRICE_PARTITION_BY_YEAR setting.
+    """
+    if partition_by_year is None:
+        partition_by_year = partition_by_year_setting()
+    inspector = inspect(engine)
+    leftover = inspector.has_table(LEGACY_TABLE)
+    if not leftover:
+        if is_managed(engine, partition_by_year):
+            ensure_price_indexes(engine)
+            return
+        if not inspector.has_table(TABLE_NAME):
+            create_price_table(engine, partition_by_year)
+            return
+
+    print(f"  Migrating '{TABLE_NAME}' to the managed schema...")
+    with engine.begin() as conn:
+        if not leftover:
+            conn.execute(text(f"ALTER TABLE {TABLE_NAME} RENAME TO {LEGACY_TABLE}"))
+        elif inspect(conn).has_table(TABLE_NAME) and not is_managed(conn, partition_by_year):
+            raise RuntimeError(
+                f"Both '{TABLE_NAME}' and '{LEGACY_TABLE}' exist and neither is the managed schema. "
+                "Move one of them aside before migrating."
+            )
+        else:
+            print(f"  Resuming from '{LEGACY_TABLE}' left by an earlier migration...")
+
+        create_price_table(conn, partition_by_year)
+        if partition_by_year:
+            years = conn.execute(text(
+                f"SELECT DISTINCT CAST(EXTRACT(YEAR FROM date) AS INTEGER) FROM {LEGACY_TABLE}"
+            )).scalars().all()
+            ensure_year_partitions(conn, years)
+
+        _copy_rows(conn, LEGACY_TABLE, overwrite=False)
+        conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
+    print("  Migration complete.")
+
+
+def _copy_rows(bind, source_table, overwrite=True):
+    """
+    Copies every row from `source_table` into `historical_prices`.
+
+    With `overwrite`, existing (ticker, date) rows are updated. Without it they're
+    left alone, which is what we want when the source itself may contain
+    duplicates (PostgreSQL won't let one INSERT update the same row twice).
+    """
+    columns = ', '.join(PRICE_COLUMNS)
+    # Old tables stored `date` as a timestamp, so normalise it on the way in.
+    date_expr = 'CAST(date AS DATE)' if _is_postgres(bind) else 'date(date)'
+    select_columns = ', '.join(date_expr if c == 'date' else c for c in PRICE_COLUMNS)
+    updates = ', '.join(f"{c} = excluded.{c}" for c in PRICE_COLUMNS if c not in ('ticker', 'date'))
+    conflict_action = f"DO UPDATE SET {updates}" if overwrite else "DO NOTHING"
+    with _transaction(bind) as conn:
+        conn.execute(text(f"""
+            INSERT INTO {TABLE_NAME} ({columns})
+            SELECT {select_columns} FROM {source_table}
+            WHERE ticker IS NOT NULL AND date IS NOT NULL AND close IS NOT NULL
+            ON CONFLICT (ticker, date) {conflict_action}
+        """))
+
+
+def load_prices(engine, prices_df: pd.DataFrame, partition_by_year=None, chunksize=1000):
+    """
+    Loads price rows into the managed table without dropping it.
+
+    The rows go into a throwaway staging table first (that's where `to_sql`'s
+    replace behaviour is harmless), then get upserted on (ticker, date). So
+    reloading the same CSVs is idempotent and the key/index/partitions survive.
+    """
+    migrate_historical_prices(engine, partition_by_year)
+
+    df = prices_df[PRICE_COLUMNS].copy()
+    df['date'] = pd.to_datetime(df['date']).dt.date
+    # If the same (ticker, date) shows up twice in one load, the last one wins.
+    df = df.drop_duplicates(subset=['ticker', 'date'], keep='last')
+
+    if _is_partitioned(engine):
+        ensure_year_partitions(engine, pd.to_datetime(df['date']).dt.year.unique())
+
+    df.to_sql(STAGING_TABLE, engine, if_exists='replace', index=False, chunksize=chunksize)
+    try:
+        _copy_rows(engine, STAGING_TABLE)
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {STAGING_TABLE}"))
+
+
+def explain_latest_price(engine, ticker) -> list[str]:
+    """
+    Returns the query plan for the latest-price lookup, one line per entry.
+    Handy for checking the composite index is actually being used.
+    """
+    query = f"SELECT close FROM {TABLE_NAME} WHERE ticker = :ticker ORDER BY date DESC LIMIT 1"
+    prefix = 'EXPLAIN' if _is_postgres(engine) else 'EXPLAIN QUERY PLAN'
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"{prefix} {query}"), {'ticker': ticker}).all()
+    # PostgreSQL returns one text column; SQLite returns (id, parent, notused, detail).
+    return [str(row[-1]) for row in rows]
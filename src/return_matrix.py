@@ -0,0 +1,304 @@
+"""
+Compact, memory-budgeted return matrices.
+
+The straightforward pandas pipeline (`pivot().ffill().pct_change().dropna()`
+and then `returns * weights`) makes a fresh full-size float64 copy at every
+step. That's fine for a 4-stock portfolio, but with the whole universe
+(~1,000 tickers x 15+ years) held by several worker processes it adds up to
+gigabytes.
+
+This module does the same maths on a single NumPy array:
+  * one allocation, in float32 if `RISK_FLOAT_DTYPE=float32` (half the memory)
+  * forward-fill and returns computed in place, block by block
+  * portfolio P/L as a matrix-vector product, so no weighted copy
+
+Finished matrices are read-only and can be shared between processes through
+`multiprocessing.shared_memory` or a memory-mapped `.npy` file.
+"""
+import json
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+SUPPORTED_DTYPES = ('float64', 'float32')
+
+# Rows per block for the in-place return calculation. NumPy buffers one block
+# of input because the source and destination rows overlap, so this caps the
+# temporary memory at block_rows x n_tickers.
+DEFAULT_BLOCK_ROWS = 256
+
+# Long-format rows scattered into the matrix per batch. Caps the temporary
+# index arrays, which would otherwise be several times the size of the matrix.
+SCATTER_CHUNK_ROWS = 1_000_000
+
+
+def get_risk_dtype(default='float64') -> np.dtype:
+    """Reads the float precision for risk matrices from `RISK_FLOAT_DTYPE`."""
+    name = os.getenv("RISK_FLOAT_DTYPE", default).strip().lower()
+    if name not in SUPPORTED_DTYPES:
+        raise ValueError(f"RISK_FLOAT_DTYPE must be one of {SUPPORTED_DTYPES}, got '{name}'.")
+    return np.dtype(name)
+
+
+def forward_fill_inplace(values: np.ndarray) -> np.ndarray:
+    """Forward-fills NaNs down each column, in place (same as `DataFrame.ffill`)."""
+    for t in range(1, values.shape[0]):
+        row = values[t]
+        missing = np.isnan(row)
+        if missing.any():
+            row[missing] = values[t - 1, missing]
+    return values
+
+
+def first_valid_rows(values: np.ndarray) -> np.ndarray:
+    """
+    The first non-NaN row of each column (len(values) for an all-NaN column).
+
+    After a forward-fill NaNs can only be at the top of a column, so every row
+    from here on is usable.
+    """
+    valid = ~np.isnan(values)
+    return np.where(valid.any(axis=0), np.argmax(valid, axis=0), len(values))
+
+
+def prices_to_returns_inplace(prices: np.ndarray, block_rows=DEFAULT_BLOCK_ROWS, drop_incomplete=True) -> tuple[np.ndarray, int]:
+    """
+    Turns a (dates x tickers) price array into simple daily returns, in place.
+
+    Row t is overwritten with prices[t + 1] / prices[t] - 1.
+
+    Args:
+        drop_incomplete: Drop leading rows that still contain NaNs (tickers
+                         that hadn't started trading yet), like
+                         `pct_change().dropna()`. That's what a single portfolio
+                         wants, but for the whole universe it would cut every
+                         ticker's history down to the youngest ticker's, so
+                         universe callers pass False and keep the NaNs instead
+                         (see `ReturnMatrix.valid_from`).
+
+    Returns:
+        A view of the returns and the index of the first price date it
+        covers, so the caller can line up the dates (row i of the view is the
+        return on date `first + i + 1`).
+    """
+    n_days = prices.shape[0]
+    if n_days < 2:
+        return prices[:0], 0
+
+    for start in range(0, n_days - 1, block_rows):
+        stop = min(start + block_rows, n_days - 1)
+        block = prices[start:stop]
+        np.divide(prices[start + 1:stop + 1], block, out=block)
+        block -= 1
+
+    returns = prices[:n_days - 1]
+    if not drop_incomplete:
+        return returns, 0
+    # After a forward-fill, NaNs can only be at the top, so the first complete
+    # row marks where the usable history starts. Scanning row by row avoids a
+    # full-size mask.
+    first = 0
+    while first < len(returns) and np.isnan(returns[first]).any():
+        first += 1
+    return returns[first:], first
+
+
+class ReturnMatrix:
+    """
+    A read-only (dates x tickers) matrix of daily returns backed by one NumPy array.
+    """
+    def __init__(self, values: np.ndarray, tickers, dates, _owner=None):
+        self.values = values
+        self.values.setflags(write=False)
+        self.tickers = list(tickers)
+        self.dates = pd.DatetimeIndex(dates)
+        self._positions = {t: i for i, t in enumerate(self.tickers)}
+        self._valid_from = None
+        # Keeps a shared memory block alive for as long as we're using its buffer.
+        self._owner = _owner
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.values.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.values.nbytes)
+
+    @property
+    def empty(self) -> bool:
+        return self.values.size == 0
+
+    @property
+    def valid_from(self) -> np.ndarray:
+        """The first row with a return for each column. All zeros unless built with drop_incomplete=False."""
+        if self._valid_from is None:
+            self._valid_from = first_valid_rows(self.values)
+        return self._valid_from
+
+    @classmethod
+    def from_long_prices(cls, prices_df: pd.DataFrame, dtype=None, block_rows=DEFAULT_BLOCK_ROWS, drop_incomplete=True):
+        """
+        Builds the matrix from long-format rows (ticker, date, close) as they come out of the database.
+
+        The rows are scattered straight into one preallocated array of the
+        requested dtype (no pivoted DataFrame), and everything after that
+        happens in place.
+
+        Args:
+            drop_incomplete: See `prices_to_returns_inplace`. Pass False for
+                             universe matrices, so each ticker keeps its own history.
+        """
+        dtype = np.dtype(dtype) if dtype is not None else get_risk_dtype()
+        if prices_df.empty:
+            return cls(np.empty((0, 0), dtype=dtype), [], [])
+
+        # unique() on a whole object column builds a hash table the size of the
+        # column, so the labels are collected a chunk at a time as well.
+        chunks = [prices_df.iloc[start:start + SCATTER_CHUNK_ROWS] for start in range(0, len(prices_df), SCATTER_CHUNK_ROWS)]
+        tickers, dates = set(), set()
+        for chunk in chunks:
+            tickers.update(chunk['ticker'].unique())
+            dates.update(chunk['date'].unique())
+        tickers = pd.Index(sorted(tickers))
+        # Rows are looked up by the raw date values, so no datetime copy of the column is made.
+        dates = pd.Index(sorted(dates))
+
+        values = np.full((len(dates), len(tickers)), np.nan, dtype=dtype)
+        for chunk in chunks:
+            rows = dates.get_indexer(chunk['date'])
+            cols = tickers.get_indexer(chunk['ticker'])
+            values[rows, cols] = chunk['close'].to_numpy(dtype=dtype)
+
+        forward_fill_inplace(values)
+        returns, first = prices_to_returns_inplace(values, block_rows, drop_incomplete)
+        return cls(returns, list(tickers), pd.to_datetime(dates[first + 1:first + 1 + len(returns)]))
+
+    def covers(self, tickers) -> bool:
+        """Whether every one of `tickers` has a column."""
+        return all(t in self._positions for t in tickers)
+
+    def align(self, weights: dict[str, float]) -> np.ndarray:
+        """Converts a {ticker: dollar value} dict into a weight vector in column order."""
+        vector = np.zeros(len(self.tickers), dtype=self.dtype)
+        for ticker, value in weights.items():
+            i = self._positions.get(ticker)
+            if i is not None:
+                vector[i] = value
+        return vector
+
+    def portfolio_rows(self, weights: dict[str, float]) -> int:
+        """The first row where every ticker the portfolio holds (and we know) has a return."""
+        held = np.flatnonzero(self.align(weights))
+        return int(self.valid_from[held].max()) if len(held) else 0
+
+    def portfolio_pl(self, weights: dict[str, float], scale: np.ndarray = None) -> np.ndarray:
+        """
+        The daily P/L of a portfolio, without materialising returns * weights.
+
+        Only covers the rows where all of the portfolio's own tickers have
+        returns, so in a universe matrix a young ticker elsewhere doesn't
+        shorten the history.
+
+        Args:
+            scale: Optional per-column multipliers for the weights (filtered
+                   simulation passes each ticker's current volatility).
+        """
+        vector = self.align(weights)
+        held = np.flatnonzero(vector)
+        if len(held) == 0:
+            return np.zeros(len(self.values), dtype=self.dtype)
+        start = int(self.valid_from[held].max())
+        held_weights = vector[held] if scale is None else vector[held] * scale[held]
+        return self.values[start:, held] @ held_weights
+
+    def to_frame(self) -> pd.DataFrame:
+        """A DataFrame view (handy for debugging, not for the hot path)."""
+        return pd.DataFrame(self.values, index=self.dates, columns=self.tickers, copy=False)
+
+    # --- Sharing between processes ---
+
+    def to_shared_memory(self, name=None):
+        """
+        Copies the matrix into a new shared memory block.
+
+        Returns:
+            The SharedMemory object (the caller owns it and must `unlink()` it
+            when done) and a small picklable descriptor for `from_shared_memory`.
+        """
+        shm = shared_memory.SharedMemory(create=True, size=max(self.nbytes, 1), name=name)
+        view = np.ndarray(self.values.shape, dtype=self.dtype, buffer=shm.buf)
+        view[...] = self.values
+        descriptor = {
+            'name': shm.name,
+            'shape': list(self.values.shape),
+            'dtype': self.dtype.str,
+            'tickers': self.tickers,
+            'dates': [d.isoformat() for d in self.dates],
+        }
+        return shm, descriptor
+
+    @classmethod
+    def from_shared_memory(cls, descriptor: dict):
+        """Attaches (read-only, no copy) to a matrix published with `to_shared_memory`."""
+        shm = shared_memory.SharedMemory(name=descriptor['name'])
+        values = np.ndarray(tuple(descriptor['shape']), dtype=np.dtype(descriptor['dtype']), buffer=shm.buf)
+        return cls(values, descriptor['tickers'], pd.to_datetime(descriptor['dates']), _owner=shm)
+
+    def save_mmap(self, path):
+        """Writes the matrix to `path` (.npy) plus a `.json` sidecar with the labels."""
+        np.save(path, self.values)
+        with open(_sidecar_path(path), 'w') as f:
+            json.dump({'tickers': self.tickers, 'dates': [d.isoformat() for d in self.dates]}, f)
+
+    @classmethod
+    def load_mmap(cls, path):
+        """Memory-maps a matrix saved with `save_mmap`. Pages are shared by every process that maps it."""
+        values = np.load(path if str(path).endswith('.npy') else f"{path}.npy", mmap_mode='r')
+        with open(_sidecar_path(path)) as f:
+            labels = json.load(f)
+        return cls(values, labels['tickers'], pd.to_datetime(labels['dates']))
+
+
+def _sidecar_path(path) -> str:
+    path = str(path)
+    return (path[:-4] if path.endswith('.npy') else path) + '.json'
+
+
+def memory_footprint(*matrices: ReturnMatrix) -> dict:
+    """
+    Reports this process's memory use, plus the size of any matrices passed in.
+
+    RSS comes from /proc on Linux and falls back to the peak RSS from
+    `resource` elsewhere. Shared and memory-mapped pages count towards RSS in
+    every process that touches them, so `matrix_bytes` is the better number
+    for working out how much is really being duplicated.
+    """
+    footprint = {
+        'pid': os.getpid(),
+        'rss_bytes': None,
+        'peak_rss_bytes': None,
+        'matrix_bytes': sum(m.nbytes for m in matrices),
+    }
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    footprint['rss_bytes'] = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    footprint['peak_rss_bytes'] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if footprint['peak_rss_bytes'] is None:
+        try:
+            import resource
+            import sys
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux reports kilobytes, macOS reports bytes.
+            footprint['peak_rss_bytes'] = peak if sys.platform == 'darwin' else peak * 1024
+        except ImportError:
+            pass
+    return footprint
@@ -1,44 +1,136 @@
+import warnings
+
 import pandas as pd
 import numpy as np
 from sqlalchemy import text
 from .portfolio import PortfolioManager
+from .risk_rollup import GroupIndex, RiskRollup, load_instrument_metadata
+from .return_matrix import ReturnMatrix, get_risk_dtype
+from .quantile_sketch import DEFAULT_COMPRESSION, TDigest
+from .filtered_simulation import FHS_DAYS, fit_cached, get_universe_simulation
+
+def bin_pl_distribution(pl, bins=60) -> dict:
+    """
+    Bins a simulated P/L vector into a compact histogram.
+
+    This is what we send to the browser instead of every simulated value, so
+    the chart can be drawn client-side from ~60 numbers.
+    """
+    pl = np.asarray(pl, dtype=float)
+    pl = pl[np.isfinite(pl)]
+    if len(pl) == 0:
+        return {"bin_edges": [], "counts": []}
+    counts, edges = np.histogram(pl, bins=bins)
+    return {"bin_edges": edges.tolist(), "counts": counts.tolist()}
+
+def expected_shortfall(pl, confidence_level=0.95, axis=None):
+    """
+    The Expected Shortfall (a.k.a. CVaR): the average loss on the days that
+    were at least as bad as the VaR. Returns None if there's no P/L.
+
+    This is the one ES definition used for reporting: the live API, the
+    nightly snapshots and batch scoring all call it. NaNs are ignored.
+
+    Args:
+        axis: Pass 0 with a (days x portfolios) array to get one ES per
+              column; a column with no values gets NaN.
+    """
+    pl = np.asarray(pl, dtype=float)
+    if axis is None:
+        pl = pl[~np.isnan(pl)]
+        if len(pl) == 0:
+            return None
+        cutoff = np.quantile(pl, 1 - confidence_level)
+        return float(-pl[pl <= cutoff].mean())
+
+    with warnings.catch_warnings():
+        # All-NaN columns just come back as NaN.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        cutoff = np.nanquantile(pl, 1 - confidence_level, axis=axis, keepdims=True)
+    tail = pl <= cutoff
+    count = tail.sum(axis=axis)
+    return -np.where(tail, pl, 0).sum(axis=axis) / np.where(count > 0, count, np.nan)
+
+def query_prices(bind, days, tickers=None) -> pd.DataFrame:
+    """
+    Fetches the last N days of (ticker, date, close) rows for `tickers`, or
+    for every ticker in `historical_prices` if `tickers` is None.
+
+    I'm using a window function here (`row_number`) to do this efficiently in a
+    single database query. The alternative would be to pull all data and then
+    filter in pandas, but that would be much slower and use more memory.
+    """
+    # The SQL query uses a Common Table Expression (CTE) to first number the rows
+    # for each ticker by date, and then it selects the top N rows.
+    ticker_filter = "WHERE ticker IN :tickers" if tickers is not None else ""
+    query = text(f"""
+        WITH ranked_prices AS (
+            SELECT
+                ticker,
+                date,
+                close,
+                ROW_NUMBER() OVER(PARTITION BY ticker ORDER BY date DESC) as rn
+            FROM historical_prices
+            {ticker_filter}
+        )
+        SELECT ticker, date, close
+        FROM ranked_prices
+        WHERE rn <= :days
+    """)
+    params = {'days': days}
+    if tickers is not None:
+        params['tickers'] = tuple(tickers)
+    return pd.read_sql(query, bind, params=params)
+
+def load_universe_returns(bind=None, days=252, dtype=None) -> tuple[ReturnMatrix, dict[str, float]]:
+    """
+    Builds the return matrix for every ticker, plus each ticker's latest close.
+
+    Tickers keep their own history: one that only listed recently has NaNs
+    before its first return (see `ReturnMatrix.valid_from`) instead of
+    cutting everyone else's history down to its length.
+
+    Returns:
+        A (returns, {ticker: latest close}) tuple, with up to `days` returns per ticker.
+    """
+    if bind is None:
+        from .models import engine as bind
+    # One extra day so we still get `days` returns.
+    long_prices = query_prices(bind, days + 1)
+    latest = long_prices.sort_values('date').groupby('ticker')['close'].last()
+    returns = ReturnMatrix.from_long_prices(long_prices, dtype=dtype, drop_incomplete=False)
+    return returns, latest.to_dict()
 
 class RiskEngine:
     """
     This is where the magic happens. The RiskEngine takes a portfolio
     and runs the calculations for Value at Risk (VaR).
     """
-    def __init__(self, portfolio_manager: PortfolioManager):
+    def __init__(self, portfolio_manager: PortfolioManager, dtype=None):
+        """
+        Args:
+            portfolio_manager: The portfolio to analyse.
+            dtype: Float precision for the return matrix ('float64' or 'float32').
+                   Defaults to the `RISK_FLOAT_DTYPE` setting.
+        """
         self.pm = portfolio_manager
         self.db = self.pm.db_session
+        self.dtype = np.dtype(dtype) if dtype is not None else get_risk_dtype()
+
+    def _query_prices(self, days) -> pd.DataFrame:
+        """
+        Fetches the last N days of (ticker, date, close) rows for all tickers in the portfolio.
+        See `query_prices`.
+        """
+        return query_prices(self.db.bind, days, self.pm.tickers)
 
     def get_historical_data(self, days=252) -> pd.DataFrame:
         """
-        Fetches the last N days of historical price data for all tickers in the portfolio.
-        
-        I'm using a window function here (`row_number`) to do this efficiently in a
-        single database query. The alternative would be to pull all data and then
-        filter in pandas, but that would be much slower and use more memory.
-        """
-        # The SQL query uses a Common Table Expression (CTE) to first number the rows
-        # for each ticker by date, and then it selects the top N rows.
-        query = text(f"""
-            WITH ranked_prices AS (
-                SELECT
-                    ticker,
-                    date,
-                    close,
-                    ROW_NUMBER() OVER(PARTITION BY ticker ORDER BY date DESC) as rn
-                FROM historical_prices
-                WHERE ticker IN :tickers
-            )
-            SELECT ticker, date, close
-            FROM ranked_prices
-            WHERE rn <= :days
-        """)
-        
-        df = pd.read_sql(query, self.db.bind, params={'tickers': tuple(self.pm.tickers), 'days': days})
-        
+        Fetches the last N days of historical price data for all tickers in the portfolio,
+        as a (date x ticker) DataFrame of closing prices.
+        """
+        df = self._query_prices(days)
+
         # Now, we pivot the data so that each column is a ticker and each row is a date.
         # This is the format we need for our calculations.
         pivot_df = df.pivot(index='date', columns='ticker', values='close').sort_index()
@@ -47,6 +139,16 @@ class RiskEngine:
         # standard way to handle this. It assumes the price just stays the same.
         return pivot_df.ffill()
 
+    def get_return_matrix(self, days=252) -> ReturnMatrix:
+        """
+        Fetches the last N days of prices and turns them into a compact daily return matrix.
+
+        Same numbers as `get_historical_data(days).pct_change().dropna()`, but
+        built in place in a single array of `self.dtype`, without the
+        intermediate DataFrames.
+        """
+        return ReturnMatrix.from_long_prices(self._query_prices(days), dtype=self.dtype)
+
     def calculate_historical_var(self, days=252, confidence_level=0.95):
         """
         Calculates the 1-day Value at Risk (VaR) using the historical simulation method.
@@ -56,32 +158,192 @@ class RiskEngine:
         would not have been exceeded.
         
         TODO: Add other VaR models, like Parametric VaR (which assumes a normal
-        distribution) or a full-blown Monte Carlo simulation.
+        distribution). There's a bootstrapped Monte Carlo in `calculate_monte_carlo_var`.
         """
         if not self.pm.market_values:
             # This should have been called already, but just in case...
             self.pm.calculate_total_market_value()
 
-        # 1. Get historical data
-        hist_data = self.get_historical_data(days)
-        if hist_data.empty:
+        # 1. Get the daily returns for each stock (built in place, see return_matrix.py)
+        returns = self.get_return_matrix(days)
+        if returns.empty:
             return None, []
 
-        # 2. Calculate daily returns for each stock
-        returns = hist_data.pct_change().dropna()
+        # 2. Calculate the historical P/L for the portfolio
+        # Each stock's daily return times its dollar value in the portfolio,
+        # summed across stocks. As a matrix-vector product this never builds
+        # the (days x stocks) weighted copy.
+        historical_pl = returns.portfolio_pl(self.pm.market_values)
+        if len(historical_pl) == 0:
+            return None, []
 
-        # 3. Calculate the dollar value of each stock in the portfolio
-        weights = pd.Series(self.pm.market_values)
-        
-        # 4. Calculate the historical P/L for the portfolio
-        # We do this by multiplying the daily returns of each stock by its
-        # dollar value in the portfolio. This gives us the daily P/L for each asset.
-        # Then we sum across the rows to get the total portfolio P/L for each day.
-        historical_pl = (returns * weights).sum(axis=1)
-        
-        # 5. Find the VaR
+        # 3. Find the VaR
         # The VaR is the quantile of the historical P/L distribution.
         # For a 95% confidence level, we're looking for the 5th percentile.
-        var_value = -historical_pl.quantile(1 - confidence_level)
+        var_value = -float(np.quantile(historical_pl, 1 - confidence_level))
         
         return var_value, historical_pl.tolist()
+
+    def calculate_filtered_var(self, days=FHS_DAYS, confidence_level=0.95, method='ewma'):
+        """
+        Calculates the 1-day VaR using filtered historical simulation.
+
+        Same idea as `calculate_historical_var`, but every historical return is
+        first divided by that day's volatility (EWMA or GARCH(1,1)) and then
+        multiplied by today's, so the scenarios reflect the current volatility
+        regime. See filtered_simulation.py.
+
+        Uses the nightly whole-universe fit when it covers the portfolio, and
+        otherwise filters just the portfolio's own tickers (cached too).
+
+        Returns:
+            A (var, simulated_pl) tuple, like `calculate_historical_var`.
+        """
+        if not self.pm.market_values:
+            self.pm.calculate_total_market_value()
+
+        simulation = get_universe_simulation(method, days)
+        if simulation is None or not simulation.covers(self.pm.market_values):
+            returns = self.get_return_matrix(days)
+            if returns.empty:
+                return None, []
+            simulation = fit_cached(returns, method)
+
+        filtered_pl = simulation.portfolio_pl(self.pm.market_values)
+        if len(filtered_pl) == 0:
+            return None, []
+
+        var_value = -float(np.quantile(filtered_pl, 1 - confidence_level))
+        return var_value, filtered_pl.tolist()
+
+    def calculate_monte_carlo_var(self, n_paths=1_000_000, horizon_days=1, days=252, confidence_level=0.95,
+                                  chunk_size=100_000, compression=DEFAULT_COMPRESSION, seed=None):
+        """
+        Bootstrapped Monte Carlo VaR and ES, estimated in bounded memory.
+
+        Each path draws `horizon_days` historical days at random (with
+        replacement) and adds up the portfolio's P/L on them. Paths are simulated
+        a chunk at a time and streamed into a t-digest (see quantile_sketch.py),
+        so memory is one chunk plus the sketch no matter how many paths we run.
+
+        Args:
+            n_paths: Number of simulated paths.
+            horizon_days: Days per path, e.g. 10 for a 10-day VaR.
+            chunk_size: Paths simulated per batch.
+            compression: Accuracy of the sketch.
+            seed: Random seed. Give each worker its own and merge their digests
+                  with `TDigest.merge_all` to split a big run across processes.
+
+        Returns:
+            A (var, es, digest) tuple, or (None, None, digest) if there's no data.
+        """
+        digest = TDigest(compression=compression)
+
+        if not self.pm.market_values:
+            self.pm.calculate_total_market_value()
+
+        returns = self.get_return_matrix(days)
+        if returns.empty:
+            return None, None, digest
+        daily_pl = returns.portfolio_pl(self.pm.market_values)
+        if len(daily_pl) == 0:
+            return None, None, digest
+
+        rng = np.random.default_rng(seed)
+        for start in range(0, n_paths, chunk_size):
+            size = min(chunk_size, n_paths - start)
+            draws = rng.integers(0, len(daily_pl), size=(size, horizon_days))
+            digest.update(daily_pl[draws].sum(axis=1))
+
+        var_value, es_value = digest.tail_risk(confidence_level)
+        return var_value, es_value, digest
+
+    def calculate_grouped_risk(self, group_by='listing_exchange', tags=None, days=252, confidence_level=0.95) -> pd.DataFrame:
+        """
+        Breaks the portfolio's value and VaR down by exchange, category or a custom tag.
+
+        Args:
+            group_by: One of 'listing_exchange', 'market_category' or 'asset_type'.
+                      Ignored if `tags` is given.
+            tags: Optional {ticker: tag} dict for custom groupings.
+
+        Returns:
+            A DataFrame indexed by group with market value, standalone VaR and
+            component VaR columns. Empty if there's no historical data.
+        """
+        if not self.pm.market_values:
+            self.pm.calculate_total_market_value()
+
+        returns = self.get_return_matrix(days)
+        if returns.empty:
+            return pd.DataFrame(columns=['market_value', 'standalone_var', 'component_var'])
+
+        tickers = returns.tickers
+
+        if tags is not None:
+            index = GroupIndex.from_tags(tickers, tags)
+        else:
+            metadata = load_instrument_metadata(self.db, tickers)
+            index = GroupIndex.from_metadata(tickers, metadata, group_by)
+
+        rollup = RiskRollup(index, returns.values)
+        return rollup.rollup(index.align(self.pm.market_values), confidence_level)
+
+FIRM_TOTAL = 'Firm total'
+
+def calculate_grouped_risk_many(portfolios: dict, group_by='listing_exchange', tags=None, days=252,
+                                confidence_level=0.95) -> pd.DataFrame:
+    """
+    Breaks many portfolios down by group in one batch, plus the firm-wide total.
+
+    All the portfolios share one return matrix and one GroupIndex, so the
+    rollup is a single `RiskRollup.rollup_many` call. The firm total is the
+    sum of every portfolio's positions, rolled up like any other. They're all
+    measured over the days where every ticker held anywhere has a return, so
+    the firm-wide components add up consistently.
+
+    Args:
+        portfolios: {name: {ticker: quantity}}.
+        group_by, tags: As in `RiskEngine.calculate_grouped_risk`.
+
+    Returns:
+        A DataFrame indexed by (portfolio, group) with market value,
+        standalone VaR and component VaR columns. The firm-wide rows are
+        under FIRM_TOTAL. Empty if there's no historical data.
+    """
+    columns = ['market_value', 'standalone_var', 'component_var']
+    if not portfolios:
+        raise ValueError("At least one portfolio is required.")
+
+    combined = {}
+    for holdings in portfolios.values():
+        for ticker, quantity in holdings.items():
+            combined[ticker] = combined.get(ticker, 0) + quantity
+    pm = PortfolioManager(combined)
+    prices = pm.get_current_prices()
+    engine = RiskEngine(pm)
+
+    returns = engine.get_return_matrix(days)
+    if returns.empty:
+        empty_index = pd.MultiIndex.from_tuples([], names=['portfolio', 'group'])
+        return pd.DataFrame(columns=columns, index=empty_index)
+
+    names = list(portfolios)
+    positions = np.array([
+        [portfolios[name].get(t, 0) * prices.get(t, 0.0) for t in returns.tickers]
+        for name in names
+    ], dtype=returns.dtype)
+    positions = np.vstack([positions, positions.sum(axis=0)])
+
+    if tags is not None:
+        index = GroupIndex.from_tags(returns.tickers, tags)
+    else:
+        metadata = load_instrument_metadata(engine.db, returns.tickers)
+        index = GroupIndex.from_metadata(returns.tickers, metadata, group_by)
+
+    result = RiskRollup(index, returns.values).rollup_many(positions, confidence_level)
+    frames = {
+        name: pd.DataFrame({col: result[col][:, p] for col in columns}, index=pd.Index(result['groups'], name='group'))
+        for p, name in enumerate(names + [FIRM_TOTAL])
+    }
+    return pd.concat(frames, names=['portfolio'])
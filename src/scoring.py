@@ -0,0 +1,686 @@
+"""
+Sharded, multi-process portfolio scoring.
+
+For the end-of-day run we need value, VaR, ES and stress P/L for every client
+portfolio, which is too much for one process. The pieces here are:
+
+  * `ScoringContext`: the price data every worker needs (a return matrix for
+    the whole universe plus latest prices). It's loaded once and handed to
+    local workers through shared memory, so nobody re-queries the database.
+  * `WorkQueue`: the queue interface. `SQLWorkQueue` keeps tasks in a
+    database table; by default it's a local SQLite file, and pointed at
+    PostgreSQL workers on other machines can pull from it too
+    (`python -m src.scoring worker --queue-url ...`). Workers reconnect to a
+    queue from its picklable `descriptor()`.
+  * `ScoringCoordinator`: splits portfolios into shards, starts local worker
+    processes, and yields results as shards finish. A shard that fails (or
+    whose worker dies) is retried on its own, up to `max_attempts`. Local
+    workers that die are replaced, up to `max_restarts`.
+
+`python -m src.scoring score` scores every saved portfolio (or a JSON file of
+them) and writes a CSV; `python -m src.scoring worker` runs a remote worker.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import time
+import traceback
+import uuid
+import warnings
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import (
+    Column, Float, Integer, MetaData, String, Table, Text, create_engine, event, text
+)
+
+from .return_matrix import ReturnMatrix, memory_footprint
+from .risk_engine import expected_shortfall, load_universe_returns
+
+DEFAULT_QUEUE_URL = 'sqlite:///scoring_queue.db'
+
+Task = namedtuple('Task', ['task_id', 'job_id', 'payload', 'attempt'])
+
+queue_metadata = MetaData()
+
+scoring_tasks = Table(
+    'scoring_tasks', queue_metadata,
+    Column('task_id', String(64), primary_key=True),
+    Column('job_id', String(64), nullable=False, index=True),
+    Column('shard_index', Integer, nullable=False),
+    Column('payload', Text, nullable=False),
+    # queued -> running -> completed, or back to queued on failure until
+    # attempts reaches max_attempts, then failed.
+    Column('status', String(16), nullable=False, index=True),
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('max_attempts', Integer, nullable=False),
+    Column('worker_id', String(128)),
+    Column('error', Text),
+    Column('result', Text),
+    Column('collected', Integer, nullable=False, default=0),
+    Column('claimed_at', Float),
+    Column('updated_at', Float),
+)
+
+
+# --- Price data shared by all workers ---
+
+class ScoringContext:
+    """
+    Everything a worker needs to score portfolios: returns and latest prices
+    for the whole universe, in the same column order.
+    """
+    def __init__(self, returns: ReturnMatrix, prices: dict[str, float]):
+        self.returns = returns
+        self.tickers = returns.tickers
+        self._positions = {t: i for i, t in enumerate(self.tickers)}
+        self.prices = np.array([prices.get(t, np.nan) for t in self.tickers], dtype=returns.dtype)
+        self._shm = None
+
+    def position(self, ticker: str) -> Optional[int]:
+        return self._positions.get(ticker)
+
+    @classmethod
+    def from_database(cls, engine=None, days=252, dtype=None):
+        """
+        Loads the context straight from `historical_prices`. Every ticker keeps
+        its own history (see `load_universe_returns`), and each portfolio is
+        scored on the rows where all of its own tickers have returns.
+        """
+        returns, latest = load_universe_returns(engine, days, dtype)
+        return cls(returns, latest)
+
+    def share(self) -> dict:
+        """
+        Publishes the return matrix into shared memory (once) and returns a
+        picklable descriptor that worker processes can attach to.
+        """
+        if self._shm is None:
+            self._shm, self._descriptor = self.returns.to_shared_memory()
+        return {
+            'returns': self._descriptor,
+            'prices': {t: float(p) for t, p in zip(self.tickers, self.prices) if np.isfinite(p)},
+        }
+
+    @classmethod
+    def attach(cls, descriptor: dict):
+        """Attaches to a context published with `share()`, without copying the matrix."""
+        return cls(ReturnMatrix.from_shared_memory(descriptor['returns']), descriptor['prices'])
+
+    def release(self):
+        """Frees the shared memory block, if we published one."""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+# --- The actual scoring ---
+
+def score_shard(payload: dict, context: ScoringContext) -> list[dict]:
+    """
+    Scores one shard of portfolios, all at once.
+
+    Args:
+        payload: {'portfolios': [{'id': ..., 'holdings': {ticker: qty}}, ...],
+                  'scenarios': {name: {ticker: shocked return, '*': default}},
+                  'confidence_level': 0.95}
+        context: The shared price data.
+
+    Returns:
+        One dict per portfolio with value, VaR, ES and stress P/L.
+    """
+    portfolios = payload['portfolios']
+    scenarios = payload.get('scenarios') or {}
+    confidence_level = payload.get('confidence_level', 0.95)
+    n_tickers = len(context.tickers)
+
+    # (portfolios x tickers) matrix of dollar positions.
+    positions = np.zeros((len(portfolios), n_tickers), dtype=context.returns.dtype)
+    missing = []
+    for p, portfolio in enumerate(portfolios):
+        unknown = []
+        for ticker, quantity in portfolio['holdings'].items():
+            i = context.position(ticker)
+            if i is None or not np.isfinite(context.prices[i]):
+                unknown.append(ticker)
+            else:
+                positions[p, i] += quantity * context.prices[i]
+        missing.append(unknown)
+
+    # Historical simulation for every portfolio in one matrix product, over
+    # just the columns this shard holds. In a universe matrix a ticker has
+    # NaNs before its first return, so those are zeroed here and each
+    # portfolio's rows before its youngest ticker's first return are masked.
+    held = np.flatnonzero(positions.any(axis=0))
+    returns = np.nan_to_num(context.returns.values[:, held])
+    pl = (returns @ positions[:, held].T).astype(float)
+    starts = np.where(positions[:, held] != 0, context.returns.valid_from[held], 0).max(axis=1, initial=0)
+    pl[np.arange(len(pl))[:, None] < starts[None, :]] = np.nan
+    if pl.shape[0]:
+        with warnings.catch_warnings():
+            # A portfolio whose tickers have no returns at all gets NaN.
+            warnings.simplefilter('ignore', RuntimeWarning)
+            var = -np.nanquantile(pl, 1 - confidence_level, axis=0)
+        es = expected_shortfall(pl, confidence_level, axis=0)
+    else:
+        var = es = np.full(len(portfolios), np.nan)
+
+    # Stress scenarios: one shocked-return vector per scenario.
+    names = list(scenarios)
+    shocks = np.zeros((len(names), n_tickers), dtype=context.returns.dtype)
+    for s, name in enumerate(names):
+        shocks[s, :] = scenarios[name].get('*', 0.0)
+        for ticker, shock in scenarios[name].items():
+            i = context.position(ticker)
+            if i is not None:
+                shocks[s, i] = shock
+    stressed = positions @ shocks.T
+
+    return [
+        {
+            'id': portfolio['id'],
+            'market_value': float(positions[p].sum()),
+            'var': float(var[p]),
+            'es': float(es[p]),
+            'observations': int(len(pl) - min(starts[p], len(pl))),
+            'stress': {name: float(stressed[p, s]) for s, name in enumerate(names)},
+            'missing_tickers': missing[p],
+        }
+        for p, portfolio in enumerate(portfolios)
+    ]
+
+
+# --- Work queue ---
+
+class WorkQueue(ABC):
+    """
+    The interface the coordinator and workers talk to.
+
+    Worker processes can't share the coordinator's queue object, so every
+    queue also describes how to reconnect to itself: `descriptor()` returns a
+    small picklable dict and `connect(descriptor)` turns it back into a queue,
+    in this process or on another machine.
+    """
+    @abstractmethod
+    def descriptor(self) -> dict:
+        """A picklable description of this queue, for `connect`."""
+
+    @classmethod
+    @abstractmethod
+    def from_descriptor(cls, descriptor: dict) -> 'WorkQueue':
+        """Opens the queue a descriptor points to."""
+
+    @abstractmethod
+    def submit(self, job_id: str, shards: list[dict]) -> list[str]:
+        """Queues one task per shard and returns their task ids."""
+
+    @abstractmethod
+    def claim(self, worker_id: str) -> Optional[Task]:
+        """Hands the next available task to a worker, or None if there isn't one."""
+
+    @abstractmethod
+    def complete(self, task_id: str, worker_id: str, result) -> bool:
+        """
+        Stores a task's result. Returns False if `worker_id` no longer holds the
+        task (its lease ran out and another worker claimed it), in which case
+        nothing is stored.
+        """
+
+    @abstractmethod
+    def fail(self, task_id: str, worker_id: str, error: str) -> bool:
+        """
+        Records a failed attempt, requeueing the task if it has attempts left.
+        Returns False, changing nothing, if `worker_id` no longer holds the task.
+        """
+
+    @abstractmethod
+    def collect(self, job_id: str) -> list[tuple[str, object]]:
+        """Results of tasks completed since the last call, each returned once."""
+
+    @abstractmethod
+    def job_status(self, job_id: str) -> dict[str, int]:
+        """Task counts by status."""
+
+    @abstractmethod
+    def failures(self, job_id: str) -> dict[str, str]:
+        """{task_id: last error} for tasks that ran out of attempts."""
+
+    def expire(self, job_id: str) -> int:
+        """Fails tasks whose workers disappeared on their last attempt. Returns how many."""
+        return 0
+
+    def release(self, worker_id: str, error: str) -> int:
+        """
+        Fails the tasks held by a worker known to be dead, so they're retried
+        straight away instead of after the lease runs out. Returns how many.
+        """
+        return 0
+
+
+# Every queue class that `connect` can open, by the 'kind' in its descriptor.
+QUEUE_KINDS = {}
+
+
+def connect(descriptor: dict) -> WorkQueue:
+    """Opens the queue described by `WorkQueue.descriptor()`."""
+    kind = descriptor.get('kind')
+    if kind not in QUEUE_KINDS:
+        raise ValueError(f"Unknown work queue kind '{kind}'. Expected one of {sorted(QUEUE_KINDS)}.")
+    return QUEUE_KINDS[kind].from_descriptor(descriptor)
+
+
+class SQLWorkQueue(WorkQueue):
+    """
+    A work queue stored in a database table.
+
+    Claiming is one atomic UPDATE ... RETURNING, with `FOR UPDATE SKIP LOCKED`
+    on PostgreSQL so many workers can claim at once. Tasks whose worker hasn't
+    finished within `lease_seconds` are handed out again, which covers workers
+    that crash or get killed.
+    """
+    def __init__(self, url: str = None, max_attempts=3, lease_seconds=600.0):
+        self.url = url or os.getenv("SCORING_QUEUE_URL", DEFAULT_QUEUE_URL)
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+
+        if self.url.startswith('sqlite'):
+            # Several processes write to the file, so wait for locks instead of erroring.
+            self.engine = create_engine(self.url, connect_args={'timeout': 30})
+
+            @event.listens_for(self.engine, 'connect')
+            def _set_wal(dbapi_connection, _):
+                dbapi_connection.execute('PRAGMA journal_mode=WAL')
+        else:
+            self.engine = create_engine(self.url)
+        queue_metadata.create_all(self.engine)
+
+    def descriptor(self):
+        return {
+            'kind': 'sql', 'url': self.url,
+            'max_attempts': self.max_attempts, 'lease_seconds': self.lease_seconds,
+        }
+
+    @classmethod
+    def from_descriptor(cls, descriptor):
+        return cls(descriptor.get('url'), max_attempts=descriptor.get('max_attempts', 3),
+                   lease_seconds=descriptor.get('lease_seconds', 600.0))
+
+    def submit(self, job_id, shards):
+        now = time.time()
+        rows = [
+            {
+                'task_id': f"{job_id}-{i}", 'job_id': job_id, 'shard_index': i,
+                'payload': json.dumps(shard), 'status': 'queued', 'attempts': 0,
+                'max_attempts': self.max_attempts, 'collected': 0, 'updated_at': now,
+            }
+            for i, shard in enumerate(shards)
+        ]
+        with self.engine.begin() as conn:
+            if rows:
+                conn.execute(scoring_tasks.insert(), rows)
+        return [row['task_id'] for row in rows]
+
+    def claim(self, worker_id):
+        now = time.time()
+        skip_locked = 'FOR UPDATE SKIP LOCKED' if self.engine.dialect.name == 'postgresql' else ''
+        with self.engine.begin() as conn:
+            row = conn.execute(text(f"""
+                UPDATE scoring_tasks
+                SET status = 'running', attempts = attempts + 1, worker_id = :worker_id,
+                    claimed_at = :now, updated_at = :now
+                WHERE task_id = (
+                    SELECT task_id FROM scoring_tasks
+                    WHERE status = 'queued'
+                       OR (status = 'running' AND claimed_at < :expired AND attempts < max_attempts)
+                    ORDER BY job_id, shard_index
+                    LIMIT 1
+                    {skip_locked}
+                )
+                RETURNING task_id, job_id, payload, attempts
+            """), {'worker_id': worker_id, 'now': now, 'expired': now - self.lease_seconds}).first()
+        if row is None:
+            return None
+        return Task(row.task_id, row.job_id, json.loads(row.payload), row.attempts)
+
+    def complete(self, task_id, worker_id, result):
+        # Only the worker holding the lease may finish the task; if it was
+        # reclaimed, the new holder's result is the one that counts.
+        with self.engine.begin() as conn:
+            updated = conn.execute(text("""
+                UPDATE scoring_tasks SET status = 'completed', result = :result, error = NULL, updated_at = :now
+                WHERE task_id = :task_id AND worker_id = :worker_id AND status = 'running'
+            """), {'task_id': task_id, 'worker_id': worker_id, 'result': json.dumps(result), 'now': time.time()})
+        return updated.rowcount > 0
+
+    def fail(self, task_id, worker_id, error):
+        with self.engine.begin() as conn:
+            updated = conn.execute(text("""
+                UPDATE scoring_tasks
+                SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                    error = :error, updated_at = :now
+                WHERE task_id = :task_id AND worker_id = :worker_id AND status = 'running'
+            """), {'task_id': task_id, 'worker_id': worker_id, 'error': error, 'now': time.time()})
+        return updated.rowcount > 0
+
+    def collect(self, job_id):
+        """Returns results of shards completed since the last call (each one only once)."""
+        with self.engine.begin() as conn:
+            rows = conn.execute(text("""
+                SELECT task_id, result FROM scoring_tasks
+                WHERE job_id = :job_id AND status = 'completed' AND collected = 0
+                ORDER BY shard_index
+            """), {'job_id': job_id}).all()
+            if rows:
+                conn.execute(
+                    scoring_tasks.update().where(scoring_tasks.c.task_id.in_([r.task_id for r in rows])).values(collected=1)
+                )
+        return [(r.task_id, json.loads(r.result)) for r in rows]
+
+    def job_status(self, job_id):
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT status, COUNT(*) AS n FROM scoring_tasks WHERE job_id = :job_id GROUP BY status
+            """), {'job_id': job_id}).all()
+        return {r.status: r.n for r in rows}
+
+    def expire(self, job_id):
+        """Marks tasks whose lease ran out on their last attempt as failed. Returns how many."""
+        now = time.time()
+        with self.engine.begin() as conn:
+            result = conn.execute(text("""
+                UPDATE scoring_tasks SET status = 'failed', error = 'Lease expired on final attempt', updated_at = :now
+                WHERE job_id = :job_id AND status = 'running'
+                  AND claimed_at < :expired AND attempts >= max_attempts
+            """), {'job_id': job_id, 'now': now, 'expired': now - self.lease_seconds})
+        return result.rowcount
+
+    def release(self, worker_id, error):
+        with self.engine.begin() as conn:
+            result = conn.execute(text("""
+                UPDATE scoring_tasks
+                SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                    error = :error, updated_at = :now
+                WHERE worker_id = :worker_id AND status = 'running'
+            """), {'worker_id': worker_id, 'error': error, 'now': time.time()})
+        return result.rowcount
+
+    def failures(self, job_id) -> dict[str, str]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT task_id, error FROM scoring_tasks WHERE job_id = :job_id AND status = 'failed'
+            """), {'job_id': job_id}).all()
+        return {r.task_id: r.error for r in rows}
+
+
+QUEUE_KINDS['sql'] = SQLWorkQueue
+
+
+# --- Workers ---
+
+def run_worker(queue: WorkQueue, context: ScoringContext, worker_id=None, scorer=score_shard,
+               should_stop=None, poll_interval=0.2):
+    """
+    Pulls shards off the queue and scores them until `should_stop()` says so
+    (or forever, if it's None).
+
+    Each completed shard is stored as {'worker_id', 'results', 'memory'},
+    where 'memory' is the worker's `memory_footprint` right after scoring.
+    """
+    worker_id = worker_id or f"{os.uname().nodename if hasattr(os, 'uname') else 'worker'}-{os.getpid()}"
+    while True:
+        task = queue.claim(worker_id)
+        if task is None:
+            if should_stop is not None and should_stop():
+                return
+            time.sleep(poll_interval)
+            continue
+        try:
+            payload = dict(task.payload, attempt=task.attempt)
+            results = scorer(payload, context)
+            stored = queue.complete(task.task_id, worker_id, {
+                'worker_id': worker_id,
+                'results': results,
+                'memory': memory_footprint(context.returns),
+            })
+            if not stored:
+                print(f"  {worker_id} lost the lease on {task.task_id}; dropping its result.")
+        except Exception:
+            queue.fail(task.task_id, worker_id, traceback.format_exc())
+
+
+def _job_finished(queue: WorkQueue, job_id: str) -> bool:
+    status = queue.job_status(job_id)
+    return not status.get('queued') and not status.get('running')
+
+
+def _local_worker_main(queue_descriptor, context_descriptor, job_id, worker_id, scorer):
+    """Entry point for a local worker process."""
+    queue = connect(queue_descriptor)
+    context = ScoringContext.attach(context_descriptor)
+    run_worker(queue, context, worker_id=worker_id, scorer=scorer,
+               should_stop=lambda: _job_finished(queue, job_id), poll_interval=0.05)
+
+
+def _log_shard(task_id: str, shard: dict):
+    """Prints which worker scored a shard and how much memory it was using."""
+    memory = shard.get('memory') or {}
+    rss = memory.get('rss_bytes')
+    rss_text = f"{rss / 2**20:.1f} MiB" if rss is not None else "unknown"
+    print(f"  {task_id}: {len(shard['results'])} portfolios on {shard.get('worker_id')} "
+          f"(rss {rss_text}, matrix {memory.get('matrix_bytes', 0) / 2**20:.1f} MiB)")
+
+
+class ScoringCoordinator:
+    """
+    Splits a batch of portfolios into shards, farms them out, and gathers the results.
+    """
+    def __init__(self, context: ScoringContext, queue: Optional[WorkQueue] = None, n_workers=None,
+                 shard_size=250, confidence_level=0.95, scorer=score_shard, poll_interval=0.05,
+                 max_restarts=None):
+        """
+        Args:
+            context: The price data. Local workers attach to it through shared memory.
+            queue: The work queue. Defaults to a local SQLite-backed queue.
+            n_workers: Local worker processes to start. 0 means rely on remote workers.
+            shard_size: Portfolios per shard.
+            scorer: The function that scores a shard (mostly here for testing).
+            max_restarts: How many dead local workers to replace per job before
+                giving up. Defaults to n_workers.
+        """
+        self.context = context
+        self.queue = queue or SQLWorkQueue()
+        self.n_workers = (os.cpu_count() or 1) if n_workers is None else n_workers
+        self.max_restarts = self.n_workers if max_restarts is None else max_restarts
+        self.shard_size = shard_size
+        self.confidence_level = confidence_level
+        self.scorer = scorer
+        self.poll_interval = poll_interval
+
+    def submit(self, portfolios: list[dict], scenarios: Optional[dict] = None) -> str:
+        """Queues a job. Each portfolio is {'id': ..., 'holdings': {ticker: qty}}."""
+        job_id = uuid.uuid4().hex
+        n_shards = math.ceil(len(portfolios) / self.shard_size)
+        shards = [
+            {
+                'portfolios': portfolios[i * self.shard_size:(i + 1) * self.shard_size],
+                'scenarios': scenarios or {},
+                'confidence_level': self.confidence_level,
+            }
+            for i in range(n_shards)
+        ]
+        self.queue.submit(job_id, shards)
+        return job_id
+
+    def iter_results(self, job_id: str, timeout: Optional[float] = None):
+        """
+        Yields per-portfolio results as shards finish. Local workers are
+        started on the first call and shut down once the job is done.
+
+        A local worker that dies (crash, OOM kill) has its shard requeued and
+        is replaced, up to `max_restarts` times.
+
+        Raises:
+            RuntimeError: If every local worker is dead and none can be restarted.
+        """
+        queue_descriptor = self.queue.descriptor()
+        context_descriptor = self.context.share()
+        spawned = 0
+
+        def spawn():
+            nonlocal spawned
+            worker_id = f"{job_id[:8]}-local-{spawned}"
+            spawned += 1
+            worker = multiprocessing.Process(
+                target=_local_worker_main,
+                args=(queue_descriptor, context_descriptor, job_id, worker_id, self.scorer),
+                name=worker_id, daemon=True
+            )
+            worker.start()
+            return worker
+
+        workers = [spawn() for _ in range(self.n_workers)]
+        restarts = 0
+        started = time.time()
+        try:
+            while True:
+                for task_id, shard in self.queue.collect(job_id):
+                    _log_shard(task_id, shard)
+                    yield from shard['results']
+                self.queue.expire(job_id)
+
+                # A worker only exits cleanly once the job is finished, so any
+                # other exit means it died, possibly holding a shard.
+                for worker in [w for w in workers if w.exitcode not in (None, 0)]:
+                    workers.remove(worker)
+                    released = self.queue.release(worker.name, f"Worker {worker.name} died with exit code {worker.exitcode}")
+                    print(f"  Worker {worker.name} died (exit code {worker.exitcode}); {released} shard(s) requeued.")
+                    if restarts < self.max_restarts:
+                        restarts += 1
+                        workers.append(spawn())
+
+                if _job_finished(self.queue, job_id):
+                    # One last sweep in case a shard finished after the collect above.
+                    for task_id, shard in self.queue.collect(job_id):
+                        _log_shard(task_id, shard)
+                        yield from shard['results']
+                    return
+                if self.n_workers and not any(w.is_alive() for w in workers):
+                    raise RuntimeError(
+                        f"Scoring job {job_id} stopped: all local workers died and "
+                        f"{restarts} restart(s) were used up."
+                    )
+                if timeout is not None and time.time() - started > timeout:
+                    raise TimeoutError(f"Scoring job {job_id} did not finish within {timeout} seconds.")
+                time.sleep(self.poll_interval)
+        finally:
+            for worker in workers:
+                worker.join(timeout=5)
+                if worker.is_alive():
+                    worker.terminate()
+
+    def score(self, portfolios: list[dict], scenarios: Optional[dict] = None, timeout: Optional[float] = None) -> pd.DataFrame:
+        """
+        Scores everything and returns one row per portfolio.
+
+        Raises:
+            RuntimeError: If any shard still failed after all its retries.
+        """
+        job_id = self.submit(portfolios, scenarios)
+        try:
+            rows = list(self.iter_results(job_id, timeout))
+        finally:
+            self.context.release()
+
+        failures = self.queue.failures(job_id)
+        if failures:
+            raise RuntimeError(f"{len(failures)} shard(s) failed after retries: {sorted(failures)}")
+        return pd.DataFrame(rows).set_index('id') if rows else pd.DataFrame()
+
+
+def score_portfolios(portfolios: list[dict], days=252, queue: Optional[WorkQueue] = None, n_workers=None,
+                     shard_size=250, confidence_level=0.95, timeout: Optional[float] = None) -> pd.DataFrame:
+    """Loads the price data and scores a batch of portfolios with local workers."""
+    print(f"Loading price data for the last {days} days...")
+    context = ScoringContext.from_database(days=days)
+    coordinator = ScoringCoordinator(context, queue, n_workers=n_workers, shard_size=shard_size,
+                                     confidence_level=confidence_level)
+    print(f"Scoring {len(portfolios)} portfolios on {coordinator.n_workers} local worker(s)...")
+    return coordinator.score(portfolios, timeout=timeout)
+
+
+def load_saved_portfolios() -> list[dict]:
+    """Every saved portfolio, in the {'id', 'holdings'} shape the coordinator takes."""
+    from .models import SessionLocal
+    from .snapshots import list_portfolios
+    db = SessionLocal()
+    try:
+        return [{'id': p.name, 'holdings': p.holdings} for p in list_portfolios(db)]
+    finally:
+        db.close()
+
+
+def load_portfolio_file(path: str) -> list[dict]:
+    """
+    Reads portfolios from a JSON file, either a list of {'id', 'holdings'} or
+    a {name: {ticker: qty}} mapping.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return [{'id': name, 'holdings': holdings} for name, holdings in data.items()]
+    return data
+
+
+def main():
+    """
+    Either scores a batch of portfolios with local workers (`score`), or runs a
+    standalone worker (`worker`), e.g. on another machine pointed at a shared
+    PostgreSQL queue.
+    """
+    parser = argparse.ArgumentParser(description="RiskDash sharded portfolio scoring.")
+    parser.add_argument('command', choices=['score', 'worker'])
+    parser.add_argument('--queue-url', default=None, help="Defaults to SCORING_QUEUE_URL or a local SQLite file.")
+    parser.add_argument('--queue', default=None,
+                        help="A queue descriptor as JSON (see WorkQueue.descriptor). Overrides --queue-url.")
+    parser.add_argument('--days', type=int, default=252)
+    parser.add_argument('--portfolios', default=None,
+                        help="score: a JSON file of portfolios. Defaults to every saved portfolio.")
+    parser.add_argument('--output', default=os.path.join('reports', 'portfolio_scores.csv'),
+                        help="score: where to write the results.")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="score: local worker processes. Defaults to the CPU count; 0 relies on remote workers.")
+    parser.add_argument('--shard-size', type=int, default=250)
+    parser.add_argument('--confidence-level', type=float, default=0.95)
+    parser.add_argument('--timeout', type=float, default=None)
+    args = parser.parse_args()
+
+    queue_descriptor = json.loads(args.queue) if args.queue else {'kind': 'sql', 'url': args.queue_url}
+    queue = connect(queue_descriptor)
+
+    if args.command == 'score':
+        portfolios = load_portfolio_file(args.portfolios) if args.portfolios else load_saved_portfolios()
+        if not portfolios:
+            print("No portfolios to score.")
+            return
+        scores = score_portfolios(portfolios, days=args.days, queue=queue, n_workers=args.workers,
+                                  shard_size=args.shard_size, confidence_level=args.confidence_level,
+                                  timeout=args.timeout)
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        scores.to_csv(args.output)
+        print(f"Wrote {len(scores)} scores to {args.output}")
+        return
+
+    print(f"Loading price data for the last {args.days} days...")
+    context = ScoringContext.from_database(days=args.days)
+    print(f"Loaded {len(context.tickers)} tickers. Waiting for shards on the {queue_descriptor['kind']} queue...")
+    run_worker(queue, context)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+In-memory screening over the precomputed `ticker_stats` table.
+
+The table is small (one row per ticker), so we load it once and keep each
+metric as a NumPy array together with its argsort. A range filter is then two
+binary searches on the sorted values, and sorting the result is just walking
+the precomputed order, so a screen is a handful of vector operations rather
+than a database query or a pandas sort.
+"""
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from .models import TickerStat
+
+SCREEN_METRICS = ('volatility', 'beta', 'max_drawdown', 'return_1m', 'return_3m', 'return_1y', 'last_close')
+
+
+class TickerScreener:
+    """
+    Filters and sorts tickers by their summary statistics.
+    """
+    def __init__(self, stats: pd.DataFrame):
+        """
+        Args:
+            stats: A DataFrame indexed by ticker with the SCREEN_METRICS columns
+                   and an `is_etf` column (i.e. the `ticker_stats` table).
+        """
+        self.tickers = np.asarray(stats.index, dtype=object)
+        self.is_etf = stats['is_etf'].fillna(False).to_numpy(dtype=bool) if 'is_etf' in stats else np.zeros(len(stats), dtype=bool)
+        self.stats = stats
+
+        # For each metric: the values, the argsort (NaNs sort to the end) and
+        # the sorted values without the NaNs, ready for searchsorted.
+        self.values, self.order, self.sorted_values = {}, {}, {}
+        for metric in SCREEN_METRICS:
+            values = stats[metric].to_numpy(dtype=float) if metric in stats else np.full(len(stats), np.nan)
+            order = np.argsort(values, kind='stable')
+            n_valid = int((~np.isnan(values)).sum())
+            self.values[metric] = values
+            self.order[metric] = order
+            self.sorted_values[metric] = values[order[:n_valid]]
+
+    def _range_mask(self, metric, low=None, high=None) -> np.ndarray:
+        """Boolean mask of tickers with low <= metric <= high."""
+        sorted_values = self.sorted_values[metric]
+        start = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+        stop = len(sorted_values) if high is None else np.searchsorted(sorted_values, high, side='right')
+        mask = np.zeros(len(self.tickers), dtype=bool)
+        mask[self.order[metric][start:stop]] = True
+        return mask
+
+    def screen(self, filters: dict = None, sort_by='volatility', descending=False, limit=50, etf=None) -> pd.DataFrame:
+        """
+        Runs a screen.
+
+        Args:
+            filters: {metric: (min, max)}; either bound may be None.
+            sort_by: The metric to sort by. Tickers missing it go last.
+            descending: Sort largest first.
+            limit: Maximum number of rows to return.
+            etf: True for ETFs only, False for stocks only, None for both.
+
+        Returns:
+            The matching rows of the stats table, in order.
+        """
+        if sort_by not in SCREEN_METRICS:
+            raise ValueError(f"Can't sort by '{sort_by}'. Expected one of {SCREEN_METRICS}.")
+
+        mask = np.ones(len(self.tickers), dtype=bool)
+        for metric, (low, high) in (filters or {}).items():
+            if metric not in SCREEN_METRICS:
+                raise ValueError(f"Can't filter on '{metric}'. Expected one of {SCREEN_METRICS}.")
+            mask &= self._range_mask(metric, low, high)
+        if etf is not None:
+            mask &= self.is_etf == bool(etf)
+
+        order = self.order[sort_by]
+        if descending:
+            # Reverse the non-NaN part only, so missing values still go last.
+            n_valid = len(self.sorted_values[sort_by])
+            order = np.concatenate([order[:n_valid][::-1], order[n_valid:]])
+        selected = order[mask[order]][:limit]
+        return self.stats.iloc[selected]
+
+    @classmethod
+    def from_database(cls, db):
+        """Loads the `ticker_stats` table."""
+        stats = pd.read_sql(select(TickerStat), db.bind).set_index('ticker')
+        return cls(stats)
+
+
+_screener_cache = {'screener': None, 'loaded_at': 0.0}
+_screener_cache_lock = threading.Lock()
+
+def get_screener(db, max_age_seconds=3600) -> TickerScreener:
+    """
+    Returns a process-wide screener, reloading it from the database at most
+    once every `max_age_seconds` (the stats only change when ingestion runs).
+    The lock means concurrent requests share one reload instead of each
+    running their own.
+    """
+    with _screener_cache_lock:
+        if _screener_cache['screener'] is None or time.time() - _screener_cache['loaded_at'] > max_age_seconds:
+            _screener_cache['screener'] = TickerScreener.from_database(db)
+            _screener_cache['loaded_at'] = time.time()
+        return _screener_cache['screener']
@@ -0,0 +1,164 @@
+"""
+Saved portfolios and their precomputed risk snapshots.
+
+The nightly job (`automate_report.generate_snapshots`) computes value, VaR,
+ES and the P/L histogram for every saved portfolio and stores them. When a
+user loads a saved portfolio the next morning, we hand back the snapshot
+instead of recomputing. A snapshot is only used while its holdings hash
+still matches the portfolio's, so editing a portfolio falls back to a live
+calculation until the next nightly run. Reading risk never writes anything:
+only the nightly job stores snapshots, keeping the latest SNAPSHOTS_KEPT
+per portfolio.
+"""
+import hashlib
+import json
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from .models import RiskSnapshot, SavedPortfolio
+from .portfolio import PortfolioManager
+from .risk_engine import RiskEngine, bin_pl_distribution, expected_shortfall
+
+# Older snapshots are pruned whenever a new one is stored.
+SNAPSHOTS_KEPT = 7
+
+
+def normalize_holdings(holdings: dict) -> dict[str, float]:
+    """Drops empty positions and makes quantities plain floats, so equal portfolios hash the same."""
+    if not isinstance(holdings, dict) or not holdings:
+        raise ValueError("Holdings must be a non-empty dictionary.")
+    normalized = {str(t): float(q) for t, q in holdings.items() if q is not None and float(q) > 0}
+    if not normalized:
+        raise ValueError("Holdings must include at least one positive quantity.")
+    return normalized
+
+
+def holdings_fingerprint(holdings: dict) -> str:
+    """A stable hash of a portfolio's holdings."""
+    payload = json.dumps(normalize_holdings(holdings), sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def save_portfolio(db: Session, name: str, holdings: dict) -> SavedPortfolio:
+    """Creates a saved portfolio, or replaces the holdings of the one with this name."""
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("A portfolio name is required.")
+    holdings = normalize_holdings(holdings)
+    now = datetime.now()
+
+    portfolio = db.query(SavedPortfolio).filter(SavedPortfolio.name == name.strip()).first()
+    if portfolio is None:
+        portfolio = SavedPortfolio(name=name.strip(), created_at=now)
+        db.add(portfolio)
+    portfolio.holdings = holdings
+    portfolio.holdings_hash = holdings_fingerprint(holdings)
+    portfolio.updated_at = now
+    db.commit()
+    return portfolio
+
+
+def list_portfolios(db: Session) -> list[SavedPortfolio]:
+    return db.query(SavedPortfolio).order_by(SavedPortfolio.name).all()
+
+
+def compute_risk_snapshot(holdings: dict, confidence_level=0.95) -> dict:
+    """
+    Runs the usual live calculation for a portfolio and packages up everything
+    the dashboard shows. Raises ValueError if there's no market data at all.
+    """
+    pm = PortfolioManager(holdings)
+    risk_engine = RiskEngine(pm)
+
+    total_value = pm.calculate_total_market_value()
+    if total_value == 0:
+        raise ValueError("Could not find market data for any of the selected tickers.")
+    var_value, simulated_pl = risk_engine.calculate_historical_var(confidence_level=confidence_level)
+
+    return {
+        "total_market_value": float(total_value),
+        "var": float(var_value) if var_value is not None and not np.isnan(var_value) else None,
+        "es": expected_shortfall(simulated_pl, confidence_level),
+        "market_values_per_stock": {str(k): float(v) for k, v in pm.market_values.items()},
+        "pl_histogram": bin_pl_distribution(simulated_pl),
+        "confidence_level": confidence_level,
+    }
+
+
+def store_snapshot(db: Session, portfolio: SavedPortfolio, snapshot: dict, as_of=None, keep=SNAPSHOTS_KEPT) -> RiskSnapshot:
+    """Writes a computed snapshot for a saved portfolio and prunes all but its latest `keep`."""
+    row = RiskSnapshot(
+        portfolio_id=portfolio.id,
+        as_of=as_of or datetime.now(),
+        holdings_hash=portfolio.holdings_hash,
+        confidence_level=snapshot.get("confidence_level", 0.95),
+        total_market_value=snapshot["total_market_value"],
+        var=snapshot["var"],
+        es=snapshot["es"],
+        market_values=snapshot["market_values_per_stock"],
+        pl_histogram=snapshot["pl_histogram"],
+    )
+    db.add(row)
+    db.flush()
+    prune_snapshots(db, portfolio, keep)
+    db.commit()
+    return row
+
+
+def prune_snapshots(db: Session, portfolio: SavedPortfolio, keep=SNAPSHOTS_KEPT) -> int:
+    """Deletes all but the latest `keep` snapshots of a portfolio. Returns how many went."""
+    stale = db.query(RiskSnapshot.id)\
+        .filter(RiskSnapshot.portfolio_id == portfolio.id)\
+        .order_by(RiskSnapshot.as_of.desc(), RiskSnapshot.id.desc())\
+        .offset(keep)\
+        .all()
+    if not stale:
+        return 0
+    return db.query(RiskSnapshot)\
+        .filter(RiskSnapshot.id.in_([row.id for row in stale]))\
+        .delete(synchronize_session=False)
+
+
+def latest_snapshot(db: Session, portfolio: SavedPortfolio, confidence_level=0.95):
+    """The most recent snapshot that still matches the portfolio's holdings, or None."""
+    return db.query(RiskSnapshot)\
+        .filter(RiskSnapshot.portfolio_id == portfolio.id)\
+        .filter(RiskSnapshot.holdings_hash == portfolio.holdings_hash)\
+        .filter(RiskSnapshot.confidence_level == confidence_level)\
+        .order_by(RiskSnapshot.as_of.desc())\
+        .first()
+
+
+def snapshot_to_response(snapshot: RiskSnapshot) -> dict:
+    """Turns a stored snapshot into the same shape as the /api/risk response."""
+    return {
+        "total_market_value": snapshot.total_market_value,
+        "var": snapshot.var,
+        "es": snapshot.es,
+        "market_values_per_stock": snapshot.market_values or {},
+        "pl_histogram": snapshot.pl_histogram or {"bin_edges": [], "counts": []},
+        "as_of": snapshot.as_of.isoformat(),
+        "source": "snapshot",
+    }
+
+
+def get_portfolio_risk(db: Session, portfolio: SavedPortfolio, holdings: dict = None, compute=compute_risk_snapshot) -> dict:
+    """
+    Risk numbers for a saved portfolio: the stored snapshot if it's still
+    current, otherwise a live calculation. Never writes to the database;
+    snapshots come from the nightly job.
+
+    Args:
+        holdings: The holdings as currently shown in the dashboard. If they
+                  differ from what's saved, those are what we compute.
+    """
+    if holdings is not None and holdings_fingerprint(holdings) != portfolio.holdings_hash:
+        return {**compute(holdings), "as_of": datetime.now().isoformat(), "source": "live"}
+
+    snapshot = latest_snapshot(db, portfolio)
+    if snapshot is not None:
+        return snapshot_to_response(snapshot)
+
+    # No usable snapshot yet (new or edited portfolio).
+    return {**compute(portfolio.holdings), "as_of": datetime.now().isoformat(), "source": "live"}
@@ -0,0 +1,213 @@
+"""
+Per-ticker summary statistics for the whole universe, in one vectorized pass.
+
+Rather than running a RiskEngine per ticker, we line every ticker's closes up
+in one (dates x tickers) array and compute volatility, beta, max drawdown and
+trailing returns for all of them at once. Tickers stop trading on different
+days, so each one's trailing windows are anchored at its own last price by
+gathering rows with index arrays, rather than by slicing.
+"""
+import glob
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from .return_matrix import forward_fill_inplace
+
+TRADING_DAYS = 252
+RETURN_HORIZONS = {'return_1m': 21, 'return_3m': 63, 'return_1y': 252}
+
+# The raw archive has bad prints: zero and sub-cent closes, and one-day jumps
+# that reverse the next day. Closes at or below MIN_CLOSE are treated as
+# missing, and so are spikes: a move outside DAILY_RETURN_BOUNDS that comes
+# back within bounds of the pre-spike close within SPIKE_MAX_DAYS prints.
+# Either would swamp a ticker's volatility, beta, drawdown and trailing
+# returns. A move that doesn't come back is kept as a level change, but its
+# daily return is still left out of volatility and beta.
+MIN_CLOSE = 0.01
+DAILY_RETURN_BOUNDS = (-0.75, 3.0)
+SPIKE_MAX_DAYS = 5
+# Volatility and beta need this many daily returns in the window.
+MIN_OBSERVATIONS = 60
+# Anything outside these is a data problem rather than a real statistic, so
+# it's stored as NULL instead of topping the screener.
+STAT_BOUNDS = {
+    'volatility': (0.0, 5.0),
+    'beta': (-10.0, 10.0),
+    'max_drawdown': (-1.0, 0.0),
+    'return_1m': (-1.0, 10.0),
+    'return_3m': (-1.0, 20.0),
+    'return_1y': (-1.0, 50.0),
+}
+STAT_COLUMNS = ['last_date', 'last_close', 'volatility', 'beta', 'max_drawdown',
+                'return_1m', 'return_3m', 'return_1y', 'n_days']
+
+
+def read_close_prices(data_dirs) -> tuple[pd.DataFrame, set[str]]:
+    """
+    Reads the Close column from every CSV in `data_dirs` into one wide DataFrame.
+
+    Returns:
+        The (dates x tickers) closes and the set of tickers that came from an
+        'etfs' directory.
+    """
+    series, etfs = [], set()
+    for data_dir in data_dirs:
+        is_etf_dir = os.path.basename(os.path.normpath(data_dir)) == 'etfs'
+        for filename in sorted(glob.glob(os.path.join(data_dir, "*.csv"))):
+            ticker = os.path.basename(filename).split('.')[0]
+            try:
+                df = pd.read_csv(filename, usecols=['Date', 'Close'], parse_dates=['Date'])
+            except Exception as e:
+                print(f"  Could not read {filename}. Error: {e}")
+                continue
+            series.append(df.set_index('Date')['Close'].rename(ticker))
+            if is_etf_dir:
+                etfs.add(ticker)
+
+    if not series:
+        return pd.DataFrame(), etfs
+    closes = pd.concat(series, axis=1).sort_index()
+    # A ticker in both folders would give duplicate columns; keep the first.
+    return closes.loc[:, ~closes.columns.duplicated()], etfs
+
+
+def _trailing_window(values: np.ndarray, last_idx: np.ndarray, first_idx: np.ndarray, window: int) -> np.ndarray:
+    """
+    Gathers the last `window` rows of each column, ending at that column's own
+    `last_idx`, as a (window x columns) array. Rows before `first_idx` are NaN.
+    """
+    offsets = np.arange(window - 1, -1, -1)[:, None]
+    rows = last_idx[None, :] - offsets
+    cols = np.arange(values.shape[1])[None, :]
+    gathered = values[np.clip(rows, 0, None), cols]
+    gathered[rows < first_idx[None, :]] = np.nan
+    return gathered
+
+
+def _reject_spikes(prices: np.ndarray):
+    """
+    Sets short-lived spikes (see SPIKE_MAX_DAYS) to NaN, in place, so they're
+    forward-filled over like any other missing close. Only the few moves
+    outside DAILY_RETURN_BOUNDS are looked at one by one.
+    """
+    low, high = DAILY_RETURN_BOUNDS
+    for c in range(prices.shape[1]):
+        column = prices[:, c]
+        rows = np.flatnonzero(~np.isnan(column))
+        values = column[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            moves = values[1:] / values[:-1] - 1
+        jumps = np.flatnonzero(~((moves >= low) & (moves <= high))) + 1
+        resume = 0
+        for k in jumps:
+            if k <= resume:
+                continue  # Part of a spike we've already removed.
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ahead = values[k + 1:k + 1 + SPIKE_MAX_DAYS] / values[k - 1] - 1
+            back = np.flatnonzero((ahead >= low) & (ahead <= high))
+            if len(back):
+                resume = k + 1 + back[0]
+                column[rows[k:resume]] = np.nan
+
+
+def compute_ticker_stats(closes: pd.DataFrame, benchmark: str = None, window=TRADING_DAYS) -> pd.DataFrame:
+    """
+    Computes summary statistics for every column of `closes` at once.
+
+    Bad prints are cleaned up first (see MIN_CLOSE and DAILY_RETURN_BOUNDS),
+    volatility and beta need MIN_OBSERVATIONS returns, and any statistic that
+    is non-finite or outside STAT_BOUNDS comes back as NaN.
+
+    Args:
+        closes: (dates x tickers) closing prices, NaN where a ticker wasn't trading.
+        benchmark: Ticker to measure beta against. If it's missing, an
+                   equal-weighted average of all tickers is used as the market.
+        window: Trading days used for volatility and beta.
+
+    Returns:
+        A DataFrame indexed by ticker with the columns in STAT_COLUMNS.
+    """
+    if closes.empty:
+        return pd.DataFrame(columns=STAT_COLUMNS)
+
+    dates = closes.index
+    prices = closes.to_numpy(dtype=float, copy=True)
+    with np.errstate(invalid='ignore'):
+        prices[~(prices > MIN_CLOSE)] = np.nan
+    _reject_spikes(prices)
+    observed = ~np.isnan(prices)
+    has_data = observed.any(axis=0)
+    first_idx = np.argmax(observed, axis=0)
+    last_idx = len(prices) - 1 - np.argmax(observed[::-1], axis=0)
+    n_days = observed.sum(axis=0)
+
+    forward_fill_inplace(prices)
+    cols = np.arange(prices.shape[1])
+    last_close = prices[last_idx, cols]
+
+    # Daily returns, with row t being the return into date t (row 0 is NaN).
+    returns = np.full_like(prices, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(prices[1:], prices[:-1], out=returns[1:])
+    returns[1:] -= 1
+    low, high = DAILY_RETURN_BOUNDS
+    with np.errstate(invalid='ignore'):
+        returns[~((returns >= low) & (returns <= high))] = np.nan
+
+    # Volatility and beta over each ticker's own trailing window. Returns are
+    # only defined from the day after the first price, hence first_idx + 1.
+    window_returns = _trailing_window(returns, last_idx, first_idx + 1, window)
+    # Tickers with too little history just get NaN, so the all-NaN warnings are noise.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        volatility = np.nanstd(window_returns, axis=0, ddof=1) * np.sqrt(TRADING_DAYS)
+    volatility[(~np.isnan(window_returns)).sum(axis=0) < MIN_OBSERVATIONS] = np.nan
+
+    if benchmark is not None and benchmark in closes.columns:
+        market = returns[:, closes.columns.get_loc(benchmark)]
+    else:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            market = np.nanmean(np.where(observed, returns, np.nan), axis=1)
+    window_market = _trailing_window(np.broadcast_to(market[:, None], returns.shape), last_idx, first_idx + 1, window)
+    valid = ~np.isnan(window_returns) & ~np.isnan(window_market)
+    count = valid.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.where(valid, window_returns, 0.0)
+        m = np.where(valid, window_market, 0.0)
+        r_dev = np.where(valid, r - r.sum(axis=0) / count, 0.0)
+        m_dev = np.where(valid, m - m.sum(axis=0) / count, 0.0)
+        beta = (r_dev * m_dev).sum(axis=0) / (m_dev ** 2).sum(axis=0)
+    beta[count < MIN_OBSERVATIONS] = np.nan
+
+    # Max drawdown over the whole history (running peak ignores leading NaNs).
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        drawdown = np.fmax.accumulate(prices, axis=0)
+        np.divide(prices, drawdown, out=drawdown)
+        max_drawdown = np.nanmin(drawdown, axis=0) - 1
+        del drawdown
+
+    stats = {
+        'last_date': dates[last_idx].date,
+        'last_close': last_close,
+        'volatility': volatility,
+        'beta': beta,
+        'max_drawdown': max_drawdown,
+        'n_days': n_days,
+    }
+    for name, horizon in RETURN_HORIZONS.items():
+        start = last_idx - horizon
+        start_price = prices[np.clip(start, 0, None), cols]
+        stats[name] = np.where(start >= first_idx, last_close / start_price - 1, np.nan)
+
+    for name, (low, high) in STAT_BOUNDS.items():
+        values = np.asarray(stats[name], dtype=float)
+        with np.errstate(invalid='ignore'):
+            stats[name] = np.where((values >= low) & (values <= high), values, np.nan)
+
+    result = pd.DataFrame(stats, index=pd.Index(closes.columns, name='ticker'))[STAT_COLUMNS]
+    return result[has_data]
@@ -43,6 +43,31 @@ def test_calculate_risk_success(mock_risk_engine, mock_portfolio_manager, client
     mock_pm_instance.calculate_total_market_value.assert_called_once()
     mock_re_instance.calculate_historical_var.assert_called_once_with()
 
+@patch('src.app.PortfolioManager')
+@patch('src.app.RiskEngine')
+def test_calculate_risk_filtered(mock_risk_engine, mock_portfolio_manager, client):
+    """Test that method=ewma/garch uses filtered historical simulation and unknown methods are a 400."""
+    mock_pm_instance = MagicMock()
+    mock_pm_instance.calculate_total_market_value.return_value = 100000.0
+    mock_pm_instance.market_values = {"AAPL": 100000.0}
+    mock_portfolio_manager.return_value = mock_pm_instance
+    mock_re_instance = mock_risk_engine.return_value
+    mock_re_instance.calculate_filtered_var.return_value = (7000.0, [100.0, -300.0])
+
+    response = client.post('/api/risk', json={"portfolio": {"AAPL": 500}, "method": "garch"})
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['method'] == 'garch'
+    assert data['var'] == 7000.0
+    assert data['simulated_pl'] == [100.0, -300.0]
+    mock_re_instance.calculate_filtered_var.assert_called_once_with(method='garch')
+    mock_re_instance.calculate_historical_var.assert_not_called()
+
+    response = client.post('/api/risk', json={"portfolio": {"AAPL": 500}, "method": "monte-carlo"})
+    assert response.status_code == 400
+    assert 'method' in response.get_json()['error']
+
 def test_calculate_risk_invalid_input(client):
     """
     Test the /api/risk endpoint with invalid input (missing 'portfolio' key).
@@ -66,4 +91,171 @@ def test_calculate_risk_type_error(mock_portfolio_manager, client):
     assert response.status_code == 400
     data = response.get_json()
     assert "error" in data
-    assert "Invalid portfolio type" in data['error']
\ No newline at end of file
+    assert "Invalid portfolio type" in data['error']
+
+@patch('src.app.PortfolioManager')
+@patch('src.app.RiskEngine')
+def test_calculate_risk_histogram_only(mock_risk_engine, mock_portfolio_manager, client):
+    """
+    Test that the dashboard can ask for just the binned P/L instead of every simulated value.
+    """
+    mock_pm_instance = MagicMock()
+    mock_pm_instance.calculate_total_market_value.return_value = 1000.0
+    mock_pm_instance.market_values = {"AAPL": 1000.0}
+    mock_portfolio_manager.return_value = mock_pm_instance
+    mock_risk_engine.return_value.calculate_historical_var.return_value = (50.0, np.linspace(-100, 100, 252))
+
+    payload = {"portfolio": {"AAPL": 10}, "include_simulated_pl": False}
+    response = client.post('/api/risk', data=json.dumps(payload), content_type='application/json')
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert 'simulated_pl' not in data
+    assert sum(data['pl_histogram']['counts']) == 252
+    assert len(data['pl_histogram']['bin_edges']) == len(data['pl_histogram']['counts']) + 1
+
+def test_get_figures_is_cached():
+    """
+    Test that figures are built once per distinct result and reused after that.
+    """
+    from src.app import get_figures
+    data = {
+        "var": 50.0,
+        "market_values_per_stock": {"AAPL": 600.0, "GOOG": 400.0},
+        "pl_histogram": {"bin_edges": [-100.0, 0.0, 100.0], "counts": [1, 3]}
+    }
+
+    figures = get_figures(data)
+    assert figures['pie']['data'][0]['values'] == [600.0, 400.0]
+    assert figures['pl']['layout']['shapes'][0]['x0'] == -50.0
+    assert get_figures(dict(data)) is figures
+    assert get_figures({**data, "var": 60.0}) is not figures
+
+def test_get_figures_from_many_threads():
+    """
+    Test that concurrent callbacks can share the figure cache without corrupting it.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from src import app as app_module
+    results = [
+        {"var": float(i % 300), "market_values_per_stock": {"AAPL": 1.0},
+         "pl_histogram": {"bin_edges": [-1.0, 0.0, 1.0], "counts": [1, 1]}}
+        for i in range(2000)
+    ]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        figures = list(pool.map(app_module.get_figures, results))
+
+    assert all(f['pl']['layout']['shapes'][0]['x0'] == -r['var'] for f, r in zip(figures, results))
+    assert len(app_module._figure_cache) <= app_module.FIGURE_CACHE_SIZE
+
+@pytest.fixture
+def saved_db(tmp_path):
+    """
+    Points the app's real `get_db` at a throwaway database for the
+    saved-portfolio endpoints, so sessions are opened and closed as in production.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from src.models import Base
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    session = session_factory()
+    with patch('src.models.SessionLocal', session_factory):
+        yield session
+    session.close()
+
+def test_saved_portfolios_endpoints(client, saved_db):
+    """Test saving, listing and loading risk for a saved portfolio."""
+    response = client.post('/api/portfolios', json={'name': 'Tech', 'portfolio': {'AAPL': 10}})
+    assert response.status_code == 200
+    portfolio_id = response.get_json()['id']
+
+    listed = client.get('/api/portfolios').get_json()['portfolios']
+    assert [p['name'] for p in listed] == ['Tech']
+
+    snapshot = {"total_market_value": 1000.0, "var": 50.0, "es": 70.0, "market_values_per_stock": {"AAPL": 1000.0},
+                "pl_histogram": {"bin_edges": [-1.0, 1.0], "counts": [2]}, "confidence_level": 0.95}
+    mock_compute = MagicMock(return_value=snapshot)
+    from src.models import RiskSnapshot, SavedPortfolio
+    from src.snapshots import get_portfolio_risk, store_snapshot
+    with patch('src.app.get_portfolio_risk', side_effect=lambda db, p, holdings=None: get_portfolio_risk(db, p, holdings, compute=mock_compute)):
+        # Without a nightly snapshot every GET is live, and none of them store anything.
+        first = client.get(f'/api/portfolios/{portfolio_id}/risk').get_json()
+        assert client.get(f'/api/portfolios/{portfolio_id}/risk').get_json()['source'] == 'live'
+        assert saved_db.query(RiskSnapshot).count() == 0
+
+        store_snapshot(saved_db, saved_db.get(SavedPortfolio, portfolio_id), snapshot)
+        second = client.get(f'/api/portfolios/{portfolio_id}/risk').get_json()
+
+    assert first['source'] == 'live'
+    assert second['source'] == 'snapshot'
+    assert second['var'] == 50.0
+    assert second['holdings'] == {'AAPL': 10.0}
+    assert mock_compute.call_count == 2
+
+    assert client.get('/api/portfolios/999/risk').status_code == 404
+    assert client.post('/api/portfolios', json={'name': 'Empty', 'portfolio': {'AAPL': 0}}).status_code == 400
+
+def test_save_portfolio_rejects_bad_input(client, saved_db):
+    """Test that a non-string name or a malformed portfolio is a 400, not a 500."""
+    from src.models import SavedPortfolio
+    for payload in [{'name': 5, 'portfolio': {'AAPL': 10}},
+                    {'name': '   ', 'portfolio': {'AAPL': 10}},
+                    {'name': 'Tech', 'portfolio': ['AAPL']},
+                    {'name': 'Tech', 'portfolio': {'AAPL': 'ten'}},
+                    {'name': 'Tech', 'portfolio': {'AAPL': True}},
+                    {'name': 'Tech'}]:
+        response = client.post('/api/portfolios', json=payload)
+        assert response.status_code == 400, payload
+        assert 'error' in response.get_json()
+    assert client.post('/api/portfolios', data='not json', content_type='application/json').status_code == 400
+    assert saved_db.query(SavedPortfolio).count() == 0
+
+def test_saved_portfolio_list_callback_reads_the_database(saved_db):
+    """Test that filling in the saved-portfolio dropdown doesn't make an HTTP request to ourselves."""
+    from src.app import save_current_portfolio
+    with patch('src.app.requests') as mock_requests:
+        options, _ = save_current_portfolio(None, None, [], [])
+        assert options == []
+        options, status = save_current_portfolio(1, 'Tech', [{'index': 'AAPL'}], [10])
+
+    assert options == [{'label': 'Tech', 'value': 1}]
+    assert "Saved 'Tech'" in status.children
+    assert not mock_requests.method_calls
+
+def test_risk_rollup_rejects_bad_tags(client):
+    """Test that tags that aren't a {ticker: tag} object are a 400, not a 500."""
+    for url, payload in [('/api/risk/rollup', {'portfolio': {'AAPL': 10}}),
+                         ('/api/risk/rollup/batch', {'portfolios': {'tech': {'AAPL': 10}}})]:
+        for tags in ['tech', ['AAPL'], {'AAPL': 3}]:
+            response = client.post(url, json={**payload, 'tags': tags})
+            assert response.status_code == 400, (url, tags)
+            assert 'tags' in response.get_json()['error']
+
+def test_risk_rollup_batch(client):
+    """Test the firm-wide batch rollup endpoint."""
+    rollup_df = pd.DataFrame(
+        {'market_value': [100.0, 300.0, 400.0], 'standalone_var': [5.0, 9.0, 12.0], 'component_var': [5.0, 9.0, 12.0]},
+        index=pd.MultiIndex.from_tuples([('tech', 'NYSE'), ('search', 'NYSE'), ('Firm total', 'NYSE')], names=['portfolio', 'group'])
+    )
+    with patch('src.app.calculate_grouped_risk_many', return_value=rollup_df) as mock_rollup:
+        response = client.post('/api/risk/rollup/batch', json={'portfolios': {'tech': {'AAPL': 1}, 'search': {'GOOG': 3}}})
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['portfolios']['Firm total']['NYSE']['market_value'] == 400.0
+    assert data['portfolios']['tech']['NYSE']['standalone_var'] == 5.0
+    mock_rollup.assert_called_once_with({'tech': {'AAPL': 1}, 'search': {'GOOG': 3}}, group_by='listing_exchange', tags=None)
+
+    assert client.post('/api/risk/rollup/batch', json={'portfolios': {'tech': {'AAPL': 'ten'}}}).status_code == 400
+    assert client.post('/api/risk/rollup/batch', json={'portfolios': []}).status_code == 400
+
+def test_screen_rejects_non_positive_limit(client):
+    """Test that a zero or negative limit is a 400 rather than a negative slice."""
+    with patch('src.app.get_screener') as mock_get_screener, patch('src.app.get_db', side_effect=lambda: iter([MagicMock()])):
+        for limit in [0, -45]:
+            response = client.get(f'/api/screen?limit={limit}')
+            assert response.status_code == 400
+            assert 'limit' in response.get_json()['error']
+    mock_get_screener.assert_not_called()
@@ -0,0 +1,140 @@
+import pytest
+import numpy as np
+import pandas as pd
+from src.return_matrix import ReturnMatrix
+from src.filtered_simulation import (
+    FHS_DAYS, FilteredSimulation, ewma_variance, garch_variance, fit_garch, fit_cached,
+    get_universe_simulation, precompute_universe, universe_cache_path
+)
+
+def simulate_garch(omega, alpha, beta, n_days, seed=0):
+    """Simulates GARCH(1,1) returns, one column per parameter set."""
+    rng = np.random.default_rng(seed)
+    variance = omega / (1 - alpha - beta)
+    returns = np.empty((n_days, len(omega)))
+    for t in range(n_days):
+        returns[t] = np.sqrt(variance) * rng.standard_normal(len(omega))
+        variance = omega + alpha * returns[t] ** 2 + beta * variance
+    return returns
+
+@pytest.fixture
+def garch_returns():
+    omega = np.array([2e-6, 5e-6, 1e-6])
+    alpha = np.array([0.05, 0.10, 0.08])
+    beta = np.array([0.92, 0.85, 0.90])
+    returns = simulate_garch(omega, alpha, beta, 3000)
+    return ReturnMatrix(returns, ['A', 'B', 'C'], pd.bdate_range('2012-01-02', periods=len(returns))), alpha, beta
+
+def test_ewma_variance_matches_recursion():
+    """Test the lfilter version against the plain recursion."""
+    rng = np.random.default_rng(1)
+    returns = rng.normal(0, 0.01, (50, 4))
+
+    expected = np.empty((51, 4))
+    expected[0] = (returns ** 2).mean(axis=0)
+    for t in range(50):
+        expected[t + 1] = 0.94 * expected[t] + 0.06 * returns[t] ** 2
+
+    np.testing.assert_allclose(ewma_variance(returns, 0.94), expected)
+
+def test_fit_garch_recovers_parameters(garch_returns):
+    """Test that the vectorized grid search lands near the true parameters for every ticker."""
+    returns, alpha, beta = garch_returns
+    params = fit_garch(returns.values)
+
+    np.testing.assert_allclose(params['alpha'], alpha, atol=0.04)
+    np.testing.assert_allclose(params['alpha'] + params['beta'], alpha + beta, atol=0.03)
+
+@pytest.mark.parametrize('method', ['ewma', 'garch'])
+def test_residuals_are_devolatilized(garch_returns, method):
+    """Test that residuals have roughly unit variance and rescale back to the current volatility."""
+    returns, _, _ = garch_returns
+    simulation = FilteredSimulation.fit(returns, method)
+
+    np.testing.assert_allclose(simulation.residuals.std(axis=0), 1.0, atol=0.1)
+    scenarios = simulation.scenario_returns()
+    np.testing.assert_allclose(scenarios.std(axis=0), simulation.current_vol, rtol=0.1)
+
+    weights = {'A': 1000.0, 'C': 500.0, 'MISSING': 1.0}
+    np.testing.assert_allclose(simulation.portfolio_pl(weights), scenarios[:, 0] * 1000 + scenarios[:, 2] * 500)
+
+def test_filtered_scenarios_follow_the_current_regime():
+    """Test that a calm history under a volatile present is scaled up (and the other way round)."""
+    rng = np.random.default_rng(4)
+    calm_then_wild = np.r_[rng.normal(0, 0.005, 400), rng.normal(0, 0.03, 100)]
+    wild_then_calm = calm_then_wild[::-1]
+    returns = ReturnMatrix(np.c_[calm_then_wild, wild_then_calm], ['UP', 'DOWN'], pd.bdate_range('2020-01-01', periods=500))
+
+    simulation = FilteredSimulation.fit(returns, 'ewma')
+    plain_vol = returns.values.std(axis=0)
+    assert simulation.current_vol[0] > 1.5 * plain_vol[0]
+    assert simulation.current_vol[1] < 0.5 * plain_vol[1]
+
+@pytest.mark.parametrize('method', ['ewma', 'garch'])
+def test_late_listing_is_fitted_on_its_own_history(garch_returns, method):
+    """Test that leading NaNs in one column don't change any other column's fit, or its own."""
+    returns, _, _ = garch_returns
+    values = returns.values.copy()
+    values[:2500, 1] = np.nan  # B only listed for the last 500 days.
+    ragged = FilteredSimulation.fit(ReturnMatrix(values, returns.tickers, returns.dates), method)
+
+    full = FilteredSimulation.fit(ReturnMatrix(values[:, [0, 2]], ['A', 'C'], returns.dates), method)
+    alone = FilteredSimulation.fit(ReturnMatrix(values[2500:, [1]], ['B'], returns.dates[2500:]), method)
+    np.testing.assert_allclose(ragged.residuals[:, [0, 2]], full.residuals)
+    np.testing.assert_allclose(ragged.residuals[2500:, 1], alone.residuals[:, 0])
+    assert np.isnan(ragged.residuals[:2500, 1]).all()
+    assert list(ragged.valid_from) == [0, 2500, 0]
+
+    assert len(ragged.portfolio_pl({'A': 1.0})) == 3000
+    assert len(ragged.portfolio_pl({'A': 1.0, 'B': 1.0})) == 500
+    assert np.isfinite(ragged.portfolio_pl({'A': 1.0, 'B': 1.0})).all()
+
+def test_precompute_universe_keeps_full_history_with_a_late_listing(tmp_path, monkeypatch):
+    """Test that a recently listed ticker doesn't cut the nightly universe fit short."""
+    from sqlalchemy import create_engine
+    monkeypatch.setenv('FHS_CACHE_DIR', str(tmp_path))
+    engine = create_engine("sqlite://")
+    rng = np.random.default_rng(8)
+    dates = pd.bdate_range('2021-01-04', periods=FHS_DAYS + 50).date
+    frames = []
+    for ticker, n_days in [('OLD1', len(dates)), ('OLD2', len(dates)), ('NEW', 120), ('TINY', 20)]:
+        closes = 100 * np.cumprod(1 + rng.normal(0, 0.01, n_days))
+        frames.append(pd.DataFrame({'ticker': ticker, 'date': dates[-n_days:], 'close': closes}))
+    pd.concat(frames).to_sql('historical_prices', engine, index=False)
+
+    precompute_universe(engine, methods=('ewma',))
+    simulation = get_universe_simulation('ewma')
+
+    assert simulation.residuals.shape == (FHS_DAYS, 3)
+    assert simulation.tickers == ['NEW', 'OLD1', 'OLD2']
+    assert not simulation.covers(['TINY'])
+    assert len(simulation.portfolio_pl({'OLD1': 1.0, 'OLD2': 1.0})) == FHS_DAYS
+    assert len(simulation.portfolio_pl({'OLD1': 1.0, 'NEW': 1.0})) == 119
+
+def test_garch_variance_forecast_shape(garch_returns):
+    returns, alpha, beta = garch_returns
+    variance = garch_variance(returns.values, np.full(3, 1e-6), alpha, beta)
+    assert variance.shape == (len(returns.values) + 1, 3)
+    assert np.all(variance > 0)
+
+def test_caches(garch_returns, tmp_path, monkeypatch):
+    """Test the in-process cache and the nightly on-disk universe cache."""
+    returns, _, _ = garch_returns
+    assert fit_cached(returns, 'ewma') is fit_cached(returns, 'ewma')
+    # Same tickers, dates and shape but a corrected price: that's a new fit.
+    revised = returns.values.copy()
+    revised[-1, 0] += 0.01
+    revised = ReturnMatrix(revised, returns.tickers, returns.dates)
+    assert fit_cached(revised, 'ewma') is not fit_cached(returns, 'ewma')
+
+    monkeypatch.setenv('FHS_CACHE_DIR', str(tmp_path))
+    assert get_universe_simulation('ewma', days=500) is None
+
+    fitted = FilteredSimulation.fit(returns, 'garch')
+    fitted.save(universe_cache_path('garch', days=500))
+    loaded = get_universe_simulation('garch', days=500)
+
+    assert loaded.tickers == fitted.tickers and loaded.method == 'garch'
+    np.testing.assert_array_equal(loaded.residuals, fitted.residuals)
+    np.testing.assert_array_equal(loaded.params['alpha'], fitted.params['alpha'])
+    assert get_universe_simulation('garch', days=500) is loaded
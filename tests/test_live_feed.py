@@ -0,0 +1,103 @@
+import json
+import pytest
+import pandas as pd
+import numpy as np
+from src.live_feed import LiveFeed, LiveRiskBook, replay_csv_ticks, stream_book_events
+
+@pytest.fixture
+def returns():
+    """A year of deterministic daily returns for three tickers."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(rng.normal(0, 0.02, size=(252, 3)), columns=['AAPL', 'MSFT', 'GOOG'])
+
+@pytest.fixture
+def book(returns):
+    return LiveRiskBook({'AAPL': 10, 'MSFT': 5, 'FAKE': 3}, {'AAPL': 150.0, 'MSFT': 300.0}, returns)
+
+def full_recompute(portfolio, prices, returns):
+    """The non-incremental answer: value and VaR from scratch."""
+    values = pd.Series({t: portfolio[t] * prices[t] for t in prices})
+    pl = (returns[values.index] * values).sum(axis=1)
+    return values.sum(), -pl.quantile(0.05)
+
+def test_book_initial_state(book, returns):
+    """Test that a new book matches a full calculation and skips tickers with no price."""
+    assert book.tickers == ['AAPL', 'MSFT']
+    total, var = full_recompute({'AAPL': 10, 'MSFT': 5}, {'AAPL': 150.0, 'MSFT': 300.0}, returns)
+    assert np.isclose(book.total_value, total)
+    assert np.isclose(book.var(), var)
+
+def test_ticks_update_incrementally(book, returns):
+    """Test that incremental tick updates agree with recomputing from scratch."""
+    assert book.apply_tick('AAPL', 155.0)
+    assert book.apply_tick('MSFT', 290.0)
+    assert book.apply_tick('AAPL', 152.5)
+    assert not book.apply_tick('GOOG', 100.0)
+
+    total, var = full_recompute({'AAPL': 10, 'MSFT': 5}, {'AAPL': 152.5, 'MSFT': 290.0}, returns)
+    assert np.isclose(book.total_value, total)
+    assert np.isclose(book.var(), var)
+    assert book.snapshot()['ticks_applied'] == 3
+
+def test_feed_routes_ticks_to_holders(returns):
+    """Test that a tick only touches the books that hold its ticker and pushes one update each."""
+    feed = LiveFeed()
+    aapl_book = feed.open_book(LiveRiskBook({'AAPL': 1}, {'AAPL': 100.0}, returns))
+    goog_book = feed.open_book(LiveRiskBook({'GOOG': 1}, {'GOOG': 100.0}, returns))
+    q = feed.broadcaster.subscribe(aapl_book)
+
+    touched = feed.ingest([{'ticker': 'AAPL', 'price': 101}, {'ticker': 'AAPL', 'price': 102}])
+
+    assert touched == {aapl_book}
+    assert feed.books[goog_book].ticks_applied == 0
+    assert q.get_nowait()['total_market_value'] == 102.0
+    assert q.empty()
+
+    with pytest.raises(ValueError):
+        feed.ingest([{'ticker': 'AAPL', 'price': 103}, {'ticker': 'AAPL', 'price': -1}])
+    assert feed.books[aapl_book].total_value == 102.0
+
+def test_stream_book_events_closes_book(returns):
+    """Test the SSE stream sends a snapshot first and closes the book when the client goes away."""
+    feed = LiveFeed()
+    book_id = feed.open_book(LiveRiskBook({'AAPL': 2}, {'AAPL': 50.0}, returns))
+
+    stream = stream_book_events(feed, book_id, heartbeat_seconds=0.01)
+    first = next(stream)
+    assert first.startswith('data: ')
+    assert json.loads(first[len('data: '):])['total_market_value'] == 100.0
+    assert next(stream) == ": keep-alive\n\n"
+
+    stream.close()
+    assert book_id not in feed.books
+
+def test_replay_csv_ticks(tmp_path):
+    """Test that the CSV replay yields one batch per date, in date order."""
+    (tmp_path / 'AAA.csv').write_text("Date,Open,Close\n2020-01-02,1,10\n2020-01-03,1,11\n")
+    (tmp_path / 'BBB.csv').write_text("Date,Open,Close\n2020-01-03,1,20\n2020-01-06,1,21\n")
+
+    batches = list(replay_csv_ticks(['BBB', 'AAA', 'ZZZ'], data_dirs=[str(tmp_path)], start='2020-01-03'))
+
+    assert [b[0]['timestamp'][:10] for b in batches] == ['2020-01-03', '2020-01-06']
+    assert batches[0] == [
+        {'ticker': 'AAA', 'price': 11.0, 'timestamp': '2020-01-03T00:00:00'},
+        {'ticker': 'BBB', 'price': 20.0, 'timestamp': '2020-01-03T00:00:00'},
+    ]
+
+def test_unsubscribed_books_are_reaped(returns):
+    """Test that a book nobody subscribes to is closed after the idle TTL, but a watched one isn't."""
+    now = [0.0]
+    feed = LiveFeed(idle_ttl_seconds=60, clock=lambda: now[0])
+    orphan = feed.open_book(LiveRiskBook({'AAPL': 1}, {'AAPL': 100.0}, returns))
+    watched = feed.open_book(LiveRiskBook({'AAPL': 1}, {'AAPL': 100.0}, returns))
+    feed.broadcaster.subscribe(watched)
+
+    now[0] = 30.0
+    assert feed.reap_idle_books() == []
+
+    now[0] = 61.0
+    feed.ingest([{'ticker': 'AAPL', 'price': 101}])
+    assert orphan not in feed.books
+    assert watched in feed.books
+    assert feed.snapshot(watched)['total_market_value'] == 101.0
+    assert feed.snapshot(orphan) is None
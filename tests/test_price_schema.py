@@ -0,0 +1,113 @@
+import os
+import pytest
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+from src.price_schema import (
+    explain_latest_price, is_managed, load_prices, migrate_historical_prices
+)
+
+@pytest.fixture
+def engine(tmp_path):
+    """A throwaway local SQLite database."""
+    return create_engine(f"sqlite:///{tmp_path / 'prices.db'}")
+
+@pytest.fixture
+def prices_df():
+    """A few days of prices in the shape ingest_stock_data produces."""
+    return pd.DataFrame({
+        'date': pd.to_datetime(['2023-01-02', '2023-01-03', '2023-01-04'] * 2),
+        'open': [1.0] * 6,
+        'high': [1.0] * 6,
+        'low': [1.0] * 6,
+        'close': [100, 101, 102, 200, 201, 202],
+        'Adj Close': [1.0] * 6,
+        'volume': [10] * 6,
+        'ticker': ['AAPL'] * 3 + ['MSFT'] * 3,
+    })
+
+def row_count(engine):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT COUNT(*) FROM historical_prices")).scalar()
+
+def test_load_prices_is_idempotent(engine, prices_df):
+    """Test that reloading keeps the managed schema and doesn't duplicate rows."""
+    load_prices(engine, prices_df)
+    prices_df.loc[2, 'close'] = 105
+    load_prices(engine, prices_df)
+
+    assert is_managed(engine)
+    assert row_count(engine) == 6
+    with engine.connect() as conn:
+        latest = conn.execute(text(
+            "SELECT close FROM historical_prices WHERE ticker = 'AAPL' ORDER BY date DESC LIMIT 1"
+        )).scalar()
+    assert latest == 105
+
+def test_migrate_legacy_table(engine, prices_df):
+    """Test that a table created by the old to_sql(replace) ingestion is migrated and de-duplicated."""
+    legacy = pd.concat([prices_df, prices_df.iloc[:2]], ignore_index=True)
+    legacy.rename(columns={'Adj Close': 'adj_close'}).to_sql('historical_prices', engine, index=False)
+    assert not is_managed(engine)
+
+    migrate_historical_prices(engine)
+
+    assert is_managed(engine)
+    assert row_count(engine) == 6
+    assert inspect(engine).get_pk_constraint('historical_prices')['constrained_columns'] == ['ticker', 'date']
+    assert not inspect(engine).has_table('historical_prices_legacy')
+
+def test_migration_resumes_after_failed_copy(engine, prices_df, monkeypatch):
+    """Test that rows left in the legacy table by a failed migration are copied on the next run."""
+    import src.price_schema as price_schema
+    prices_df.rename(columns={'Adj Close': 'adj_close'}).to_sql('historical_prices', engine, index=False)
+
+    def broken_copy(*args, **kwargs):
+        raise RuntimeError("connection dropped")
+    with monkeypatch.context() as m:
+        m.setattr(price_schema, '_copy_rows', broken_copy)
+        with pytest.raises(RuntimeError):
+            migrate_historical_prices(engine)
+
+    # Whatever the failure left behind, the rows must not be lost.
+    tables = inspect(engine).get_table_names()
+    assert 'historical_prices' in tables or 'historical_prices_legacy' in tables
+
+    migrate_historical_prices(engine)
+
+    assert is_managed(engine)
+    assert row_count(engine) == 6
+    assert not inspect(engine).has_table('historical_prices_legacy')
+
+def test_is_managed_checks_partitioning(engine, prices_df, monkeypatch):
+    """Test that a managed but unpartitioned table doesn't count as managed when partitioning is asked for."""
+    load_prices(engine, prices_df)
+
+    assert is_managed(engine, partition_by_year=False)
+    assert not is_managed(engine, partition_by_year=True)
+    monkeypatch.setenv("PRICE_PARTITION_BY_YEAR", "true")
+    assert not is_managed(engine)
+
+def test_latest_price_query_uses_index(engine, prices_df):
+    """Test that EXPLAIN shows an index lookup with no separate sort step."""
+    load_prices(engine, prices_df)
+    plan = ' '.join(explain_latest_price(engine, 'AAPL')).upper()
+
+    assert 'USING' in plan and 'INDEX' in plan
+    assert 'TEMP B-TREE' not in plan
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL (PostgreSQL) not set")
+def test_latest_price_uses_index_postgres(prices_df):
+    """Test that PostgreSQL serves the latest-price query from the composite index without sorting."""
+    engine = create_engine(os.environ["TEST_DATABASE_URL"])
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS historical_prices CASCADE"))
+    load_prices(engine, prices_df)
+
+    with engine.connect() as conn:
+        conn.execute(text("SET enable_seqscan = off"))
+        plan = ' '.join(row[0] for row in conn.execute(text(
+            "EXPLAIN SELECT close FROM historical_prices WHERE ticker = 'AAPL' ORDER BY date DESC LIMIT 1"
+        )))
+
+    assert 'Index' in plan
+    assert 'Sort' not in plan
@@ -0,0 +1,69 @@
+import pytest
+import numpy as np
+from src.quantile_sketch import TDigest, sketch_pl
+from src.risk_engine import expected_shortfall
+
+QUANTILES = [0.001, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 0.999]
+
+@pytest.fixture
+def fat_tailed_pl():
+    """Student-t P/L, which is much harder on tail estimates than a normal."""
+    rng = np.random.default_rng(7)
+    return rng.standard_t(3, 500_000) * 1000
+
+def rank_errors(digest, values):
+    """How far (in fraction of ranks) each estimated quantile is from the exact one."""
+    ordered = np.sort(values)
+    estimates = digest.quantile(QUANTILES)
+    ranks = np.searchsorted(ordered, estimates) / len(ordered)
+    return np.abs(ranks - np.asarray(QUANTILES))
+
+def test_quantiles_within_error_bound(fat_tailed_pl):
+    """Test estimated quantiles against exact ones, streamed in chunks."""
+    digest = sketch_pl(np.array_split(fat_tailed_pl, 50))
+
+    assert digest.count == len(fat_tailed_pl)
+    assert np.all(rank_errors(digest, fat_tailed_pl) <= digest.rank_error_bound(QUANTILES))
+    # Memory stays bounded: a few hundred centroids for half a million values.
+    assert len(digest) < 2 * digest.compression
+    assert digest.quantile(0) == fat_tailed_pl.min() and digest.quantile(1) == fat_tailed_pl.max()
+
+def test_var_and_es_match_exact(fat_tailed_pl):
+    """Test the sketch's VaR and ES against the exact calculation."""
+    digest = TDigest().update(fat_tailed_pl)
+    var_value, es_value = digest.tail_risk(0.99)
+
+    assert var_value == pytest.approx(-np.quantile(fat_tailed_pl, 0.01), rel=0.01)
+    assert es_value == pytest.approx(expected_shortfall(fat_tailed_pl, 0.99), rel=0.01)
+
+def test_merged_digests_match_single_pass(fat_tailed_pl):
+    """Test that sketches built on separate partitions merge to the same answers."""
+    parts = [TDigest().update(part) for part in np.array_split(fat_tailed_pl, 8)]
+    # Send them through the JSON form, like results coming back from workers.
+    merged = TDigest.merge_all(TDigest.from_dict(p.to_dict()) for p in parts)
+
+    assert merged.count == len(fat_tailed_pl)
+    assert np.all(rank_errors(merged, fat_tailed_pl) <= merged.rank_error_bound(QUANTILES))
+    assert merged.tail_mean(0.01) == pytest.approx(TDigest().update(fat_tailed_pl).tail_mean(0.01), rel=0.01)
+
+def test_higher_compression_is_more_accurate(fat_tailed_pl):
+    """Test that the error bound is configurable through the compression."""
+    coarse = TDigest(compression=50).update(fat_tailed_pl)
+    fine = TDigest.for_rank_error(0.0005, q=0.01)
+
+    assert fine.compression > coarse.compression
+    fine.update(fat_tailed_pl)
+    assert fine.rank_error_bound(0.01) <= 0.0005
+    assert rank_errors(fine, fat_tailed_pl).max() <= rank_errors(coarse, fat_tailed_pl).max()
+
+def test_small_and_empty_digests():
+    """Test the edge cases: exact answers for tiny inputs, NaN/None when empty."""
+    digest = TDigest().update([3.0, 1.0, 2.0, np.nan])
+    assert digest.count == 3
+    assert digest.quantile(0.5) == pytest.approx(2.0)
+
+    empty = TDigest()
+    assert np.isnan(empty.quantile(0.5))
+    assert empty.tail_risk() == (None, None)
+    with pytest.raises(ValueError):
+        digest.quantile(1.5)
@@ -0,0 +1,137 @@
+import multiprocessing
+import pytest
+import pandas as pd
+import numpy as np
+from src.return_matrix import ReturnMatrix, get_risk_dtype, memory_footprint
+
+@pytest.fixture
+def long_prices():
+    """Long-format prices with a late starter and a gap, like the database returns."""
+    rng = np.random.default_rng(1)
+    dates = pd.bdate_range('2020-01-01', periods=600)
+    frames = []
+    for i, ticker in enumerate(['AAA', 'BBB', 'CCC', 'DDD']):
+        closes = 100 * np.cumprod(1 + rng.normal(0, 0.02, len(dates)))
+        df = pd.DataFrame({'ticker': ticker, 'date': dates, 'close': closes})
+        if ticker == 'CCC':
+            df = df.iloc[40:]          # started trading later
+        if ticker == 'DDD':
+            df = df.drop(df.index[100:105])  # a few missing days
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+def pandas_returns(long_prices):
+    """The original pandas pipeline from RiskEngine."""
+    pivot = long_prices.pivot(index='date', columns='ticker', values='close').sort_index()
+    return pivot.ffill().pct_change().dropna()
+
+def child_portfolio_pl(descriptor, weights, out):
+    """Runs in another process: attach to the shared matrix and compute P/L."""
+    matrix = ReturnMatrix.from_shared_memory(descriptor)
+    out.put((matrix.values.flags.writeable, matrix.portfolio_pl(weights).tolist()))
+
+def test_inplace_pipeline_matches_pandas(long_prices):
+    """Test that the in-place pipeline gives the same returns (and dates) as pandas."""
+    expected = pandas_returns(long_prices)
+    matrix = ReturnMatrix.from_long_prices(long_prices, dtype='float64', block_rows=7)
+
+    assert matrix.tickers == list(expected.columns)
+    assert matrix.dates.equals(pd.DatetimeIndex(expected.index))
+    np.testing.assert_allclose(matrix.values, expected.to_numpy(), rtol=1e-12)
+    assert not matrix.values.flags.writeable
+
+def test_float32_var_close_to_float64(long_prices):
+    """Test that float32 mode halves the memory and keeps VaR within a tight tolerance."""
+    weights = {'AAA': 50000.0, 'BBB': 25000.0, 'CCC': 15000.0, 'DDD': 10000.0}
+    m64 = ReturnMatrix.from_long_prices(long_prices, dtype='float64')
+    m32 = ReturnMatrix.from_long_prices(long_prices, dtype='float32')
+
+    assert m32.nbytes * 2 == m64.nbytes
+    pl64, pl32 = m64.portfolio_pl(weights), m32.portfolio_pl(weights)
+    assert pl32.dtype == np.float32
+    np.testing.assert_allclose(pl32, pl64, rtol=1e-4, atol=1e-2)
+    for q in (0.01, 0.05):
+        assert np.isclose(np.quantile(pl32, q), np.quantile(pl64, q), rtol=1e-5)
+
+def test_risk_dtype_setting(monkeypatch):
+    """Test the RISK_FLOAT_DTYPE setting."""
+    monkeypatch.setenv("RISK_FLOAT_DTYPE", "float32")
+    assert get_risk_dtype() == np.float32
+    monkeypatch.setenv("RISK_FLOAT_DTYPE", "float16")
+    with pytest.raises(ValueError):
+        get_risk_dtype()
+
+def test_shared_memory_across_processes(long_prices):
+    """Test that another process can read the matrix from shared memory without copying it."""
+    matrix = ReturnMatrix.from_long_prices(long_prices, dtype='float32')
+    weights = {'AAA': 1000.0, 'DDD': 500.0}
+    shm, descriptor = matrix.to_shared_memory()
+    try:
+        out = multiprocessing.Queue()
+        child = multiprocessing.Process(target=child_portfolio_pl, args=(descriptor, weights, out))
+        child.start()
+        writeable, pl = out.get(timeout=30)
+        child.join(timeout=30)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    assert not writeable
+    np.testing.assert_allclose(pl, matrix.portfolio_pl(weights))
+
+def test_mmap_roundtrip(long_prices, tmp_path):
+    """Test saving and memory-mapping a matrix."""
+    matrix = ReturnMatrix.from_long_prices(long_prices, dtype='float32')
+    matrix.save_mmap(tmp_path / 'returns.npy')
+
+    loaded = ReturnMatrix.load_mmap(tmp_path / 'returns.npy')
+
+    assert isinstance(loaded.values, np.memmap)
+    assert loaded.tickers == matrix.tickers
+    np.testing.assert_array_equal(loaded.values, matrix.values)
+
+def test_memory_footprint(long_prices):
+    """Test that the footprint report includes the process RSS and matrix sizes."""
+    matrix = ReturnMatrix.from_long_prices(long_prices)
+    footprint = memory_footprint(matrix)
+
+    assert footprint['matrix_bytes'] == matrix.nbytes
+    assert footprint['peak_rss_bytes'] > 0
+
+def test_universe_matrix_keeps_each_tickers_history(long_prices):
+    """Test that drop_incomplete=False keeps the full history and a portfolio uses its own span."""
+    full = ReturnMatrix.from_long_prices(long_prices, dtype='float64', drop_incomplete=False)
+    dropped = ReturnMatrix.from_long_prices(long_prices, dtype='float64')
+
+    # CCC started 40 days late, but the others keep all 599 returns.
+    assert len(full.values) == 599 and len(dropped.values) == 559
+    assert list(full.valid_from) == [0, 0, 40, 0]
+
+    aaa_only = {'AAA': 1000.0}
+    expected = pandas_returns(long_prices[long_prices['ticker'] == 'AAA'])['AAA'].to_numpy() * 1000
+    np.testing.assert_allclose(full.portfolio_pl(aaa_only), expected)
+
+    with_ccc = {'AAA': 1000.0, 'CCC': 500.0}
+    assert full.portfolio_rows(with_ccc) == 40
+    np.testing.assert_allclose(full.portfolio_pl(with_ccc), dropped.portfolio_pl(with_ccc))
+
+def test_from_long_prices_memory(monkeypatch):
+    """Test that building the matrix doesn't make full-size float64 copies along the way."""
+    import tracemalloc
+    import src.return_matrix
+    monkeypatch.setattr(src.return_matrix, 'SCATTER_CHUNK_ROWS', 5000)
+    n_days, n_tickers = 1000, 200
+    rng = np.random.default_rng(3)
+    long_prices = pd.DataFrame({
+        'ticker': np.repeat([f"T{i:03d}" for i in range(n_tickers)], n_days),
+        'date': np.tile(pd.bdate_range('2015-01-01', periods=n_days).date, n_tickers),
+        'close': rng.uniform(10, 20, n_days * n_tickers),
+    })
+    float64_bytes = n_days * n_tickers * 8
+
+    for dtype, limit in (('float64', 1.25), ('float32', 0.75)):
+        tracemalloc.start()
+        ReturnMatrix.from_long_prices(long_prices, dtype=dtype, block_rows=16)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert peak < limit * float64_bytes
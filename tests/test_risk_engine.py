@@ -53,4 +53,88 @@ def test_calculate_historical_var(mock_portfolio_manager, mock_read_sql, mocker)
     re.get_historical_data = mocker.MagicMock()
     test_pl = np.array([-1000, -500, 100, 2000])
     var = -np.percentile(test_pl, 5)
-    assert np.isclose(var, 925.0)
\ No newline at end of file
+    assert np.isclose(var, 925.0)
+
+def test_bin_pl_distribution():
+    """Test the compact P/L histogram that the dashboard draws from."""
+    from src.risk_engine import bin_pl_distribution
+    histogram = bin_pl_distribution([-1000, -500, 100, 2000, np.nan], bins=4)
+
+    assert histogram['counts'] == [2, 1, 0, 1]
+    assert histogram['bin_edges'][0] == -1000 and histogram['bin_edges'][-1] == 2000
+    assert bin_pl_distribution([]) == {"bin_edges": [], "counts": []}
+
+def test_expected_shortfall():
+    """Test that ES is the average loss beyond the VaR quantile."""
+    from src.risk_engine import expected_shortfall
+    pl = np.arange(-50, 50, dtype=float)  # 100 outcomes, worst is -50
+
+    # The worst 5% are -50..-46 (the quantile itself is interpolated just above -46).
+    assert expected_shortfall(pl, 0.95) == pytest.approx(48.0)
+    assert expected_shortfall([], 0.95) is None
+
+    # Column by column, ignoring the rows a portfolio has no history for.
+    columns = np.column_stack([pl, np.r_[np.full(20, np.nan), pl[20:]], np.full(100, np.nan)])
+    es = expected_shortfall(columns, 0.95, axis=0)
+    assert es[0] == pytest.approx(48.0)
+    assert es[1] == pytest.approx(expected_shortfall(pl[20:], 0.95))
+    assert np.isnan(es[2])
+
+def test_calculate_monte_carlo_var(mock_portfolio_manager, mocker):
+    """Test the streamed Monte Carlo VaR against the exact quantile of its own bootstrap."""
+    from src.return_matrix import ReturnMatrix
+    rng = np.random.default_rng(3)
+    returns = ReturnMatrix(rng.normal(0, 0.01, (252, 2)), ['AAPL', 'GOOG'], pd.date_range('2023-01-01', periods=252))
+    mock_portfolio_manager.db_session = MagicMock()
+    re = RiskEngine(mock_portfolio_manager)
+    mocker.patch.object(re, 'get_return_matrix', return_value=returns)
+
+    var_value, es_value, digest = re.calculate_monte_carlo_var(n_paths=200_000, chunk_size=30_000, seed=1)
+
+    daily_pl = returns.portfolio_pl(mock_portfolio_manager.market_values)
+    assert digest.count == 200_000
+    assert var_value == pytest.approx(-np.quantile(daily_pl, 0.05), rel=0.05)
+    assert es_value > var_value
+
+    # Ten-day paths spread out by roughly sqrt(10).
+    var_10d, _, _ = re.calculate_monte_carlo_var(n_paths=50_000, horizon_days=10, seed=2)
+    assert var_10d == pytest.approx(var_value * np.sqrt(10), rel=0.15)
+
+def test_calculate_filtered_var(mock_portfolio_manager, mocker):
+    """Test that filtered VaR scales historical scenarios up after a volatility spike."""
+    from src.return_matrix import ReturnMatrix
+    rng = np.random.default_rng(5)
+    values = np.vstack([rng.normal(0, 0.005, (400, 2)), rng.normal(0, 0.03, (100, 2))])
+    returns = ReturnMatrix(values, ['AAPL', 'GOOG'], pd.bdate_range('2022-01-03', periods=500))
+    mock_portfolio_manager.db_session = MagicMock()
+    mocker.patch('src.risk_engine.get_universe_simulation', return_value=None)
+    re = RiskEngine(mock_portfolio_manager)
+    mocker.patch.object(re, 'get_return_matrix', return_value=returns)
+
+    filtered_var, filtered_pl = re.calculate_filtered_var(confidence_level=0.95)
+
+    plain_var = -np.quantile(returns.portfolio_pl(mock_portfolio_manager.market_values), 0.05)
+    assert len(filtered_pl) == 500
+    assert filtered_var > 1.5 * plain_var
+
+def test_calculate_grouped_risk_many(mocker):
+    """Test the batched rollup against one portfolio at a time, with the firm total as their sum."""
+    from src.return_matrix import ReturnMatrix
+    from src.risk_engine import FIRM_TOTAL, calculate_grouped_risk_many
+    rng = np.random.default_rng(9)
+    returns = ReturnMatrix(rng.normal(0, 0.01, (252, 3)), ['AAPL', 'GOOG', 'MSFT'], pd.bdate_range('2023-01-02', periods=252))
+    pm = MagicMock()
+    pm.get_current_prices.return_value = {'AAPL': 100.0, 'GOOG': 50.0, 'MSFT': 200.0}
+    mocker.patch('src.risk_engine.PortfolioManager', return_value=pm)
+    mocker.patch.object(RiskEngine, 'get_return_matrix', return_value=returns)
+
+    portfolios = {'tech': {'AAPL': 10, 'MSFT': 5}, 'search': {'GOOG': 40}}
+    tags = {'AAPL': 'hardware', 'MSFT': 'software', 'GOOG': 'software'}
+    result = calculate_grouped_risk_many(portfolios, tags=tags)
+
+    assert set(result.index.get_level_values('portfolio')) == {'tech', 'search', FIRM_TOTAL}
+    assert result.loc[('tech', 'hardware'), 'market_value'] == 1000.0
+    firm = result.xs(FIRM_TOTAL, level='portfolio')
+    np.testing.assert_allclose(firm['market_value'], result.groupby('group')['market_value'].sum() / 2)
+    firm_pl = returns.values @ np.array([1000.0, 2000.0, 1000.0])
+    assert firm['component_var'].sum() == pytest.approx(-np.quantile(firm_pl, 0.05))
@@ -0,0 +1,70 @@
+import pytest
+import pandas as pd
+import numpy as np
+from src.risk_rollup import GroupIndex, RiskRollup, labels_from_metadata
+
+@pytest.fixture
+def metadata():
+    """A small slice of the instruments table."""
+    return pd.DataFrame({
+        'listing_exchange': ['Q', 'N', 'Q', 'P'],
+        'market_category': ['Q', None, 'S', None],
+        'is_etf': [False, False, False, True],
+    }, index=pd.Index(['AAPL', 'IBM', 'ZZZ', 'SPY'], name='ticker'))
+
+@pytest.fixture
+def returns():
+    """Deterministic daily returns for four tickers."""
+    rng = np.random.default_rng(42)
+    return rng.normal(0, 0.02, size=(250, 4))
+
+def test_labels_from_metadata(metadata):
+    """Test that exchange codes are mapped and unknown tickers go to 'Other'."""
+    tickers = ['AAPL', 'IBM', 'SPY', 'FAKE']
+    assert labels_from_metadata(tickers, metadata, 'listing_exchange') == ['NASDAQ', 'NYSE', 'NYSE Arca', 'Other']
+    assert labels_from_metadata(tickers, metadata, 'market_category') == ['NASDAQ Global Select', 'NYSE', 'NYSE Arca', 'Other']
+    assert labels_from_metadata(tickers, metadata, 'asset_type') == ['Stock', 'Stock', 'ETF', 'Other']
+
+    with pytest.raises(ValueError):
+        labels_from_metadata(tickers, metadata, 'sector')
+
+def test_group_index_structures(metadata):
+    """Test that codes, members and the sparse matrix all describe the same grouping."""
+    index = GroupIndex.from_metadata(['AAPL', 'IBM', 'ZZZ', 'SPY'], metadata)
+
+    assert index.groups == ['NASDAQ', 'NYSE', 'NYSE Arca']
+    assert index.matrix.shape == (3, 4)
+    np.testing.assert_array_equal(index.matrix.toarray().argmax(axis=0), index.codes)
+    np.testing.assert_array_equal(index.members[0], [0, 2])
+
+def test_rollup_matches_direct_calculation(metadata, returns):
+    """Test the rollup against a straightforward pandas/numpy calculation."""
+    tickers = ['AAPL', 'IBM', 'ZZZ', 'SPY']
+    index = GroupIndex.from_metadata(tickers, metadata)
+    positions = index.align({'AAPL': 50000.0, 'IBM': 20000.0, 'ZZZ': 10000.0, 'SPY': 30000.0})
+
+    result = RiskRollup(index, returns).rollup(positions)
+
+    assert result.loc['NASDAQ', 'market_value'] == 60000.0
+    nasdaq_pl = returns[:, [0, 2]] @ positions[[0, 2]]
+    assert np.isclose(result.loc['NASDAQ', 'standalone_var'], -np.quantile(nasdaq_pl, 0.05))
+
+    # The components should add back up to the portfolio VaR.
+    total_var = -np.quantile(returns @ positions, 0.05)
+    assert np.isclose(result['component_var'].sum(), total_var)
+
+def test_rollup_many_matches_single(returns):
+    """Test that the batched rollup gives the same answer as one portfolio at a time."""
+    index = GroupIndex.from_tags(['A', 'B', 'C', 'D'], {'A': 'Tech', 'B': 'Tech', 'C': 'Energy'})
+    rng = np.random.default_rng(7)
+    positions = rng.uniform(0, 10000, size=(20, 4))
+
+    rollup = RiskRollup(index, returns)
+    batched = rollup.rollup_many(positions, confidence_level=0.99)
+
+    assert batched['groups'] == ['Energy', 'Other', 'Tech']
+    for p in (0, 11, 19):
+        single = rollup.rollup(positions[p], confidence_level=0.99)
+        np.testing.assert_allclose(batched['standalone_var'][:, p], single['standalone_var'])
+        np.testing.assert_allclose(batched['component_var'][:, p], single['component_var'])
+        assert np.isclose(batched['total_var'][p], -np.quantile(returns @ positions[p], 0.01))
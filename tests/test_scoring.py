@@ -0,0 +1,218 @@
+import json
+import os
+import pytest
+import pandas as pd
+import numpy as np
+from unittest.mock import patch
+from src import scoring
+from src.return_matrix import ReturnMatrix
+from src.scoring import ScoringContext, ScoringCoordinator, SQLWorkQueue, WorkQueue, connect, score_shard
+
+@pytest.fixture
+def context():
+    """A small universe of five tickers with a year of returns."""
+    rng = np.random.default_rng(3)
+    tickers = ['AAA', 'BBB', 'CCC', 'DDD', 'EEE']
+    returns = ReturnMatrix(rng.normal(0, 0.02, size=(252, 5)), tickers, pd.bdate_range('2020-01-01', periods=252))
+    return ScoringContext(returns, {t: 10.0 * (i + 1) for i, t in enumerate(tickers)})
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLWorkQueue(f"sqlite:///{tmp_path / 'queue.db'}", max_attempts=2)
+
+@pytest.fixture
+def portfolios():
+    rng = np.random.default_rng(5)
+    tickers = ['AAA', 'BBB', 'CCC', 'DDD', 'EEE']
+    return [
+        {'id': f"client-{i}", 'holdings': {t: int(q) for t, q in zip(tickers, rng.integers(0, 100, 5))}}
+        for i in range(23)
+    ]
+
+def flaky_scorer(payload, context):
+    """Fails the first attempt of every shard, then scores normally."""
+    if payload['attempt'] == 1:
+        raise RuntimeError("simulated worker failure")
+    return score_shard(payload, context)
+
+def always_fails(payload, context):
+    raise RuntimeError("broken shard")
+
+def dies_once(payload, context):
+    """Kills the worker process on the first attempt of every shard."""
+    if payload['attempt'] == 1:
+        os._exit(1)
+    return score_shard(payload, context)
+
+def always_dies(payload, context):
+    os._exit(1)
+
+def test_score_shard_matches_direct_calculation(context):
+    """Test the vectorized shard scoring against a single-portfolio calculation."""
+    payload = {
+        'portfolios': [{'id': 'p1', 'holdings': {'AAA': 10, 'CCC': 5, 'ZZZ': 3}}],
+        'scenarios': {'crash': {'*': -0.2, 'AAA': -0.5}},
+    }
+    result = score_shard(payload, context)[0]
+
+    values = np.array([100.0, 0, 150.0, 0, 0])
+    pl = context.returns.values @ values
+    cutoff = np.quantile(pl, 0.05)
+    assert result['market_value'] == 250.0
+    assert np.isclose(result['var'], -cutoff)
+    assert np.isclose(result['es'], -pl[pl <= cutoff].mean())
+    assert np.isclose(result['stress']['crash'], 100 * -0.5 + 150 * -0.2)
+    assert result['missing_tickers'] == ['ZZZ']
+
+def test_score_shard_uses_each_portfolios_own_history(context):
+    """Test that a recently listed ticker only shortens the history of portfolios that hold it."""
+    values = context.returns.values.copy()
+    values[:200, 4] = np.nan  # EEE only has the last 52 returns.
+    returns = ReturnMatrix(values, context.tickers, context.returns.dates)
+    young = ScoringContext(returns, {t: 10.0 for t in context.tickers})
+    payload = {'portfolios': [
+        {'id': 'old', 'holdings': {'AAA': 10, 'BBB': 5}},
+        {'id': 'mixed', 'holdings': {'AAA': 10, 'EEE': 5}},
+    ]}
+    old, mixed = score_shard(payload, young)
+
+    old_pl = values[:, :2] @ np.array([100.0, 50.0])
+    mixed_pl = values[200:, [0, 4]] @ np.array([100.0, 50.0])
+    assert old['observations'] == 252 and mixed['observations'] == 52
+    assert np.isclose(old['var'], -np.quantile(old_pl, 0.05))
+    assert np.isclose(mixed['var'], -np.quantile(mixed_pl, 0.05))
+    assert np.isclose(mixed['es'], -mixed_pl[mixed_pl <= np.quantile(mixed_pl, 0.05)].mean())
+
+def test_context_from_database_keeps_short_history():
+    """Test that a short-history ticker doesn't cut the universe down to its length."""
+    from sqlalchemy import create_engine
+    engine = create_engine("sqlite://")
+    rng = np.random.default_rng(11)
+    dates = pd.bdate_range('2022-01-03', periods=300).date
+    rows = [('OLD', d, 100 + c) for d, c in zip(dates, rng.normal(0, 1, 300).cumsum())]
+    rows += [('NEW', d, 50 + c) for d, c in zip(dates[-30:], rng.normal(0, 1, 30).cumsum())]
+    pd.DataFrame(rows, columns=['ticker', 'date', 'close']).to_sql('historical_prices', engine, index=False)
+
+    context = ScoringContext.from_database(engine, days=252)
+    assert context.returns.values.shape == (252, 2)
+    assert dict(zip(context.tickers, context.returns.valid_from)) == {'NEW': 252 - 29, 'OLD': 0}
+    assert context.prices[context.position('NEW')] == rows[-1][2]
+
+    old, new = score_shard({'portfolios': [{'id': 'old', 'holdings': {'OLD': 1}},
+                                           {'id': 'new', 'holdings': {'NEW': 1}}]}, context)
+    assert old['observations'] == 252 and new['observations'] == 29
+
+def test_queue_reconnects_from_descriptor(queue):
+    """Test that a worker can open the same queue from its picklable descriptor."""
+    import pickle
+    queue.submit('job', [{'n': 1}])
+    other = connect(pickle.loads(pickle.dumps(queue.descriptor())))
+
+    assert isinstance(other, WorkQueue)
+    assert other.claim('w1').payload == {'n': 1}
+    assert queue.job_status('job') == {'running': 1}
+    with pytest.raises(TypeError):
+        WorkQueue()
+    with pytest.raises(ValueError, match="Unknown work queue"):
+        connect({'kind': 'carrier-pigeon'})
+
+def test_queue_retries_then_fails(queue):
+    """Test that a failed shard is requeued until it runs out of attempts."""
+    queue.submit('job', [{'n': 1}])
+
+    task = queue.claim('w1')
+    assert task.attempt == 1 and task.payload == {'n': 1}
+    assert queue.claim('w2') is None
+    queue.fail(task.task_id, 'w1', 'boom')
+    assert queue.job_status('job') == {'queued': 1}
+
+    task = queue.claim('w2')
+    assert task.attempt == 2
+    queue.fail(task.task_id, 'w2', 'boom again')
+    assert queue.job_status('job') == {'failed': 1}
+    assert queue.failures('job') == {task.task_id: 'boom again'}
+
+def test_queue_reclaims_expired_lease(tmp_path):
+    """Test that a shard held by a dead worker is handed out again after its lease runs out."""
+    queue = SQLWorkQueue(f"sqlite:///{tmp_path / 'queue.db'}", max_attempts=3, lease_seconds=0.0)
+    queue.submit('job', [{'n': 1}])
+    first = queue.claim('dead-worker')
+    second = queue.claim('w2')
+
+    assert second.task_id == first.task_id and second.attempt == 2
+    assert queue.complete(second.task_id, 'w2', {'ok': True})
+    assert queue.collect('job') == [(second.task_id, {'ok': True})]
+    assert queue.collect('job') == []
+
+def test_queue_ignores_worker_that_lost_its_lease(tmp_path):
+    """Test that a worker whose shard was reclaimed can't overwrite or fail it."""
+    queue = SQLWorkQueue(f"sqlite:///{tmp_path / 'queue.db'}", max_attempts=3, lease_seconds=0.0)
+    queue.submit('job', [{'n': 1}])
+    first = queue.claim('slow-worker')
+    second = queue.claim('w2')
+
+    assert not queue.complete(first.task_id, 'slow-worker', {'stale': True})
+    assert not queue.fail(first.task_id, 'slow-worker', 'too late')
+    assert queue.job_status('job') == {'running': 1}
+    assert queue.complete(second.task_id, 'w2', {'ok': True})
+    assert not queue.complete(second.task_id, 'w2', {'again': True})
+    assert queue.collect('job') == [(second.task_id, {'ok': True})]
+
+def test_queue_releases_dead_workers_tasks(queue):
+    """Test that a dead worker's shard is requeued without waiting for the lease."""
+    queue.submit('job', [{'n': 1}, {'n': 2}])
+    task = queue.claim('dead')
+    queue.claim('alive')
+
+    assert queue.release('dead', 'worker died') == 1
+    assert queue.job_status('job') == {'queued': 1, 'running': 1}
+    assert queue.claim('w3').task_id == task.task_id
+
+def test_coordinator_with_local_workers(context, queue, portfolios, capsys):
+    """Test a full sharded run across worker processes, with every shard failing once."""
+    coordinator = ScoringCoordinator(context, queue, n_workers=2, shard_size=5, scorer=flaky_scorer)
+    scores = coordinator.score(portfolios, scenarios={'down10': {'*': -0.1}}, timeout=60)
+
+    # Every shard logs the memory of the worker that scored it.
+    log = capsys.readouterr().out
+    assert log.count(' portfolios on ') == 5
+    assert f"matrix {context.returns.nbytes / 2**20:.1f} MiB" in log
+
+    assert len(scores) == len(portfolios)
+    expected = pd.DataFrame(score_shard({'portfolios': portfolios}, context)).set_index('id')
+    np.testing.assert_allclose(scores.loc[expected.index, 'var'], expected['var'])
+    np.testing.assert_allclose(scores['stress'].map(lambda s: s['down10']), -0.1 * scores['market_value'])
+
+def test_coordinator_reports_failed_shards(context, queue, portfolios):
+    """Test that shards that never succeed are reported instead of silently dropped."""
+    coordinator = ScoringCoordinator(context, queue, n_workers=1, shard_size=10, scorer=always_fails)
+    with pytest.raises(RuntimeError, match="3 shard"):
+        coordinator.score(portfolios, timeout=60)
+
+def test_coordinator_replaces_dead_workers(context, queue, portfolios, capsys):
+    """Test that workers killed mid-shard are replaced and their shards retried."""
+    coordinator = ScoringCoordinator(context, queue, n_workers=2, shard_size=12, scorer=dies_once, max_restarts=4)
+    scores = coordinator.score(portfolios, timeout=60)
+
+    assert len(scores) == len(portfolios)
+    assert 'died (exit code 1)' in capsys.readouterr().out
+
+def test_coordinator_fails_fast_when_workers_are_gone(context, queue, portfolios):
+    """Test that the job stops as soon as no local worker is left, instead of waiting for the timeout."""
+    coordinator = ScoringCoordinator(context, queue, n_workers=1, shard_size=10, scorer=always_dies, max_restarts=1)
+    with pytest.raises(RuntimeError, match="all local workers died"):
+        coordinator.score(portfolios, timeout=60)
+
+def test_score_command_writes_csv(context, portfolios, tmp_path):
+    """Test that `python -m src.scoring score` scores a portfolio file and writes the results."""
+    path = tmp_path / 'portfolios.json'
+    path.write_text(json.dumps({p['id']: p['holdings'] for p in portfolios}))
+    output = tmp_path / 'scores.csv'
+    argv = ['scoring', 'score', '--portfolios', str(path), '--output', str(output), '--workers', '1',
+            '--shard-size', '10', '--timeout', '60', '--queue-url', f"sqlite:///{tmp_path / 'queue.db'}"]
+
+    with patch('sys.argv', argv), patch.object(scoring.ScoringContext, 'from_database', return_value=context):
+        scoring.main()
+
+    scores = pd.read_csv(output, index_col='id')
+    assert sorted(scores.index) == sorted(p['id'] for p in portfolios)
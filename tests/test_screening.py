@@ -0,0 +1,71 @@
+import pytest
+import pandas as pd
+import numpy as np
+from src.screening import TickerScreener
+
+@pytest.fixture
+def stats():
+    """A fake ticker_stats table with a couple of missing values."""
+    rng = np.random.default_rng(2)
+    n = 500
+    df = pd.DataFrame({
+        'is_etf': rng.random(n) < 0.2,
+        'volatility': rng.uniform(0.1, 0.8, n),
+        'beta': rng.normal(1, 0.4, n),
+        'max_drawdown': -rng.uniform(0.05, 0.9, n),
+        'return_1m': rng.normal(0, 0.1, n),
+        'return_3m': rng.normal(0, 0.2, n),
+        'return_1y': rng.normal(0.05, 0.3, n),
+        'last_close': rng.uniform(1, 500, n),
+    }, index=pd.Index([f"T{i:03d}" for i in range(n)], name='ticker'))
+    df.iloc[:10, df.columns.get_loc('beta')] = np.nan
+    return df
+
+def test_screen_matches_pandas(stats):
+    """Test a filtered, sorted screen against the same query done in pandas."""
+    screener = TickerScreener(stats)
+    result = screener.screen(
+        {'volatility': (None, 0.4), 'return_1y': (0.0, None)},
+        sort_by='beta', descending=True, limit=20, etf=False
+    )
+
+    expected = stats[(stats['volatility'] <= 0.4) & (stats['return_1y'] >= 0.0) & ~stats['is_etf']]
+    expected = expected.sort_values('beta', ascending=False, na_position='last').head(20)
+    assert list(result.index) == list(expected.index)
+
+def test_missing_values_sort_last_and_fail_filters(stats):
+    """Test that tickers without a stat are excluded by filters on it and sorted to the end."""
+    screener = TickerScreener(stats)
+
+    filtered = screener.screen({'beta': (-10, 10)}, limit=1000)
+    assert filtered['beta'].notna().all()
+
+    ascending = screener.screen(sort_by='beta', limit=1000)
+    assert ascending['beta'].iloc[-10:].isna().all()
+    assert ascending['beta'].iloc[:-10].is_monotonic_increasing
+
+def test_screen_rejects_unknown_metric(stats):
+    screener = TickerScreener(stats)
+    with pytest.raises(ValueError):
+        screener.screen(sort_by='sharpe')
+    with pytest.raises(ValueError):
+        screener.screen({'sharpe': (0, None)})
+
+def test_get_screener_loads_once_across_threads(stats):
+    """Test that concurrent first requests share a single load of the stats table."""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from unittest.mock import patch
+    from src import screening
+
+    def slow_load(db):
+        time.sleep(0.05)
+        return TickerScreener(stats)
+
+    with patch.dict(screening._screener_cache, {'screener': None, 'loaded_at': 0.0}), \
+            patch.object(TickerScreener, 'from_database', side_effect=slow_load) as load:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            screeners = list(pool.map(lambda _: screening.get_screener(None), range(16)))
+
+    assert load.call_count == 1
+    assert all(s is screeners[0] for s in screeners)
@@ -0,0 +1,149 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from src.models import Base, RiskSnapshot
+from src.snapshots import holdings_fingerprint, save_portfolio, list_portfolios, get_portfolio_risk, store_snapshot
+
+@pytest.fixture
+def db():
+    """An in-memory database with the app's tables."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+@pytest.fixture
+def fake_compute():
+    """Stands in for the live risk calculation and counts how often it runs."""
+    calls = []
+    def compute(holdings):
+        calls.append(dict(holdings))
+        value = float(sum(holdings.values()))
+        return {
+            "total_market_value": value,
+            "var": value / 10,
+            "es": value / 8,
+            "market_values_per_stock": dict(holdings),
+            "pl_histogram": {"bin_edges": [-1.0, 0.0, 1.0], "counts": [1, 1]},
+            "confidence_level": 0.95,
+        }
+    compute.calls = calls
+    return compute
+
+def test_holdings_fingerprint_is_stable():
+    """Test that the hash ignores key order, int/float and empty positions."""
+    assert holdings_fingerprint({'AAPL': 10, 'MSFT': 5}) == holdings_fingerprint({'MSFT': 5.0, 'AAPL': 10, 'TSLA': 0})
+    assert holdings_fingerprint({'AAPL': 10}) != holdings_fingerprint({'AAPL': 11})
+    with pytest.raises(ValueError):
+        holdings_fingerprint({'AAPL': 0})
+
+def test_save_portfolio_replaces_by_name(db):
+    """Test that saving under an existing name updates that portfolio."""
+    first = save_portfolio(db, 'Tech', {'AAPL': 10})
+    second = save_portfolio(db, 'Tech', {'AAPL': 20})
+
+    assert first.id == second.id
+    assert [p.name for p in list_portfolios(db)] == ['Tech']
+    assert second.holdings == {'AAPL': 20.0}
+    with pytest.raises(ValueError):
+        save_portfolio(db, ' ', {'AAPL': 10})
+
+def test_save_portfolio_needs_a_name(db):
+    """Test that a missing or non-string name is a ValueError rather than an AttributeError."""
+    for name in [None, '', '  ', 5]:
+        with pytest.raises(ValueError, match="name"):
+            save_portfolio(db, name, {'AAPL': 10})
+
+def test_snapshot_is_reused_until_holdings_change(db, fake_compute):
+    """Test that a stored snapshot is served without recomputing, and edits fall back to live."""
+    portfolio = save_portfolio(db, 'Tech', {'AAPL': 10, 'MSFT': 5})
+
+    # No snapshot yet: computed live, and reading never stores anything.
+    first = get_portfolio_risk(db, portfolio, compute=fake_compute)
+    assert first['source'] == 'live'
+    assert db.query(RiskSnapshot).count() == 0
+
+    # Once the nightly job has stored one, same holdings are served from it.
+    store_snapshot(db, portfolio, fake_compute(portfolio.holdings))
+    second = get_portfolio_risk(db, portfolio, holdings={'MSFT': 5, 'AAPL': 10}, compute=fake_compute)
+    assert second['source'] == 'snapshot'
+    assert second['var'] == first['var']
+    assert len(fake_compute.calls) == 2
+
+    # Unsaved edits: computed live, nothing stored.
+    edited = get_portfolio_risk(db, portfolio, holdings={'AAPL': 20}, compute=fake_compute)
+    assert edited['source'] == 'live'
+    assert edited['total_market_value'] == 20.0
+    assert db.query(RiskSnapshot).count() == 1
+
+    # Saved edits make the old snapshot stale until the next nightly run.
+    save_portfolio(db, 'Tech', {'AAPL': 20})
+    assert get_portfolio_risk(db, portfolio, compute=fake_compute)['source'] == 'live'
+    assert get_portfolio_risk(db, portfolio, compute=fake_compute)['source'] == 'live'
+    assert db.query(RiskSnapshot).count() == 1
+
+def test_store_snapshot_prunes_old_ones(db, fake_compute):
+    """Test that only the latest snapshots are kept for each portfolio."""
+    from datetime import datetime, timedelta
+    tech = save_portfolio(db, 'Tech', {'AAPL': 10})
+    other = save_portfolio(db, 'Other', {'MSFT': 5})
+    store_snapshot(db, other, fake_compute(other.holdings))
+    start = datetime(2026, 1, 1)
+    for day in range(5):
+        store_snapshot(db, tech, fake_compute({'AAPL': 10 + day}), as_of=start + timedelta(days=day), keep=3)
+
+    kept = db.query(RiskSnapshot).filter(RiskSnapshot.portfolio_id == tech.id).order_by(RiskSnapshot.as_of).all()
+    assert [s.as_of.day for s in kept] == [3, 4, 5]
+    assert db.query(RiskSnapshot).filter(RiskSnapshot.portfolio_id == other.id).count() == 1
+
+def test_generate_snapshots_writes_every_portfolio(db, fake_compute):
+    """Test that the nightly job stores a snapshot per saved portfolio and skips failures."""
+    from unittest.mock import patch
+    import automate_report
+    save_portfolio(db, 'Tech', {'AAPL': 10})
+    save_portfolio(db, 'Broken', {'ZZZ': 1})
+
+    def compute(holdings):
+        if 'ZZZ' in holdings:
+            raise ValueError("no market data")
+        return fake_compute(holdings)
+
+    with patch.object(automate_report, 'SessionLocal', return_value=db), patch.object(db, 'close'):
+        assert automate_report.generate_snapshots(compute=compute) == 1
+
+    tech = list_portfolios(db)[1]
+    assert tech.name == 'Tech'
+    assert get_portfolio_risk(db, tech, compute=compute)['source'] == 'snapshot'
+
+def test_generate_firm_rollup_covers_saved_portfolios(db, tmp_path, monkeypatch):
+    """Test that the nightly job rolls up every saved portfolio in one batch and writes a CSV."""
+    import pandas as pd
+    from unittest.mock import MagicMock, patch
+    import automate_report
+    save_portfolio(db, 'Tech', {'AAPL': 10})
+    save_portfolio(db, 'Search', {'GOOG': 4})
+    monkeypatch.setattr(automate_report, 'REPORT_OUTPUT_DIR', str(tmp_path))
+    rollup_df = pd.DataFrame({'market_value': [1.0]}, index=pd.MultiIndex.from_tuples([('Firm total', 'NYSE')], names=['portfolio', 'group']))
+    rollup = MagicMock(return_value=rollup_df)
+
+    with patch.object(automate_report, 'SessionLocal', return_value=db), patch.object(db, 'close'):
+        automate_report.generate_firm_rollup(rollup=rollup)
+
+    rollup.assert_called_once_with({'Search': {'GOOG': 4.0}, 'Tech': {'AAPL': 10.0}}, group_by='listing_exchange')
+    assert (tmp_path / 'firm_rollup.csv').read_text().startswith('portfolio,group,market_value')
+
+def test_generate_portfolio_scores_covers_saved_portfolios(db, tmp_path, monkeypatch):
+    """Test that the nightly job hands every saved portfolio to the scoring coordinator and writes a CSV."""
+    import pandas as pd
+    from unittest.mock import MagicMock, patch
+    import automate_report
+    save_portfolio(db, 'Tech', {'AAPL': 10})
+    monkeypatch.setattr(automate_report, 'REPORT_OUTPUT_DIR', str(tmp_path))
+    score = MagicMock(return_value=pd.DataFrame({'var': [1.0]}, index=pd.Index(['Tech'], name='id')))
+
+    with patch.object(automate_report, 'SessionLocal', return_value=db), patch.object(db, 'close'):
+        automate_report.generate_portfolio_scores(score=score)
+
+    score.assert_called_once_with([{'id': 'Tech', 'holdings': {'AAPL': 10.0}}])
+    assert (tmp_path / 'portfolio_scores.csv').read_text().startswith('id,var')
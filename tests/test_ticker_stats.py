@@ -0,0 +1,111 @@
+import pytest
+import pandas as pd
+import numpy as np
+from src.ticker_stats import compute_ticker_stats, read_close_prices
+
+@pytest.fixture
+def closes():
+    """Three tickers: a long history, a late starter and one that stopped trading early."""
+    rng = np.random.default_rng(11)
+    dates = pd.bdate_range('2018-01-01', periods=600)
+    data = pd.DataFrame(
+        100 * np.cumprod(1 + rng.normal(0, 0.015, size=(600, 3)), axis=0),
+        index=dates, columns=['LONG', 'LATE', 'GONE']
+    )
+    data.iloc[:450, 1] = np.nan
+    data.iloc[500:, 2] = np.nan
+    return data
+
+def reference_stats(series: pd.Series, market: pd.Series):
+    """Straightforward per-ticker pandas version of the same statistics."""
+    series = series.dropna()
+    returns = series.pct_change().dropna().iloc[-252:]
+    market = market.reindex(returns.index)
+    return {
+        'volatility': returns.std() * np.sqrt(252),
+        'beta': returns.cov(market) / market.var(),
+        'max_drawdown': (series / series.cummax() - 1).min(),
+        'return_1m': series.iloc[-1] / series.iloc[-22] - 1,
+        'last_close': series.iloc[-1],
+    }
+
+def test_stats_match_per_ticker_calculation(closes):
+    """Test the vectorized stats against a one-ticker-at-a-time pandas calculation."""
+    stats = compute_ticker_stats(closes, benchmark='LONG')
+    market = closes['LONG'].pct_change()
+
+    for ticker in ['LATE', 'GONE']:
+        expected = reference_stats(closes[ticker], market)
+        for metric, value in expected.items():
+            assert np.isclose(stats.loc[ticker, metric], value), (ticker, metric)
+
+    assert stats.loc['GONE', 'last_date'] == closes.index[499].date()
+    assert stats.loc['LONG', 'beta'] == pytest.approx(1.0)
+    # The late starter only has 150 days of prices, so no 1-year return.
+    assert np.isnan(stats.loc['LATE', 'return_1y'])
+    assert stats.loc['LATE', 'n_days'] == 150
+
+def test_default_benchmark_is_equal_weighted(closes):
+    """Test that beta falls back to an equal-weighted market when the benchmark is missing."""
+    stats = compute_ticker_stats(closes, benchmark='SPY')
+    assert stats['beta'].notna().all()
+
+def test_bad_prints_are_ignored(closes):
+    """Test that near-zero closes and short-lived spikes don't blow up any statistic."""
+    clean = compute_ticker_stats(closes, benchmark='LONG')
+    spiked = closes.copy()
+    spiked.iloc[580, 0] = 0.0001  # One bad print in the benchmark...
+    spiked.iloc[300, 2] = 0.0     # ...a zero close in another ticker...
+    spiked.iloc[540, 0] *= 10     # ...a one-day 10x spike...
+    spiked.iloc[520:522, 1] /= 10 # ...and a two-day crash that recovers.
+
+    stats = compute_ticker_stats(spiked, benchmark='LONG')
+    metrics = ['volatility', 'beta', 'max_drawdown', 'return_1m', 'return_3m', 'return_1y']
+    for metric in metrics:
+        # Dropping the bad days moves the numbers a little, not by orders of magnitude.
+        assert np.allclose(stats[metric], clean[metric], rtol=0.1, atol=0.01, equal_nan=True), metric
+    assert stats.loc['LONG', 'n_days'] == 598
+
+    # The bad prints are treated exactly like missing closes.
+    missing = closes.copy()
+    missing.iloc[[540, 580], 0] = np.nan
+    missing.iloc[300, 2] = np.nan
+    missing.iloc[520:522, 1] = np.nan
+    pd.testing.assert_frame_equal(stats, compute_ticker_stats(missing, benchmark='LONG'))
+
+def test_lasting_jumps_are_kept(closes):
+    """Test that a move outside the daily bounds that doesn't reverse is kept as a new price level."""
+    jumped = closes.copy()
+    jumped.iloc[590:, 0] *= 5
+
+    stats = compute_ticker_stats(jumped, benchmark='LONG')
+    assert stats.loc['LONG', 'last_close'] == jumped['LONG'].iloc[-1]
+    assert stats.loc['LONG', 'n_days'] == 600
+
+def test_short_and_absurd_histories_are_null():
+    """Test that too few returns or out-of-range results come back as NaN instead of huge numbers."""
+    dates = pd.bdate_range('2020-01-01', periods=300)
+    closes = pd.DataFrame({
+        'NEW': np.r_[np.full(270, np.nan), np.linspace(10, 11, 30)],
+        'PUMP': np.geomspace(0.02, 100.0, 300),
+    }, index=dates)
+
+    stats = compute_ticker_stats(closes)
+    assert np.isnan(stats.loc['NEW', 'volatility']) and np.isnan(stats.loc['NEW', 'beta'])
+    assert stats.loc['NEW', 'return_1m'] == pytest.approx(11 / closes['NEW'].iloc[-22] - 1)
+    # A 5000x rise in a year is a data problem, not a screenable return.
+    assert np.isnan(stats.loc['PUMP', 'return_1y'])
+    assert np.isfinite(stats.loc['PUMP', 'return_1m'])
+
+def test_read_close_prices(tmp_path):
+    """Test reading CSVs from stock and ETF folders into one wide frame."""
+    (tmp_path / 'stocks').mkdir()
+    (tmp_path / 'etfs').mkdir()
+    (tmp_path / 'stocks' / 'AAA.csv').write_text("Date,Open,Close\n2020-01-02,1,10\n2020-01-03,1,11\n")
+    (tmp_path / 'etfs' / 'EEE.csv').write_text("Date,Open,Close\n2020-01-03,1,20\n")
+
+    closes, etfs = read_close_prices([str(tmp_path / 'stocks'), str(tmp_path / 'etfs')])
+
+    assert list(closes.columns) == ['AAA', 'EEE']
+    assert etfs == {'EEE'}
+    assert np.isnan(closes.loc['2020-01-02', 'EEE'])